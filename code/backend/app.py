@@ -1,17 +1,50 @@
 from flask import Flask, request, jsonify
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from google.cloud import firestore, storage
+from google.cloud import firestore
 import os
 from dotenv import load_dotenv
 import re
 import pandas as pd
+import pyarrow as pa
 from io import BytesIO
 import jwt
 import datetime
-from functools import wraps
+import time
+from functools import wraps, partial
+from contextlib import contextmanager, nullcontext, ExitStack
 from flask_cors import CORS
 import uuid
-import bcrypt  
+import json
+import hashlib
+from google.api_core.exceptions import NotFound, Conflict
+from dataset_cache import dataset_cache
+from blob_cache import blob_cache
+from user_cache import user_cache
+from manifest import build_manifest, build_manifest_from_parquet, build_manifest_from_schema, describe_frame, manifest_for
+from compact import compact_frame, memory_bytes, read_options, append_options
+from compression import storage_codec, sniff_stream, open_text, decompressing, compressed, set_encoding
+from columnar import working_copy_name, is_columnar, write_parquet, read_parquet, read_row_groups
+from zone_maps import prune_row_groups
+from commands import parse_command
+from engines import EngineFallback, select_engine, duckdb_engine
+from plan import plan_step, plan_schema, validate_filter, filter_predicate, compile_plan, required_columns, execute_plan
+from predicates import predicate_mask
+from ingest import UploadInspector, TeeReader
+from jobs import job_queue, report_progress, record_metrics, run_periodically
+from blob_store import create_storage_client, delete_blobs, storage_calls
+from telemetry import span, traced, annotate, start_request, end_request, latency_histograms, cpu_histograms, render_counter
+from passwords import password_hasher, PasswordBusy
+from transfers import upload_file
+from io_pool import PIPELINED_UPLOAD_MIN_BYTES, submit_io, pipelined_upload
+from streaming import (
+    STREAMING_MIN_BYTES, STREAMING_CHUNK_BYTES, use_streaming, stream_plan, count_plan_rows_streaming, stream_export,
+    profile_plan_streaming
+)
+from profiling import DatasetProfile, profile_name, format_profile
+from segments import (
+    segment_name, dataset_segments, part_names, dataset_version, check_segment, append_segment, replace_segments,
+    segment_blobs, compaction_run, read_parts
+)
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -32,13 +65,96 @@ login_manager.login_view = "login"
 
 # Initialize Firestore and Cloud Storage
 firestore_client = firestore.Client()
-storage_client = storage.Client()
+storage_client = create_storage_client()
+
+# Let users registered before email lookup documents existed log in through a query until
+# `backfill_email_lookups` has run; off by default, since it queries for every unknown email
+EMAIL_LOOKUP_FALLBACK = os.getenv("EMAIL_LOOKUP_FALLBACK", "false").lower() == "true"
+# How often users whose bucket was never created are looked for and provisioned; 0 disables it
+STORAGE_RECONCILE_SECONDS = int(os.getenv("STORAGE_RECONCILE_SECONDS", "300"))
+
+# Every request runs inside a root span; the phases below are recorded as its children
+@app.before_request
+def start_request_span():
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    request.telemetry = start_request(request.method, route)
+
+@app.after_request
+def record_status_code(response):
+    request.status_code = response.status_code
+    return response
+
+@app.teardown_request
+def end_request_span(exc):
+    handle = getattr(request, 'telemetry', None)
+    if handle is not None:
+        end_request(handle, getattr(request, 'status_code', 500 if exc else None))
 
 def sanitize_bucket_name(name):
     unique_id = str(uuid.uuid4())[:8]  # Generate a short unique ID
     sanitized_name = re.sub(r'[^a-z0-9-]', '-', name.lower().strip('-'))[:55]  # Adjust length for ID
     return f"{sanitized_name}-{unique_id}"
 
+def get_user(user_id):
+    """
+    User document as a dict (None if it does not exist), served from the user cache when fresh.
+    """
+    user_data = user_cache.get(user_id)
+    if user_data is None:
+        with span("firestore.get_user"):
+            user_data = firestore_client.collection('users').document(user_id).get().to_dict()
+        if user_data is not None:
+            user_cache.put(user_id, user_data)
+    return user_data
+
+def email_key(email):
+    """Id of an email's lookup document; hashed, since an email may hold characters ids cannot."""
+    return hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()
+
+def find_user_id(email):
+    """
+    Id of the user registered with `email`, or None, read from the email's
+    lookup document with a single GET instead of a query over all users.
+    """
+    with span("firestore.get_email"):
+        lookup = firestore_client.collection('emails').document(email_key(email)).get()
+    return lookup.to_dict()['user_id'] if lookup.exists else None
+
+def find_legacy_user_id(email):
+    """
+    Id of a user registered before email lookup documents existed, found with
+    a query over all users. Only used by /login while EMAIL_LOOKUP_FALLBACK is set.
+    """
+    with span("firestore.find_user"):
+        users = firestore_client.collection('users').where('email', '==', email).get()
+    return users[0].id if users else None
+
+def backfill_email_lookups():
+    """
+    Create the missing email lookup documents of existing users; run once after deploying them, e.g.
+    `python -c "import app; app.backfill_email_lookups()"`. Returns how many were created.
+    """
+    created = 0
+    for user in firestore_client.collection('users').stream():
+        email = user.to_dict().get('email')
+        if not email:
+            continue
+        try:
+            firestore_client.collection('emails').document(email_key(email)).create({'user_id': user.id, 'email': email})
+            created += 1
+        except Conflict:
+            pass
+    print(f"Created {created} email lookup documents")
+    return created
+
+def update_user(user_id, fields):
+    """
+    Single write path for user documents: updates Firestore, then the cached copy.
+    """
+    with span("firestore.update_user", fields=",".join(sorted(fields))):
+        firestore_client.collection('users').document(user_id).update(fields)
+    user_cache.apply(user_id, fields)
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -61,6 +177,20 @@ def token_required(f):
 
     return decorated
 
+def count_storage_calls(f):
+    """
+    Record how many storage API round-trips a request or job made, on its span and on the running job.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        with storage_calls.track() as calls:
+            result = f(*args, **kwargs)
+        record_metrics(storage_calls=dict(calls))
+        annotate(storage_calls=sum(calls.values()), **{f"storage_calls.{kind}": count for kind, count in calls.items()})
+        return result
+
+    return decorated
+
 # User model
 class User(UserMixin):
     def __init__(self, id, email):
@@ -72,9 +202,8 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    user_doc = firestore_client.collection('users').document(user_id).get()
-    if user_doc.exists:
-        data = user_doc.to_dict()
+    data = get_user(user_id)
+    if data:
         return User(id=user_id, email=data['email'])
     return None
 
@@ -83,6 +212,7 @@ def unauthorized():
     return jsonify({"message": "User is not authenticated"}), 401
 
 @app.route('/signup', methods=['POST'])
+@count_storage_calls
 def signup():
     data = request.json
     name, email, password = data.get('name'), data.get('email'), data.get('password')
@@ -92,56 +222,112 @@ def signup():
     if not re.match(email_regex, email):
         return jsonify({"message": "Invalid email format. Please provide a valid email address."}), 400
 
-    # Check if user already exists
-    users_ref = firestore_client.collection('users')
-    existing_user = users_ref.where('email', '==', email).get()
-    if existing_user:
-        return jsonify({"message": "User already exists"}), 400
-
-    # Hash the password
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    # Hash the password on the bcrypt pool
+    try:
+        hashed_password = password_hasher.hash(password)
+    except PasswordBusy:
+        return jsonify({"message": "The server is busy. Please try again."}), 503, {"Retry-After": "1"}
 
     # Create a unique bucket name
     sanitized_bucket_name = sanitize_bucket_name(f"{name}-bucket")
 
-    # Store user data in Firestore
-    user_doc = users_ref.document()
+    # Claim the email and store the user in one atomic write; the `create` fails,
+    # and nothing is written, if the email is registered already, even concurrently
+    user_doc = firestore_client.collection('users').document()
     user_id = user_doc.id
-    user_doc.set({
+    batch = firestore_client.batch()
+    batch.create(firestore_client.collection('emails').document(email_key(email)), {'user_id': user_id, 'email': email})
+    batch.set(user_doc, {
         'name': name,
         'email': email,
-        'password': hashed_password.decode('utf-8'),  # Store as a string
+        'password': hashed_password,  # Store as a string
         'bucket': sanitized_bucket_name,
+        # The bucket is created in the background; see `provision_storage`
+        'bucket_ready': False,
         'id': user_id
     })
-
-    # Create a GCP bucket for the user
     try:
-        bucket = storage_client.create_bucket(sanitized_bucket_name)
-        bucket.storage_class = "STANDARD"
-        bucket.update()
-        print(f"{sanitized_bucket_name} created.")
-    except Exception as e:
-        print(f"Error creating bucket: {e}")
-        return jsonify({"message": "Failed to create bucket"}), 500
+        with span("firestore.create_user"):
+            batch.commit()
+    except Conflict:
+        return jsonify({"message": "User already exists"}), 400
 
+    job_queue.submit(user_id, "provision storage", provision_storage, user_id)
     return jsonify({"message": "User registered successfully", "bucket": sanitized_bucket_name}), 201
 
+@traced("provision")
+def provision_storage(user_id):
+    """
+    Create the user's bucket unless it exists already.
+
+    Runs as a background job after signup, from the reconciler for users whose
+    job never finished, and from the first upload if neither got there yet.
+    Creating a bucket that exists counts as success, so these may overlap.
+    Returns the response body and status code.
+    """
+    with user_cache.lock(user_id):
+        user_data = get_user(user_id)
+        if user_data is None:
+            return {"message": "User not found."}, 404
+        bucket_name = user_data.get('bucket')
+        # Users registered before provisioning was deferred have no flag and a bucket
+        if user_data.get('bucket_ready', True):
+            return {"message": "Storage is ready.", "bucket": bucket_name}, 200
+
+        # The storage class is sent with the create request rather than patched afterwards
+        bucket = storage_client.bucket(bucket_name)
+        bucket.storage_class = "STANDARD"
+        try:
+            with span("gcs.create_bucket"):
+                storage_client.create_bucket(bucket)
+            print(f"{bucket_name} created.")
+        except Conflict:
+            print(f"{bucket_name} already exists.")
+        update_user(user_id, {'bucket_ready': True})
+    return {"message": "Storage is ready.", "bucket": bucket_name}, 201
+
+def user_bucket(user_id, user_data):
+    """Name of the user's bucket, created first if provisioning has not finished yet."""
+    if user_data.get('bucket') and not user_data.get('bucket_ready', True):
+        provision_storage(user_id)
+    return user_data.get('bucket')
+
+def reconcile_storage():
+    """Queue provisioning for every user whose bucket has not been created."""
+    with span("firestore.find_unprovisioned"):
+        users = firestore_client.collection('users').where('bucket_ready', '==', False).get()
+    for user in users:
+        job_queue.submit(user.id, "provision storage", provision_storage, user.id)
+    if users:
+        print(f"Queued storage provisioning for {len(users)} users")
+    return len(users)
+
 @app.route('/login', methods=['POST'])
 def login():
     data = request.json
     email, password = data.get('email'), data.get('password')
     
-    # Retrieve user from Firestore
-    user_doc = firestore_client.collection('users').where('email', '==', email).get()
-    if user_doc:
-        user_data = user_doc[0].to_dict()
-        
-        # Compare hashed password with user-provided password
-        if bcrypt.checkpw(password.encode('utf-8'), user_data['password'].encode('utf-8')):
+    # Resolve the user through the email's lookup document, then read it through the user cache
+    user_id = find_user_id(email)
+    if user_id is None and EMAIL_LOOKUP_FALLBACK:
+        user_id = find_legacy_user_id(email)
+    user_data = get_user(user_id) if user_id is not None else None
+    if user_data:
+        # Compare hashed password with user-provided password, on the bcrypt pool
+        try:
+            password_matches = password_hasher.check(password, user_data['password'])
+        except PasswordBusy:
+            return jsonify({"message": "The server is busy. Please try again."}), 503, {"Retry-After": "1"}
+        if password_matches:
+            if password_hasher.needs_rehash(user_data['password']):
+                # BCRYPT_ROUNDS changed since this hash was made; the password is at hand, so upgrade it
+                try:
+                    update_user(user_id, {'password': password_hasher.hash(password)})
+                except PasswordBusy:
+                    pass
             # Generate JWT token
             token = jwt.encode(
-                {"user_id": user_doc[0].id, "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=1)},
+                {"user_id": user_id, "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=1)},
                 app.secret_key, algorithm="HS256"
             )
             return jsonify({"message": "Login successful", "token": token}), 200
@@ -159,89 +345,120 @@ def logout():
 
 @app.route('/home', methods=['POST'])
 @token_required
+@count_storage_calls
 def upload_dataset():
     if 'file' not in request.files or 'file_type' not in request.form:
         return jsonify({"message": "File and file type are required"}), 400
 
     file, file_type = request.files['file'], request.form.get('file_type').lower()
-    user_ref = firestore_client.collection('users').document(request.user_id)
-    user_data = user_ref.get().to_dict()
-    user_bucket_name = user_data.get('bucket')
+    user_data = get_user(request.user_id)
+    try:
+        user_bucket_name = user_bucket(request.user_id, user_data)
+    except Exception as e:
+        print(f"Error creating bucket: {e}")
+        return jsonify({"message": "Storage is not ready yet. Please try again."}), 503, {"Retry-After": "5"}
 
     if not user_bucket_name:
         return jsonify({"message": "User bucket not found"}), 400
 
     filename = file.filename
     try:
+        if request.form.get('mode') == 'append':
+            body, status_code = append_upload(request.user_id, user_data, file.stream, file_type, request.content_length)
+            return jsonify(body), status_code
+
         # Check if a dataset already exists
         existing_dataset = user_data.get('dataset')
-        bucket = storage_client.get_bucket(user_bucket_name)
-
-        # If an existing dataset exists, delete it
-        if existing_dataset:
-            existing_blob = bucket.blob(existing_dataset)
-            if existing_blob.exists():
-                existing_blob.delete()
-                print(f"Deleted existing dataset: {existing_dataset}")
-
-        # Upload the new dataset
-        blob = bucket.blob(filename)
-        blob.upload_from_file(file)
-        print(f"Uploaded new dataset: {filename}")
 
-        # Verify the dataset structure
-        file_path = f"/tmp/{filename}"
-        blob.download_to_filename(file_path)
+        # Upload, verify and convert the new dataset in one pass; the original is kept for download
         delimiter = ',' if file_type == 'csv' else '\t'
-        pd.read_csv(file_path, delimiter=delimiter, nrows=5)
+        manifest = ingest_upload(user_bucket_name, filename, file.stream, delimiter, size_hint=request.content_length)
+        print(f"Uploaded new dataset: {filename}")
 
-        # Update Firestore with the new dataset information
-        user_ref.update({'dataset': filename, 'file_type': file_type})
+        # Once the new dataset is in place, Firestore is updated and then the existing one is deleted
+        cleanup = []
+        if existing_dataset and existing_dataset != filename:
+            cleanup.append(partial(delete_dataset, user_bucket_name, existing_dataset, user_data.get('manifest')))
+        elif dataset_segments(user_data.get('manifest')):
+            # The upload overwrote the base working copy; the old segments are left over
+            cleanup.append(partial(delete_segments, user_bucket_name, dataset_segments(user_data.get('manifest'))))
+        with user_cache.lock(request.user_id):
+            update_user(request.user_id, {
+                'dataset': filename,
+                'file_type': file_type,
+                'manifest': manifest,
+                # Pending transformations belong to the dataset being replaced
+                'updated_dataset': None,
+                'updated_manifest': None,
+                'plan': []
+            })
+        # Only deleted once Firestore no longer points at it; a failed update keeps the old dataset usable
+        for delete in cleanup:
+            delete()
+        if cleanup:
+            print(f"Deleted existing dataset: {existing_dataset}")
         return jsonify({"message": "File uploaded successfully", "dataset": filename}), 201
 
+    except ValueError as ve:
+        return jsonify({"message": f"Invalid dataset: {ve}"}), 400
     except Exception as e:
         print(f"Error uploading file: {e}")
         return jsonify({"message": f"Failed to upload dataset: {e}"}), 500
 
 @app.route('/replace-dataset', methods=['POST'])
 @token_required
+@count_storage_calls
 def replace_dataset():
     if 'file' not in request.files or 'file_type' not in request.form:
         return jsonify({"message": "File and file type are required"}), 400
 
     file, file_type = request.files['file'], request.form.get('file_type').lower()
-    user_ref = firestore_client.collection('users').document(request.user_id)
-    user_data = user_ref.get().to_dict()
-    user_bucket_name = user_data.get('bucket')
+    user_data = get_user(request.user_id)
+    try:
+        user_bucket_name = user_bucket(request.user_id, user_data)
+    except Exception as e:
+        print(f"Error creating bucket: {e}")
+        return jsonify({"message": "Storage is not ready yet. Please try again."}), 503, {"Retry-After": "5"}
 
     if not user_bucket_name:
         return jsonify({"message": "User bucket not found"}), 400
 
     filename = file.filename
     try:
-        # Replace the existing dataset
-        bucket = storage_client.get_bucket(user_bucket_name)
-
-        # Delete existing dataset if any
-        existing_dataset = user_data.get('dataset')
-        if existing_dataset:
-            bucket.blob(existing_dataset).delete()
-
-        # Upload new dataset
-        blob = bucket.blob(filename)
-        blob.upload_from_file(file)
-        file_path = f"/tmp/{filename}"
-        blob.download_to_filename(file_path)
+        if request.form.get('mode') == 'append':
+            body, status_code = append_upload(request.user_id, user_data, file.stream, file_type, request.content_length)
+            return jsonify(body), status_code
 
-        # Validate file structure
+        # Upload new dataset, validating and converting it in the same pass
         delimiter = ',' if file_type == 'csv' else '\t'
-        pd.read_csv(file_path, delimiter=delimiter, nrows=5)
+        manifest = ingest_upload(user_bucket_name, filename, file.stream, delimiter, size_hint=request.content_length)
 
-        # Update Firestore
-        user_ref.update({'dataset': filename, 'file_type': file_type})
+        # Update Firestore, then delete the existing dataset, if any
+        existing_dataset = user_data.get('dataset')
+        cleanup = []
+        if existing_dataset and existing_dataset != filename:
+            cleanup.append(partial(delete_dataset, user_bucket_name, existing_dataset, user_data.get('manifest')))
+        elif dataset_segments(user_data.get('manifest')):
+            # The upload overwrote the base working copy; the old segments are left over
+            cleanup.append(partial(delete_segments, user_bucket_name, dataset_segments(user_data.get('manifest'))))
+        with user_cache.lock(request.user_id):
+            update_user(request.user_id, {
+                'dataset': filename,
+                'file_type': file_type,
+                'manifest': manifest,
+                # Pending transformations belong to the dataset being replaced
+                'updated_dataset': None,
+                'updated_manifest': None,
+                'plan': []
+            })
+        # Only deleted once Firestore no longer points at it; a failed update keeps the old dataset usable
+        for delete in cleanup:
+            delete()
 
         return jsonify({"message": "Dataset replaced successfully!"}), 200
 
+    except ValueError as ve:
+        return jsonify({"message": f"Invalid dataset: {ve}"}), 400
     except Exception as e:
         print(f"Error replacing dataset: {e}")
         return jsonify({"message": f"Failed to replace dataset: {e}"}), 500
@@ -250,8 +467,7 @@ def replace_dataset():
 @token_required
 def dataset_status():
     try:
-        user_ref = firestore_client.collection('users').document(request.user_id)
-        user_data = user_ref.get().to_dict()
+        user_data = get_user(request.user_id)
 
         if not user_data:
             return jsonify({"datasetExists": False, "name": None}), 200
@@ -264,19 +480,579 @@ def dataset_status():
         print(f"Error in dataset_status: {e}")
         return jsonify({"message": f"Failed to check dataset status."}), 500
 
-def load_dataset(bucket_name, dataset_name, delimiter=','):
+@traced("load_dataset")
+def load_dataset(bucket_name, dataset_name, delimiter=',', columns=None, columnar=False, row_groups=None, dtypes=None,
+                 segments=None):
+    """
+    Load a dataset, reading only `columns` when given.
+
+    Columnar datasets are read from their Parquet working copy; datasets
+    uploaded before working copies existed are parsed from the original file.
+    When `row_groups` is given and the dataset is not cached, only those row
+    groups of the working copy are fetched. Full downloads go through the
+    on-disk blob cache. Text files are parsed with the recorded `dtypes`, when
+    given, instead of inferring them again. The working copies of appended
+    `segments` are read after the base one, as a single frame.
+    """
     bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(dataset_name)
-    file_path = f"/tmp/{dataset_name}"
-    blob.download_to_filename(file_path)
-    return pd.read_csv(file_path, delimiter=delimiter)
+    blob_name = working_copy_name(dataset_name) if columnar else dataset_name
+    # Metadata GET only; the generation tells us whether a cached frame is still current
+    with span("gcs.get_metadata"):
+        blob = bucket.get_blob(blob_name)
+    if blob is None:
+        raise FileNotFoundError(f"Dataset '{dataset_name}' not found.")
+    annotate(dataset=dataset_name, format="parquet" if columnar else "text", bytes=blob.size)
+
+    # A segmented dataset is current while none of its parts has changed
+    version = (blob.generation, *(segment['generation'] for segment in segments)) if segments else blob.generation
+    df = dataset_cache.get(bucket_name, dataset_name, version)
+    if df is not None:
+        annotate(cache="hit", rows=len(df), columns=len(df.columns))
+        return df if columns is None else df[columns]
+
+    if columnar and row_groups is not None:
+        with blob.open("rb", chunk_size=STREAMING_CHUNK_BYTES) as source:
+            df = read_row_groups(source, row_groups, columns=columns)
+        annotate(cache="miss", row_groups=len(row_groups), rows=len(df), columns=len(df.columns))
+        return df
+
+    if segments:
+        with stage_parts(bucket_name, dataset_name, segments, blob) as file_paths, span("parse", parts=len(file_paths)):
+            df = read_parts(file_paths, columns=columns)
+    else:
+        with blob_cache.open(bucket_name, blob_name, blob) as file_path:
+            with span("parse"):
+                if columnar:
+                    df = read_parquet(file_path, columns=columns)
+                else:
+                    df = read_text(file_path, delimiter, columns, dtypes)
+    annotate(cache="miss", rows=len(df), columns=len(df.columns))
+
+    # Only complete frames are cached; a projection is useless to the next command
+    if columns is None:
+        dataset_cache.put(bucket_name, dataset_name, version, df)
+    return df
 
+def read_text(file_path, delimiter, columns=None, dtypes=None):
+    """Parse a CSV/TSV file, decompressing it on the fly when it is gzip or zstd compressed."""
+    if dtypes:
+        try:
+            with open_text(file_path) as source:
+                return pd.read_csv(source, delimiter=delimiter, usecols=columns, **read_options(dtypes))
+        except (ValueError, TypeError) as e:
+            # The file no longer matches the recorded schema
+            print(f"Recorded dtypes do not apply to {file_path}, inferring them: {e}")
+    with open_text(file_path) as source:
+        return pd.read_csv(source, delimiter=delimiter, usecols=columns)
+
+@traced("save_dataset")
 def save_dataset(bucket_name, dataset_name, dataframe):
+    """
+    Write the columnar working copy of a dataset and return its manifest.
+
+    CSV/TSV is only produced by `export_dataset`. Large frames are uploaded
+    while they are encoded instead of after; small ones are encoded into memory
+    and uploaded from that buffer, so no file is written and read back.
+    """
+    bucket = storage_client.bucket(bucket_name)
+    blob_name = working_copy_name(dataset_name)
+    blob = bucket.blob(blob_name)
+    annotate(dataset=dataset_name, rows=len(dataframe), columns=len(dataframe.columns))
+
+    if int(dataframe.memory_usage(deep=False).sum()) >= PIPELINED_UPLOAD_MIN_BYTES:
+        with span("serialize", format="parquet", pipelined=True), pipelined_upload(blob) as target:
+            metadata = write_parquet(dataframe, target)
+            annotate(bytes=target.tell())
+        # The resumable upload does not report the new generation
+        blob.reload()
+    else:
+        buffer = pa.BufferOutputStream()
+        with span("serialize", format="parquet"):
+            metadata = write_parquet(dataframe, buffer)
+        data = buffer.getvalue()
+        with span("gcs.upload", bytes=data.size):
+            blob.upload_from_file(pa.BufferReader(data), size=data.size)
+        blob_cache.put(bucket_name, blob_name, blob, data)
+
+    # The upload response carries the new generation, so the frame we just wrote is the current one
+    dataset_cache.invalidate(bucket_name, dataset_name)
+    dataset_cache.put(bucket_name, dataset_name, blob.generation, dataframe)
+    return build_manifest(dataframe, blob, metadata)
+
+@contextmanager
+def stage_dataset(bucket_name, dataset_name, segments=None):
+    """
+    Local path of a dataset's working copy for an out-of-core engine.
+
+    The copy comes from the blob cache when it is current, so staging an
+    unchanged dataset again costs a metadata GET instead of a download. A
+    dataset with appended `segments` is staged as the list of its parts' paths.
+    """
+    if segments:
+        with stage_parts(bucket_name, dataset_name, segments) as file_paths:
+            yield file_paths
+        return
+    blob_name = working_copy_name(dataset_name)
+    blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise FileNotFoundError(f"Dataset '{dataset_name}' not found.")
+    with blob_cache.open(bucket_name, blob_name, blob) as source_path:
+        yield source_path
+
+@contextmanager
+def stage_parts(bucket_name, dataset_name, segments, blob=None):
+    """
+    Local paths of the working copies of a dataset and its segments, in row order.
+
+    Their metadata GETs run concurrently; `blob`, when given, is the base
+    working copy already looked up by the caller.
+    """
+    bucket = storage_client.bucket(bucket_name)
+    names = part_names(dataset_name, segments)
+    lookups = [submit_io(bucket.get_blob, name) for name in (names[1:] if blob is not None else names)]
+    blobs = ([blob] if blob is not None else []) + [lookup.result() for lookup in lookups]
+    if any(part is None for part in blobs):
+        raise FileNotFoundError(f"A part of dataset '{dataset_name}' is missing.")
+    with ExitStack() as stack:
+        yield [stack.enter_context(blob_cache.open(bucket_name, name, part)) for name, part in zip(names, blobs)]
+
+@contextmanager
+def open_parts(bucket_name, dataset_name, segments=None):
+    """
+    Readable file object of a dataset's working copy, fetched with ranged GETs,
+    or a list of them, one per part, when it has appended `segments`.
+    """
+    bucket = storage_client.bucket(bucket_name)
+    with ExitStack() as stack:
+        sources = [stack.enter_context(bucket.blob(name).open("rb", chunk_size=STREAMING_CHUNK_BYTES))
+                   for name in part_names(dataset_name, segments)]
+        yield sources if segments else sources[0]
+
+@traced("duckdb.transform")
+def transform_staged_dataset(bucket_name, dataset_name, target_name, steps, manifest):
+    """
+    Run plan steps through DuckDB over the staged working copy and upload the result.
+
+    Returns the manifest of the new working copy. No DataFrame is built, so the
+    dataset does not have to fit in memory.
+    """
+    with blob_cache.scratch(working_copy_name(target_name)) as target_path:
+        with stage_dataset(bucket_name, dataset_name, dataset_segments(manifest)) as source_path:
+            duckdb_engine.transform_file(source_path, target_path, steps, manifest['columns'])
+        blob = storage_client.bucket(bucket_name).blob(working_copy_name(target_name))
+        with span("gcs.upload", bytes=os.path.getsize(target_path)):
+            upload_file(blob, target_path)
+        dataset_cache.invalidate(bucket_name, target_name)
+        manifest = build_manifest_from_parquet(target_path, blob)
+        # The next command stages the result, so keep it instead of downloading it again
+        blob_cache.adopt(bucket_name, working_copy_name(target_name), blob, target_path)
+    return manifest
+
+@traced("streaming.transform")
+def transform_streaming_dataset(bucket_name, dataset_name, target_name, steps, row_groups=None, segments=None):
+    """
+    Execute plan steps chunk by chunk from the working copy straight into the new working copy.
+
+    The source is read with ranged GETs and the result is written with a chunked
+    resumable upload that runs on the I/O pool while the next batch is processed,
+    so peak memory is bounded by the batch size, not the dataset.
+    """
+    target_blob = storage_client.bucket(bucket_name).blob(working_copy_name(target_name))
+    with open_parts(bucket_name, dataset_name, segments) as source, pipelined_upload(target_blob) as target:
+        schema, rows, metadata = stream_plan(source, target, steps, row_groups=row_groups)
+    annotate(rows=rows, columns=len(schema.names))
+
+    # The resumable upload does not report the new generation
+    target_blob.reload()
+    dataset_cache.invalidate(bucket_name, target_name)
+    return build_manifest_from_schema(schema, rows, target_blob, metadata)
+
+def source_manifest(bucket_name, dataset_name, manifest, delimiter=','):
+    """
+    Manifest of the dataset a plan runs against; derived from the data for
+    datasets uploaded before manifests existed.
+    """
+    if manifest:
+        return manifest
+    return describe_frame(load_dataset(bucket_name, dataset_name, delimiter=delimiter))
+
+def plan_row_groups(manifest, steps):
+    """
+    Row groups of the working copy a plan has to read and, when the zone maps
+    settle it, the number of rows it produces. See `zone_maps.prune_row_groups`.
+
+    The zone maps only cover the base working copy, so datasets with appended
+    segments are read in full.
+    """
+    if not is_columnar(manifest) or dataset_segments(manifest):
+        return None, None
+    _, predicates = compile_plan(steps, manifest['columns'], manifest.get('dtypes'))
+    return prune_row_groups(manifest, predicates)
+
+@traced("materialize_plan")
+def materialize_plan(bucket_name, dataset_name, target_name, manifest, steps, delimiter=','):
+    """
+    Execute a pending plan in one pass and write the result as the working copy of `target_name`.
+
+    Returns the manifest of the result.
+    """
+    annotate(steps=len(steps), engine=select_engine(manifest))
+    if select_engine(manifest) == "duckdb":
+        try:
+            return transform_staged_dataset(bucket_name, dataset_name, target_name, steps, manifest)
+        except EngineFallback as e:
+            print(f"DuckDB could not run the plan, falling back to pandas: {e}")
+
+    # Row groups whose zone maps rule out every filter are never read
+    row_groups, _ = plan_row_groups(manifest, steps)
+
+    # Datasets too large to load at once are processed in bounded chunks
+    if use_streaming(manifest):
+        return transform_streaming_dataset(bucket_name, dataset_name, target_name, steps, row_groups,
+                                           dataset_segments(manifest))
+
+    columnar = is_columnar(manifest)
+    columns = required_columns(steps, manifest['columns']) if columnar else None
+    df = load_dataset(bucket_name, dataset_name, delimiter=delimiter, columns=columns, columnar=columnar,
+                      row_groups=row_groups, dtypes=manifest.get('dtypes'), segments=dataset_segments(manifest))
+    transformed_df = execute_plan(df, steps, manifest['columns'] if columnar else None)
+    return save_dataset(bucket_name, target_name, transformed_df)
+
+@traced("count_rows")
+def count_plan_rows(bucket_name, dataset_name, manifest, steps, delimiter=','):
+    """
+    Number of rows a pending plan produces, computed without writing anything.
+
+    Answered from the zone maps alone when they show that each row group
+    matches either entirely or not at all.
+    """
+    row_groups, rows = plan_row_groups(manifest, steps)
+    if rows is not None:
+        return rows
+
+    if select_engine(manifest) == "duckdb":
+        try:
+            with stage_dataset(bucket_name, dataset_name, dataset_segments(manifest)) as source_path:
+                return duckdb_engine.count_rows(source_path, steps, manifest['columns'])
+        except EngineFallback as e:
+            print(f"DuckDB could not count the plan, falling back to pandas: {e}")
+
+    if use_streaming(manifest):
+        with open_parts(bucket_name, dataset_name, dataset_segments(manifest)) as source:
+            return count_plan_rows_streaming(source, steps, row_groups=row_groups)
+
+    df = load_dataset(bucket_name, dataset_name, delimiter=delimiter, columnar=is_columnar(manifest),
+                      row_groups=row_groups, dtypes=(manifest or {}).get('dtypes'), segments=dataset_segments(manifest))
+    return len(execute_plan(df, steps))
+
+@traced("describe")
+def describe_dataset(bucket_name, dataset_name, manifest, steps, delimiter=','):
+    """
+    Profile of a dataset with a pending plan applied: null counts, min/max,
+    mean/std and sketches of the distinct values and quantiles of every column.
+
+    The profile of a working copy is persisted next to it, keyed by the
+    generations of its parts, so describing an unchanged dataset again costs one small GET.
+    Large datasets are profiled batch by batch and the batch profiles merged.
+    """
+    columnar = is_columnar(manifest)
+    bucket = storage_client.bucket(bucket_name)
+    profile_blob = bucket.blob(profile_name(dataset_name))
+    if columnar and not steps:
+        try:
+            stored = json.loads(profile_blob.download_as_bytes())
+            if stored.get('version') == dataset_version(manifest):
+                annotate(cache="hit")
+                return DatasetProfile.from_dict(stored['profile'])
+        except NotFound:
+            pass
+
+    annotate(cache="miss", steps=len(steps))
+    if select_engine(manifest) == "duckdb":
+        # Already staged for out-of-core commands; read from the local copy in batches
+        with stage_dataset(bucket_name, dataset_name, dataset_segments(manifest)) as source_path:
+            profile = profile_plan_streaming(source_path, steps)
+    elif use_streaming(manifest):
+        with open_parts(bucket_name, dataset_name, dataset_segments(manifest)) as source:
+            profile = profile_plan_streaming(source, steps)
+    else:
+        df = load_dataset(bucket_name, dataset_name, delimiter=delimiter, columnar=columnar,
+                          dtypes=(manifest or {}).get('dtypes'), segments=dataset_segments(manifest))
+        profile = DatasetProfile.of_frame(execute_plan(df, steps, manifest['columns'] if columnar else None))
+
+    if columnar and not steps:
+        with span("gcs.upload"):
+            profile_blob.upload_from_string(json.dumps({'version': dataset_version(manifest), 'profile': profile.to_dict()}),
+                                            content_type="application/json")
+    return profile
+
+@traced("export_dataset")
+def export_dataset(bucket_name, dataset_name, dataframe, delimiter=','):
+    """
+    Write the downloadable CSV/TSV copy of a dataset under its own name.
+
+    The copy is compressed with the storage codec and served with a matching
+    `Content-Encoding`. Large frames are uploaded while they are written out,
+    small ones from an in-memory buffer.
+    """
     bucket = storage_client.bucket(bucket_name)
-    file_path = f"/tmp/{dataset_name}"
-    dataframe.to_csv(file_path, index=False)
     blob = bucket.blob(dataset_name)
-    blob.upload_from_filename(file_path)
+    codec = storage_codec()
+    set_encoding(blob, codec, delimiter)
+    if int(dataframe.memory_usage(deep=False).sum()) >= PIPELINED_UPLOAD_MIN_BYTES:
+        with span("to_csv", rows=len(dataframe), columns=len(dataframe.columns), compression=codec, pipelined=True), \
+                pipelined_upload(blob, content_type=blob.content_type) as target, compressed(target, codec) as writer:
+            dataframe.to_csv(writer, index=False, sep=delimiter, mode='wb')
+        blob.reload()
+        return blob
+
+    buffer = BytesIO()
+    with span("to_csv", rows=len(dataframe), columns=len(dataframe.columns), compression=codec):
+        with compressed(buffer, codec) as writer:
+            dataframe.to_csv(writer, index=False, sep=delimiter, mode='wb')
+    size = buffer.tell()
+    buffer.seek(0)
+    with span("gcs.upload", bytes=size):
+        blob.upload_from_file(buffer, size=size, content_type=blob.content_type)
+    return blob
+
+@traced("duckdb.export")
+def export_staged_dataset(bucket_name, dataset_name, delimiter=',', segments=None):
+    """
+    Export the staged working copy to CSV/TSV through DuckDB, without building a DataFrame.
+    """
+    codec = storage_codec()
+    blob = storage_client.bucket(bucket_name).blob(dataset_name)
+    set_encoding(blob, codec, delimiter)
+    with blob_cache.scratch(dataset_name) as file_path:
+        with stage_dataset(bucket_name, dataset_name, segments) as source_path:
+            duckdb_engine.export_file(source_path, file_path, delimiter=delimiter, compression=codec)
+        with span("gcs.upload", bytes=os.path.getsize(file_path)):
+            upload_file(blob, file_path, content_type=blob.content_type)
+    return blob
+
+@traced("streaming.export")
+def export_streaming_dataset(bucket_name, dataset_name, delimiter=',', segments=None):
+    """
+    Export the working copy to CSV/TSV chunk by chunk, streaming it into a resumable upload.
+    """
+    blob = storage_client.bucket(bucket_name).blob(dataset_name)
+    codec = storage_codec()
+    set_encoding(blob, codec, delimiter)
+    with open_parts(bucket_name, dataset_name, segments) as source, \
+            pipelined_upload(blob, content_type=blob.content_type) as target, compressed(target, codec) as writer:
+        stream_export(source, writer, delimiter=delimiter)
+    blob.reload()
+    return blob
+
+@traced("ingest_upload")
+def ingest_upload(bucket_name, dataset_name, stream, delimiter=',', size_hint=None, dtypes=None):
+    """
+    Store an uploaded file and build its columnar working copy and manifest in a single pass.
+
+    The upload is read once: its bytes are forwarded to GCS as they are read,
+    the head is validated before the rest is sent, and the same bytes are parsed
+    into the working copy. A rejected file is never finalized in GCS.
+
+    Gzip and zstd uploads, told apart by their magic number, are stored as they
+    are and decompressed on the fly for parsing; plain text is compressed with
+    the storage codec on its way to GCS. Rows appended to a dataset are parsed
+    with its recorded `dtypes` as hints, see `compact.append_options`.
+    """
+    blob = storage_client.bucket(bucket_name).blob(dataset_name)
+    codec, stream = sniff_stream(stream)
+    stored_codec = codec or storage_codec()
+    set_encoding(blob, stored_codec, delimiter)
+    writer = blob.open("wb", chunk_size=STREAMING_CHUNK_BYTES, ignore_flush=True, content_type=blob.content_type)
+    inspector = UploadInspector(delimiter)
+
+    large = (size_hint or 0) >= STREAMING_MIN_BYTES
+    # Large uploads are spooled to a scratch file of their own and converted out-of-core
+    with blob_cache.scratch(dataset_name) if large else nullcontext() as file_path:
+        try:
+            with compressed(writer, None if codec else stored_codec) as sink:
+                if codec:
+                    # Stored as uploaded; only the decompressed text is inspected and parsed
+                    raw = TeeReader(stream, [writer])
+                    source, sinks = decompressing(raw, codec), []
+                else:
+                    raw, source, sinks = None, stream, [sink]
+                if large:
+                    with open(file_path, 'wb') as spool:
+                        TeeReader(source, sinks + [spool], inspector).drain()
+                else:
+                    reader = TeeReader(source, sinks, inspector)
+                    df = pd.read_csv(reader, delimiter=delimiter, **(append_options(dtypes) if dtypes else {}))
+                    reader.drain()
+                if raw is not None:
+                    # Anything after the last compressed frame is still part of the stored file
+                    raw.drain()
+            inspector.finish()
+        except BaseException as e:
+            # A rejected upload is abandoned, so nothing is stored under its name
+            discard = getattr(writer, "discard", None)
+            if discard is not None:
+                discard()
+            if codec and isinstance(e, OSError):
+                raise ValueError(f"The file is not a valid {codec} stream: {e}") from e
+            raise
+        writer.close()
+
+        if large:
+            with blob_cache.scratch(working_copy_name(dataset_name)) as target_path:
+                duckdb_engine.convert_csv(file_path, target_path, delimiter=delimiter)
+                working_blob = storage_client.bucket(bucket_name).blob(working_copy_name(dataset_name))
+                upload_file(working_blob, target_path)
+                dataset_cache.invalidate(bucket_name, dataset_name)
+                manifest = build_manifest_from_parquet(target_path, working_blob)
+                blob_cache.adopt(bucket_name, working_copy_name(dataset_name), working_blob, target_path)
+        else:
+            # Dtypes are settled once here; the working copy keeps them for every later load
+            inferred_bytes = memory_bytes(df)
+            manifest = save_dataset(bucket_name, dataset_name, compact_frame(df))
+            manifest['inferred_memory_bytes'] = inferred_bytes
+            print(f"{dataset_name}: {inferred_bytes} bytes in memory as parsed, {manifest['memory_bytes']} with compact dtypes")
+
+    # The resumable upload does not report the new generation
+    blob.reload()
+    # The uploaded original doubles as the download copy until the dataset is transformed
+    manifest['export_generation'] = blob.generation
+    manifest['source_bytes'] = inspector.bytes
+    manifest['compression'] = stored_codec
+    manifest['stored_bytes'] = blob.size
+    annotate(dataset=dataset_name, bytes=inspector.bytes, stored_bytes=blob.size, compression=stored_codec,
+             rows=manifest['rows'], columns=len(manifest['columns']), memory_bytes=manifest.get('memory_bytes'),
+             inferred_memory_bytes=manifest.get('inferred_memory_bytes'))
+    return manifest
+
+@traced("append_upload")
+def append_upload(user_id, user_data, stream, file_type, size_hint=None):
+    """
+    Store an uploaded file as a new segment of the user's dataset, without rewriting the rows already stored.
+
+    Only the new rows are uploaded and converted, so the cost scales with the
+    upload, not the dataset. Their schema must match the dataset's. Once enough
+    small segments pile up, a compaction job is queued behind the user's
+    commands. Returns the response body and status code.
+    """
+    bucket_name, dataset_name = user_data.get('bucket'), user_data.get('dataset')
+    manifest = user_data.get('manifest')
+    if not dataset_name:
+        return {"message": "No dataset to append to. Please upload a dataset first."}, 400
+    if not is_columnar(manifest):
+        return {"message": "This dataset was uploaded before appends were supported. Please upload it again."}, 400
+    if file_type != user_data.get('file_type', 'csv'):
+        return {"message": f"Rows appended to a {user_data.get('file_type', 'csv')} dataset must be a {user_data.get('file_type', 'csv')} file."}, 400
+    if user_data.get('updated_dataset'):
+        return {"message": "Reply `yes` or `no` to the pending transformation before appending rows."}, 409
+
+    delimiter = ',' if file_type == 'csv' else '\t'
+    name = segment_name(dataset_name)
+    segment_manifest = ingest_upload(bucket_name, name, stream, delimiter, size_hint=size_hint, dtypes=manifest.get('dtypes'))
+    try:
+        check_segment(manifest, segment_manifest)
+    except ValueError:
+        delete_dataset(bucket_name, name, segment_manifest)
+        raise
+
+    with user_cache.lock(user_id):
+        # Re-read under the lock: the dataset may have been replaced while the rows were uploaded
+        current = get_user(user_id)
+        if current.get('dataset') != dataset_name or current.get('updated_dataset'):
+            delete_dataset(bucket_name, name, segment_manifest)
+            return {"message": "The dataset changed while the rows were uploaded. Please try again."}, 409
+        manifest = append_segment(current.get('manifest'), name, segment_manifest)
+        update_user(user_id, {'manifest': manifest})
+    dataset_cache.invalidate(bucket_name, dataset_name)
+    print(f"Appended {segment_manifest['rows']} rows to {dataset_name} as {name}")
+
+    if compaction_run(manifest) is not None:
+        job_queue.submit(user_id, "compact segments", compact_segments, user_id)
+    return {
+        "message": f"Appended {segment_manifest['rows']} rows to the dataset.",
+        "dataset": dataset_name,
+        "rows": manifest['rows'],
+        "segments": len(manifest['segments']),
+    }, 201
+
+@traced("compact")
+@count_storage_calls
+def compact_segments(user_id):
+    """
+    Merge the longest run of small consecutive segments of the user's dataset into one segment.
+
+    Runs on the user's job queue, so no command reads the segments while they
+    are replaced; appends, which do not, are checked for under the user lock.
+    Returns the response body and status code.
+    """
+    user_data = get_user(user_id)
+    bucket_name, dataset_name = user_data.get('bucket'), user_data.get('dataset')
+    manifest = user_data.get('manifest')
+    run = compaction_run(manifest)
+    if run is None:
+        return {"message": "Nothing to compact."}, 200
+
+    start, end = run
+    merged = dataset_segments(manifest)[start:end]
+    name = segment_name(dataset_name)
+    report_progress(f"merging {len(merged)} segments")
+    with blob_cache.scratch(working_copy_name(name)) as target_path:
+        with ExitStack() as stack:
+            file_paths = [stack.enter_context(stage_dataset(bucket_name, segment['name'])) for segment in merged]
+            df = compact_frame(read_parts(file_paths))
+        metadata = write_parquet(df, target_path)
+        blob = storage_client.bucket(bucket_name).blob(working_copy_name(name))
+        with span("gcs.upload", bytes=os.path.getsize(target_path)):
+            upload_file(blob, target_path)
+        segment_manifest = build_manifest(df, blob, metadata)
+        blob_cache.adopt(bucket_name, working_copy_name(name), blob, target_path)
+
+    with user_cache.lock(user_id):
+        current = get_user(user_id)
+        names = [segment['name'] for segment in dataset_segments(current.get('manifest'))[start:end]]
+        if current.get('dataset') != dataset_name or names != [segment['name'] for segment in merged]:
+            delete_dataset(bucket_name, name, segment_manifest)
+            return {"message": "The dataset changed; compaction was skipped."}, 409
+        manifest = replace_segments(current.get('manifest'), start, end, name, segment_manifest)
+        update_user(user_id, {'manifest': manifest})
+
+    delete_segments(bucket_name, merged)
+    dataset_cache.invalidate(bucket_name, dataset_name)
+    print(f"Compacted {len(merged)} segments of {dataset_name} into {name}")
+    return {"message": f"Merged {len(merged)} segments into one.", "segments": len(manifest['segments'])}, 200
+
+@traced("gcs.delete")
+def delete_segments(bucket_name, segments):
+    """Delete the blobs of some segments of a dataset in one batch request."""
+    generations = {}
+    for segment in segments:
+        generations.update(segment_blobs(segment))
+        blob_cache.invalidate(bucket_name, working_copy_name(segment['name']))
+    delete_blobs(storage_client, storage_client.bucket(bucket_name), generations)
+
+@traced("gcs.delete")
+def delete_dataset(bucket_name, dataset_name, manifest=None):
+    """
+    Delete a dataset's downloadable copy, its columnar working copy, its
+    appended segments and its profile in one batch request.
+
+    The generations recorded in the manifest are used as preconditions, so a
+    copy that has been rewritten since is not deleted by mistake.
+    """
+    manifest = manifest or {}
+    generations = {
+        dataset_name: manifest.get('export_generation'),
+        working_copy_name(dataset_name): manifest.get('generation') if is_columnar(manifest) else None,
+        profile_name(dataset_name): None,
+    }
+    for segment in dataset_segments(manifest):
+        generations.update(segment_blobs(segment))
+    delete_blobs(storage_client, storage_client.bucket(bucket_name), generations)
+    dataset_cache.invalidate(bucket_name, dataset_name)
+    blob_cache.invalidate(bucket_name, dataset_name)
+    blob_cache.invalidate(bucket_name, working_copy_name(dataset_name))
+    for segment in dataset_segments(manifest):
+        blob_cache.invalidate(bucket_name, working_copy_name(segment['name']))
 
 @app.route('/chat', methods=['GET'])
 @token_required
@@ -294,10 +1070,17 @@ def chat_welcome():
             "  Example: rename column Age to Years\n"
             "● filter rows where <condition>\n"
             "  Example: filter rows where Age > 25\n"
+            "  Conditions: =, !=, <, >, in (...), between, is null, like, joined with and/or/not\n"
+            "● several transformations separated by ;\n"
+            "  Example: remove column Age; rename column Name to Who\n"
             "● columns\n"
             "  Example: columns (to list all column names)\n"
             "● size\n"
             "  Example: size (to get the dataset dimensions)\n"
+            "● describe [column_name]\n"
+            "  Example: describe Age (to get approximate statistics of one or all columns)\n"
+            "● download\n"
+            "  Example: download (to get a download link for the dataset)\n"
             "● change dataset\n"
             "  Example: change dataset (to upload or replace your dataset)\n"
         )
@@ -310,84 +1093,197 @@ def chat_welcome():
 @app.route('/transform', methods=['POST'])
 @token_required
 def transform_dataset():
+    """
+    Queue a transformation or metadata command and return its job id immediately.
+
+    Commands of the same user run one at a time in the order they were sent;
+    poll `GET /jobs/<job_id>` for the result.
+    """
+    data = request.json
+    command = data.get("command")
+    if not command:
+        return jsonify({"message": "No command provided"}), 400
+
+    # Several transformations separated by `;` are run as one batch
+    if ";" in command:
+        return queue_batch(split_commands(command))
+
+    job_id = job_queue.submit(request.user_id, command, run_transform_command, request.user_id, command)
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}), 202
+
+@app.route('/transform/batch', methods=['POST'])
+@token_required
+def transform_batch():
+    """
+    Queue an ordered list of transformations that run against a single load and save of the dataset.
+
+    Accepts `commands` as a list or as one string separated by `;`.
+    """
+    commands = request.json.get("commands")
+    if isinstance(commands, str):
+        commands = split_commands(commands)
+    if not commands or not isinstance(commands, list):
+        return jsonify({"message": "No commands provided"}), 400
+    return queue_batch(commands)
+
+def split_commands(text):
+    return [command.strip() for command in text.split(";") if command.strip()]
+
+def queue_batch(commands):
+    job_id = job_queue.submit(request.user_id, "; ".join(commands), run_batch_commands, request.user_id, commands)
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def job_status(job_id):
+    """
+    Status, progress, timing and, once finished, the result of a queued command.
+    """
+    job = job_queue.get(job_id)
+    if not job or job['key'] != request.user_id:
+        return jsonify({"message": "Job not found"}), 404
+
+    return jsonify({
+        "job_id": job['id'],
+        "command": job['description'],
+        "status": job['status'],
+        "progress": job['progress'],
+        "timing": job['timing'],
+        "metrics": job['metrics'],
+        "status_code": job['status_code'],
+        "result": job['result'],
+    }), 200
+
+@traced("command")
+@count_storage_calls
+def run_transform_command(user_id, command):
     """
     Perform transformations or provide metadata about the dataset based on user commands.
+
+    Runs on a job worker; returns the response body and status code.
     """
+    annotate(command_type=command_type(command))
     try:
-        # Retrieve request data
-        user_id = request.user_id
-        data = request.json
-        command = data.get("command")
-        if not command:
-            return jsonify({"message": "No command provided"}), 400
-
         # Retrieve dataset information
-        user_ref = firestore_client.collection('users').document(user_id)
-        user_data = user_ref.get().to_dict()
+        user_data = get_user(user_id)
         bucket_name = user_data.get('bucket')
         current_dataset = user_data.get('dataset')
         file_type = user_data.get('file_type', 'csv')
 
         if not current_dataset:
-            return jsonify({"message": "No dataset found. Please upload a dataset first."}), 400
+            return {"message": "No dataset found. Please upload a dataset first."}, 400
+
+        plan = user_data.get('plan') or []
+        dataset_to_use = user_data.get('updated_dataset') if user_data.get('updated_dataset') else current_dataset
+        delimiter = ',' if file_type == 'csv' else '\t'
+        manifest = manifest_for(user_data)
+        transformed_dataset_name = f"transformed_{current_dataset}"
+        pending_updates = {}
+
+        if plan and command.lower() in ("yes", "download"):
+            # Pending transformations are only executed when their result is needed
+            report_progress("applying pending transformations")
+            try:
+                manifest = materialize_plan(bucket_name, dataset_to_use, transformed_dataset_name, manifest, plan, delimiter)
+            except ValueError as ve:
+                return {"message": f"Failed to apply pending transformations: {ve}"}, 400
+            pending_updates = {'updated_dataset': transformed_dataset_name, 'updated_manifest': manifest, 'plan': []}
+            user_data.update(pending_updates)
+            dataset_to_use, plan = transformed_dataset_name, []
 
         if command.lower() == "yes":
             # Switch to the updated dataset
             new_dataset_name = user_data.get('updated_dataset')
             if not new_dataset_name:
-                return jsonify({"message": "No updated dataset found. Please apply a transformation first."}), 400
+                return {"message": "No updated dataset found. Please apply a transformation first."}, 400
 
             # Set the updated dataset as the current dataset and delete the old one
             try:
-                bucket = storage_client.get_bucket(bucket_name)
-                old_blob = bucket.blob(current_dataset)
-                if old_blob.exists():
-                    old_blob.delete()  # Delete old dataset
-                    print(f"Deleted old dataset: {current_dataset}")
-
-                # Update Firestore with the new dataset information
-                user_ref.update({'dataset': new_dataset_name, 'updated_dataset': None})
-                return jsonify({"message": "Using updated dataset for further transformations."}), 200
+                # Update Firestore with the new dataset information; the old dataset is
+                # only deleted once the user no longer points at it
+                update_user(user_id, {
+                    'dataset': new_dataset_name,
+                    'manifest': user_data.get('updated_manifest'),
+                    'updated_dataset': None,
+                    'updated_manifest': None,
+                    'plan': []
+                })
+                delete_dataset(bucket_name, current_dataset, user_data.get('manifest'))
+                print(f"Deleted old dataset: {current_dataset}")
+                return {"message": "Using updated dataset for further transformations."}, 200
             except Exception as e:
-                return jsonify({"message": f"Failed to switch to updated dataset: {e}"}), 500
+                return {"message": f"Failed to switch to updated dataset: {e}"}, 500
 
         if command.lower() == "no":
-            return jsonify({"message": "Continuing with the original dataset for transformations."}), 200
-
-        # Load the dataset
-        dataset_to_use = user_data.get('updated_dataset') if user_data.get('updated_dataset') else current_dataset
-        delimiter = ',' if file_type == 'csv' else '\t'
-        df = load_dataset(bucket_name, dataset_to_use, delimiter=delimiter)
-
-        # Handle metadata commands
-        if command.lower() == "columns":
-            column_list = df.columns.tolist()
-            pretty_columns = "\n".join([f"● {col}" for col in column_list])
-            return jsonify({"message": f"Dataset Columns:\n{pretty_columns}"}), 200
-
-        if command.lower() == "size":
-            dimensions = f"Rows: {df.shape[0]}, Columns: {df.shape[1]}"
-            return jsonify({"message": f"Dataset Dimensions:\n{dimensions}"}), 200
-
-        # Apply transformations
+            # Discard pending transformations
+            update_user(user_id, {'updated_dataset': None, 'updated_manifest': None, 'plan': []})
+            return {"message": "Continuing with the original dataset for transformations."}, 200
+
+        columnar = is_columnar(manifest)
+
+        if command.lower() == "download":
+            blob = storage_client.bucket(bucket_name).get_blob(dataset_to_use)
+            # Export only when no CSV/TSV copy matches the current working copy
+            if columnar and (blob is None or blob.generation != manifest.get('export_generation')):
+                report_progress("exporting dataset")
+                segments = dataset_segments(manifest)
+                if select_engine(manifest) == "duckdb":
+                    blob = export_staged_dataset(bucket_name, dataset_to_use, delimiter=delimiter, segments=segments)
+                elif use_streaming(manifest):
+                    blob = export_streaming_dataset(bucket_name, dataset_to_use, delimiter=delimiter, segments=segments)
+                else:
+                    df = load_dataset(bucket_name, dataset_to_use, delimiter=delimiter, columnar=True, segments=segments)
+                    blob = export_dataset(bucket_name, dataset_to_use, df, delimiter=delimiter)
+                manifest['export_generation'] = blob.generation
+                manifest_field = 'updated_manifest' if user_data.get('updated_dataset') else 'manifest'
+                pending_updates[manifest_field] = manifest
+            # Firestore is updated while the link is signed
+            saving = submit_io(update_user, user_id, pending_updates) if pending_updates else None
+            report_progress("generating download link")
+            with span("sign_url"):
+                download_url = blob.generate_signed_url(expiration=datetime.timedelta(hours=1))
+            if saving is not None:
+                saving.result()
+            return {"message": "Your dataset is ready to download.", "download_url": download_url}, 200
+
+        # Handle metadata commands from the manifest and the pending plan, without writing anything
+        if command.lower() in ("columns", "size"):
+            schema = plan_schema(source_manifest(bucket_name, dataset_to_use, manifest, delimiter), plan)
+            if command.lower() == "columns":
+                pretty_columns = "\n".join([f"● {col}" for col in schema['columns']])
+                return {"message": f"Dataset Columns:\n{pretty_columns}"}, 200
+
+            rows = schema['rows']
+            if rows is None:
+                report_progress("counting rows")
+                rows = count_plan_rows(bucket_name, dataset_to_use, manifest, plan, delimiter)
+            dimensions = f"Rows: {rows}, Columns: {len(schema['columns'])}"
+            return {"message": f"Dataset Dimensions:\n{dimensions}"}, 200
+
+        if command_type(command) == "describe":
+            column = command.strip()[len("describe"):].strip() or None
+            schema = plan_schema(source_manifest(bucket_name, dataset_to_use, manifest, delimiter), plan)
+            if column is not None and column not in schema['columns']:
+                return {"message": f"Column '{column}' does not exist in the dataset."}, 400
+            report_progress("profiling dataset")
+            profile = describe_dataset(bucket_name, dataset_to_use, manifest, plan, delimiter)
+            return {"message": f"Dataset Profile (approximate):\n{format_profile(profile, column)}"}, 200
+
+        # Add the transformation to the pending plan; it is validated against the plan's schema now
+        # and executed once, when the user accepts it or asks for a download link
         try:
-            transformed_df = apply_predefined_transformation(df, command)
-            transformed_dataset_name = f"transformed_{current_dataset}"
-            save_dataset(bucket_name, transformed_dataset_name, transformed_df)
-
-            # Update Firestore with the new transformed dataset
-            user_ref.update({'updated_dataset': transformed_dataset_name})
-
-            # Generate download link
-            bucket = storage_client.get_bucket(bucket_name)
-            blob = bucket.blob(transformed_dataset_name)
-            download_url = blob.generate_signed_url(expiration=datetime.timedelta(hours=1))
+            step = plan_step(command)
+            schema = plan_schema(source_manifest(bucket_name, dataset_to_use, manifest, delimiter), plan)
+            if step['op'] == "filter":
+                validate_filter(schema, step['condition'])
+            else:
+                plan_schema(schema, [step])
+            update_user(user_id, {'plan': plan + [step]})
 
-            return jsonify({
-                "message": "Transformation applied successfully.",
-                "download_url": download_url,
+            return {
+                "message": "Transformation applied successfully. Reply with `download` to get a download link.",
                 "followup_message": "Do you want to use this updated dataset for further transformations? Reply with `yes` or `no`."
-            }), 200
+            }, 200
 
         except ValueError as ve:
             supported_commands = (
@@ -399,83 +1295,182 @@ def transform_dataset():
                 "  Example: rename column Age to Years\n"
                 "● filter rows where <condition>\n"
                 "  Example: filter rows where Age > 25\n"
+                "  Conditions: =, !=, <, >, in (...), between, is null, like, joined with and/or/not\n"
+                "● several transformations separated by ;\n"
+                "  Example: remove column Age; rename column Name to Who\n"
                 "● columns\n"
                 "  Example: columns (to list all column names)\n"
                 "● size\n"
                 "  Example: size (to get the dataset dimensions)\n"
+                "● describe [column_name]\n"
+                "  Example: describe Age (to get approximate statistics of one or all columns)\n"
+                "● download\n"
+                "  Example: download (to get a download link for the dataset)\n"
                 "● change dataset\n"
             "  Example: change dataset (to upload or replace your dataset)\n"
             )
-            return jsonify({"message": f"{ve}\n\n{supported_commands}"}), 400
+            return {"message": f"{ve}\n\n{supported_commands}"}, 400
 
     except Exception as e:
         print(f"Error in transform_dataset: {e}")
-        return jsonify({"message": f"Error: {str(e)}"}), 500
+        return {"message": f"Error: {str(e)}"}, 500
+
+@traced("batch")
+@count_storage_calls
+def run_batch_commands(user_id, commands):
+    """
+    Apply several transformations with one load and one save of the dataset.
+
+    Runs on a job worker; returns the response body and status code. The body
+    reports the time taken and the resulting row and column counts of every
+    step. Nothing is saved unless every step succeeds.
+    """
+    annotate(command_type="batch", steps=len(commands))
+    try:
+        user_data = get_user(user_id)
+        bucket_name = user_data.get('bucket')
+        current_dataset = user_data.get('dataset')
+        if not current_dataset:
+            return {"message": "No dataset found. Please upload a dataset first."}, 400
 
+        # Every command is checked before any data is read
+        try:
+            steps = [plan_step(command) for command in commands]
+        except ValueError as ve:
+            return {"message": f"Unsupported command in batch: {str(ve) or 'only remove, rename and filter can be batched.'}"}, 400
+
+        plan = user_data.get('plan') or []
+        dataset_to_use = user_data.get('updated_dataset') or current_dataset
+        delimiter = ',' if user_data.get('file_type', 'csv') == 'csv' else '\t'
+        manifest = manifest_for(user_data)
+        transformed_dataset_name = f"transformed_{current_dataset}"
+
+        if select_engine(manifest) == "duckdb" or use_streaming(manifest):
+            # Too large for memory: the batch joins the pending plan and runs as a single out-of-core pass
+            report_progress("applying transformations")
+            started = time.perf_counter()
+            try:
+                schema = plan_schema(manifest, plan)
+                for step in steps:
+                    if step['op'] == "filter":
+                        validate_filter(schema, step['condition'])
+                    schema = plan_schema(schema, [step])
+                result_manifest = materialize_plan(bucket_name, dataset_to_use, transformed_dataset_name, manifest, plan + steps, delimiter)
+            except ValueError as ve:
+                return {"message": f"Failed to apply transformations: {ve}"}, 400
+            step_reports = [{
+                "command": "; ".join(commands),
+                "seconds": round(time.perf_counter() - started, 4),
+                "rows": result_manifest['rows'],
+                "columns": len(result_manifest['columns']),
+            }]
+        else:
+            report_progress("loading dataset")
+            columnar = is_columnar(manifest)
+            df = load_dataset(bucket_name, dataset_to_use, delimiter=delimiter, columnar=columnar,
+                              dtypes=(manifest or {}).get('dtypes'), segments=dataset_segments(manifest))
+            if plan:
+                df = execute_plan(df, plan)
+
+            step_reports = []
+            for index, command in enumerate(commands):
+                report_progress(f"step {index + 1} of {len(commands)}", index / len(commands))
+                started = time.perf_counter()
+                try:
+                    df = apply_predefined_transformation(df, command)
+                except ValueError as ve:
+                    return {"message": f"Step {index + 1} ({command}) failed: {ve}", "steps": step_reports}, 400
+                step_reports.append({
+                    "command": command,
+                    "seconds": round(time.perf_counter() - started, 4),
+                    "rows": len(df),
+                    "columns": len(df.columns),
+                })
+
+            report_progress("saving dataset")
+            result_manifest = save_dataset(bucket_name, transformed_dataset_name, df)
+
+        update_user(user_id, {'updated_dataset': transformed_dataset_name, 'updated_manifest': result_manifest, 'plan': []})
+        return {
+            "message": f"Applied {len(commands)} transformations. Reply with `download` to get a download link.",
+            "steps": step_reports,
+            "followup_message": "Do you want to use this updated dataset for further transformations? Reply with `yes` or `no`."
+        }, 200
+
+    except Exception as e:
+        print(f"Error in run_batch_commands: {e}")
+        return {"message": f"Error: {str(e)}"}, 500
 
+def command_type(command):
+    """First word of a chat command, lower-cased, used to group timings."""
+    words = command.split()
+    return words[0].lower() if words else ""
+
+@traced("transform")
 def apply_predefined_transformation(df, command):
     """
     Apply supported transformations to the dataframe.
+
+    This is the in-memory pandas engine; `engines.DuckDBEngine` runs the same
+    commands out-of-core over a staged working copy.
     """
-    supported_commands = ""
-    if command.startswith("remove column"):
-        column = command.split("remove column")[-1].strip()
+    operation, args = parse_command(command)
+    annotate(command_type=operation, input_rows=len(df))
+    if operation == "remove":
+        column = args['column']
         if column in df.columns:
             df = df.drop(columns=[column])
         else:
             raise ValueError(f"Column '{column}' does not exist in the dataset.")
-    elif command.startswith("rename column"):
-        parts = command.split("rename column")[-1].strip().split("to")
-        if len(parts) == 2:
-            old_name, new_name = parts[0].strip(), parts[1].strip()
-            if old_name in df.columns:
-                df = df.rename(columns={old_name: new_name})
-            else:
-                raise ValueError(f"Column '{old_name}' does not exist in the dataset.")
+    elif operation == "rename":
+        old_name, new_name = args['old_name'], args['new_name']
+        if old_name in df.columns:
+            df = df.rename(columns={old_name: new_name})
         else:
-            raise ValueError("Invalid rename command. Use 'rename column <old_name> to <new_name>'.")
-    elif command.startswith("filter rows where"):
-        condition = command.split("filter rows where")[-1].strip()
+            raise ValueError(f"Column '{old_name}' does not exist in the dataset.")
+    elif operation == "filter":
+        # Parsed once into a predicate tree (cached) and evaluated as a vectorized mask
+        tree = filter_predicate(args['condition'], list(df.columns), df.dtypes.astype(str).to_dict())
         try:
-            df = df.query(condition)
+            df = df[predicate_mask(tree, df)]
         except Exception as e:
             raise ValueError(f"Error in filter condition: {e}")
-    else:
-        raise ValueError(supported_commands)
-    return df
-    if command.startswith("remove column"):
-        column = command.split("remove column")[-1].strip()
-        if column in df.columns:
-            df = df.drop(columns=[column])
-        else:
-            raise ValueError(f"Column '{column}' does not exist in the dataset.")
-    elif command.startswith("rename column"):
-        parts = command.split("rename column")[-1].strip().split("to")
-        if len(parts) == 2:
-            old_name, new_name = parts[0].strip(), parts[1].strip()
-            if old_name in df.columns:
-                df = df.rename(columns={old_name: new_name})
-            else:
-                raise ValueError(f"Column '{old_name}' does not exist in the dataset.")
-        else:
-            raise ValueError("Invalid rename command. Use `rename column <old_name> to <new_name>`.")
-    elif command.startswith("filter rows where"):
-        condition = command.split("filter rows where")[-1].strip()
-        try:
-            df = df.query(condition)
-        except Exception as e:
-            raise ValueError(f"Error in filter condition: {e}")
-    else:
-        raise ValueError(supported_commands)
+    annotate(rows=len(df), columns=len(df.columns))
     return df
 
+@app.route('/cache-stats', methods=['GET'])
+@token_required
+def cache_stats():
+    """
+    Hit/miss counters for the in-process dataset and user-document caches and the on-disk blob cache.
+    """
+    return jsonify({"datasets": dataset_cache.stats(), "users": user_cache.stats(), "blobs": blob_cache.stats()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Latency and CPU time histograms per route and phase, storage API call counts
+    and bcrypt pool counters, for Prometheus to scrape.
+    """
+    passwords = password_hasher.stats()
+    body = latency_histograms.render() + cpu_histograms.render(
+        "idts_cpu_seconds", "CPU time of each request, by route; the bcrypt phase is the share spent hashing passwords."
+    ) + render_counter(
+        "idts_storage_calls_total", "Storage API round-trips, by kind of call.", "kind", storage_calls.totals
+    ) + render_counter(
+        "idts_password_operations_total", "Password hashes and checks run on the bcrypt pool.", "operation", passwords['completed']
+    ) + render_counter(
+        "idts_password_rejections_total", "Password hashes and checks turned away because the bcrypt pool was full.",
+        "operation", passwords['rejected']
+    )
+    return body, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 @app.route('/check-dataset', methods=['GET'])
 @token_required
 def check_dataset():
     try:
         user_id = request.user_id
-        user_ref = firestore_client.collection('users').document(user_id)
-        user_data = user_ref.get().to_dict()
+        user_data = get_user(user_id)
 
         if not user_data or not user_data.get('dataset'):
             return jsonify({"hasDataset": False}), 200
@@ -487,6 +1482,9 @@ def check_dataset():
     except Exception as e:
         print(f"Error in check_dataset: {e}")
         return jsonify({"message": f"Error: {str(e)}"}), 500
-    
+
+# Provisions the buckets of users whose signup job was lost, e.g. to a restart or a failed create
+run_periodically(STORAGE_RECONCILE_SECONDS, reconcile_storage, "storage-reconciler")
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
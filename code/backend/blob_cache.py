@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import quote
+
+from telemetry import span, annotate
+from transfers import download_file
+
+BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", "/tmp/blob-cache")
+
+
+class BlobCache:
+    """
+    On-disk LRU cache of downloaded blobs, bounded by total file size.
+
+    Files are stored as `<bucket>/<blob name>@<generation>` under `directory`,
+    so two buckets with identically named objects never share a file and a
+    rewritten object is never served from an older download. Callers look the
+    blob up first (a metadata GET), so a repeat read of an unchanged object
+    costs that call alone. The size and MD5 hash from the metadata are checked
+    against the entry before it is reused.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._pins = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._scan()
+
+    @contextmanager
+    def open(self, bucket_name, blob_name, blob):
+        """
+        Local path of a blob's current generation, downloading it on a miss.
+
+        The entry is pinned inside the block, so it cannot be evicted while the
+        caller is reading it. `blob` must have been loaded with `get_blob` or
+        `reload`, so its generation, size and hash are known.
+        """
+        path = self.path_for(bucket_name, blob_name, blob.generation)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and self._valid(entry, blob) and path.is_file():
+                self._entries.move_to_end(path)
+                self.hits += 1
+                self.bytes_saved += entry["size"]
+                hit = True
+            else:
+                self.misses += 1
+                hit = False
+            self._pin(path)
+        try:
+            if not hit:
+                temp_path = self._temp_path(path)
+                try:
+                    # Content-encoded blobs are kept as stored, so the file matches their size and hash
+                    raw = {"raw_download": True} if isinstance(getattr(blob, "content_encoding", None), str) else {}
+                    with span("gcs.download"):
+                        download_file(blob, temp_path, **raw)
+                        annotate(bytes=os.path.getsize(temp_path))
+                    self._store(blob, temp_path, path)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.unlink(temp_path)
+                    raise
+            yield str(path)
+        finally:
+            with self._lock:
+                self._unpin(path)
+
+    def adopt(self, bucket_name, blob_name, blob, file_path):
+        """
+        Move a file that was just uploaded as `blob` into the cache, so the next
+        read of that generation does not download it again.
+        """
+        path = self.path_for(bucket_name, blob_name, blob.generation)
+        temp_path = self._temp_path(path)
+        # The file may live on another filesystem than the cache
+        shutil.move(file_path, temp_path)
+        self._store(blob, temp_path, path)
+
+    def put(self, bucket_name, blob_name, blob, data):
+        """
+        Store the bytes just uploaded as `blob`, e.g. an in-memory buffer, without reading them back.
+        """
+        path = self.path_for(bucket_name, blob_name, blob.generation)
+        temp_path = self._temp_path(path)
+        with open(temp_path, "wb") as f:
+            f.write(memoryview(data))
+        self._store(blob, temp_path, path)
+
+    @contextmanager
+    def scratch(self, name):
+        """
+        Unique path for a temporary file named after `name`, deleted when the block exits.
+
+        Scratch files live next to the cache entries, so adopting one is a
+        rename, not a copy, and two requests for the same dataset name never
+        share a file.
+        """
+        directory = self.directory / ".scratch"
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, prefix=f"{quote(name, safe='')}-")
+        os.close(fd)
+        try:
+            yield path
+        finally:
+            # Adopted files have already been moved into the cache
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def path_for(self, bucket_name, blob_name, generation):
+        return self.directory / quote(bucket_name, safe="") / f"{quote(blob_name, safe='')}@{generation}"
+
+    def invalidate(self, bucket_name, blob_name):
+        """Drop every cached generation of a blob."""
+        prefix = f"{quote(blob_name, safe='')}@"
+        parent = self.directory / quote(bucket_name, safe="")
+        with self._lock:
+            for path in [p for p in self._entries if p.parent == parent and p.name.startswith(prefix)]:
+                if path not in self._pins:
+                    self._drop(path)
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._entries):
+                self._drop(path)
+            self.hits = self.misses = self.evictions = self.bytes_saved = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _temp_path(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".download-")
+        os.close(fd)
+        return temp_path
+
+    def _store(self, blob, temp_path, path):
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        prefix = path.name.rsplit("@", 1)[0] + "@"
+        with self._lock:
+            # Older generations of the same object can never be served again
+            for old in [p for p in self._entries if p.parent == path.parent and p.name.startswith(prefix) and p != path]:
+                if old not in self._pins:
+                    self._drop(old)
+            self._remove(path)
+            self._entries[path] = {"size": size, "md5": _md5(blob)}
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        # The newest entry is kept even when it alone is larger than the budget
+        for path in list(self._entries)[:-1]:
+            if self._bytes <= self.max_bytes:
+                break
+            if path not in self._pins:
+                self._drop(path)
+                self.evictions += 1
+
+    def _valid(self, entry, blob):
+        size = getattr(blob, "size", None)
+        if isinstance(size, int) and size != entry["size"]:
+            return False
+        md5 = _md5(blob)
+        return md5 is None or entry["md5"] is None or md5 == entry["md5"]
+
+    def _pin(self, path):
+        self._pins[path] = self._pins.get(path, 0) + 1
+
+    def _unpin(self, path):
+        self._pins[path] -= 1
+        if not self._pins[path]:
+            del self._pins[path]
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    def _drop(self, path):
+        self._remove(path)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _scan(self):
+        # Entries left by a previous process are reused, oldest access first
+        if not self.directory.is_dir():
+            return
+        files = [p for p in self.directory.glob("*/*@*") if p.is_file()]
+        for path in sorted(files, key=lambda p: p.stat().st_atime):
+            size = path.stat().st_size
+            self._entries[path] = {"size": size, "md5": None}
+            self._bytes += size
+        self._evict()
+
+
+def _md5(blob):
+    md5 = getattr(blob, "md5_hash", None)
+    return md5 if isinstance(md5, str) else None
+
+
+blob_cache = BlobCache(BLOB_CACHE_DIR, int(os.getenv("BLOB_CACHE_MB", "2048")) * 1024 * 1024)
@@ -0,0 +1,356 @@
+import base64
+import contextvars
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+import google.auth
+import google_crc32c
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+# `gcs` talks to Cloud Storage; `local` keeps buckets as directories for offline runs and tests
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", "/tmp/local-storage")
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", "32"))
+# Cloud Storage rejects batch requests with more calls than this
+BATCH_MAX_CALLS = 1000
+
+
+class StorageCalls:
+    """
+    Counts storage API round-trips, in total and for the request or job being tracked.
+
+    The tracked counter lives in a context variable, so calls made by I/O
+    threads running in a copy of the context are counted too.
+    """
+
+    def __init__(self):
+        self.totals = Counter()
+        self._lock = threading.Lock()
+        self._calls = contextvars.ContextVar("storage_calls", default=None)
+
+    @contextmanager
+    def track(self):
+        """Count the calls made inside the block; yields a Counter keyed by call kind."""
+        calls = Counter()
+        token = self._calls.set(calls)
+        try:
+            yield calls
+        finally:
+            self._calls.reset(token)
+
+    def record(self, kind):
+        calls = self._calls.get()
+        with self._lock:
+            self.totals[kind] += 1
+            if calls is not None:
+                calls[kind] += 1
+
+
+storage_calls = StorageCalls()
+
+
+class CountingSession(AuthorizedSession):
+    """Authorized HTTP session that reports every request it sends to `storage_calls`."""
+
+    def request(self, method, url, *args, **kwargs):
+        storage_calls.record(call_kind(method, url))
+        return super().request(method, url, *args, **kwargs)
+
+
+def call_kind(method, url):
+    if "/batch/" in url:
+        return "batch"
+    if "/upload/" in url:
+        return "upload"
+    if "alt=media" in url:
+        return "download"
+    if "/compose" in url:
+        return "compose"
+    if method == "DELETE":
+        return "delete"
+    return "metadata"
+
+
+def create_storage_client(backend=STORAGE_BACKEND):
+    """
+    Storage client for the configured backend.
+
+    The GCS client shares one pooled, authorized HTTP session between all
+    threads, so job workers reuse connections instead of opening their own.
+    """
+    if backend == "local":
+        return LocalStorageClient(LOCAL_STORAGE_ROOT)
+
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = CountingSession(credentials)
+    adapter = HTTPAdapter(pool_connections=STORAGE_POOL_SIZE, pool_maxsize=STORAGE_POOL_SIZE)
+    session.mount("https://", adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+
+def delete_blobs(client, bucket, generations):
+    """
+    Delete blobs in as few batch requests as Cloud Storage allows.
+
+    `generations` maps blob names to the generation expected to be live (None
+    for no precondition). Blobs that are already gone, or were overwritten
+    since that generation was recorded, are left alone.
+    """
+    items = list(generations.items())
+    for start in range(0, len(items), BATCH_MAX_CALLS):
+        with client.batch(raise_exception=False):
+            for blob_name, generation in items[start:start + BATCH_MAX_CALLS]:
+                bucket.blob(blob_name).delete(if_generation_match=generation)
+
+
+class LocalStorageClient:
+    """
+    Directory-backed stand-in for `google.cloud.storage.Client`.
+
+    Implements the subset of the client, bucket and blob API the service uses.
+    Buckets are directories under `root`; a blob's generation is kept in its
+    file's modification time.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._generation_lock = threading.Lock()
+        self._last_generation = 0
+
+    def bucket(self, bucket_name):
+        return LocalBucket(self, bucket_name)
+
+    def get_bucket(self, bucket_name):
+        storage_calls.record("metadata")
+        bucket = self.bucket(bucket_name)
+        if not bucket.path.is_dir():
+            raise NotFound(f"Bucket {bucket_name} not found")
+        return bucket
+
+    def create_bucket(self, bucket_or_name):
+        storage_calls.record("metadata")
+        bucket = bucket_or_name if isinstance(bucket_or_name, LocalBucket) else self.bucket(bucket_or_name)
+        bucket.path.mkdir(parents=True, exist_ok=True)
+        return bucket
+
+    @contextmanager
+    def batch(self, raise_exception=True):
+        storage_calls.record("batch")
+        self._local.batch = {"raise_exception": raise_exception, "calls": 0}
+        try:
+            yield
+        finally:
+            self._local.batch = None
+
+    def in_batch(self):
+        return getattr(self._local, "batch", None)
+
+    def next_generation(self):
+        # Strictly increasing even when the clock is coarser than the write rate
+        with self._generation_lock:
+            self._last_generation = max(time.time_ns(), self._last_generation + 1)
+            return self._last_generation
+
+
+class LocalBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.path = client.root / name
+        self.storage_class = None
+
+    def blob(self, blob_name):
+        return LocalBlob(self, blob_name)
+
+    def get_blob(self, blob_name):
+        blob = self.blob(blob_name)
+        try:
+            blob.reload()
+        except NotFound:
+            return None
+        return blob
+
+    def update(self):
+        storage_calls.record("metadata")
+
+
+class LocalBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = bucket.path / name
+        self.generation = None
+        self.size = None
+        self.content_type = None
+        self.content_encoding = None
+
+    def _record(self, kind):
+        if not self.bucket.client.in_batch():
+            storage_calls.record(kind)
+
+    def _load(self):
+        stat = self.path.stat()
+        self.generation, self.size = stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        self._record("metadata")
+        if not self.path.is_file():
+            raise NotFound(f"{self.bucket.name}/{self.name} not found")
+        self._load()
+
+    def exists(self):
+        self._record("metadata")
+        return self.path.is_file()
+
+    def download_to_filename(self, file_path, raw_download=False):
+        self._record("download")
+        if not self.path.is_file():
+            raise NotFound(f"{self.bucket.name}/{self.name} not found")
+        shutil.copyfile(self.path, file_path)
+        self._load()
+
+    def download_as_bytes(self, start=None, end=None, raw_download=False, if_generation_match=None, checksum=None):
+        self._record("download")
+        if not self.path.is_file():
+            raise NotFound(f"{self.bucket.name}/{self.name} not found")
+        if if_generation_match is not None and self.path.stat().st_mtime_ns != if_generation_match:
+            raise PreconditionFailed(f"{self.bucket.name}/{self.name} is not at generation {if_generation_match}")
+        # `end` is inclusive, like an HTTP range
+        with open(self.path, "rb") as f:
+            f.seek(start or 0)
+            return f.read(-1 if end is None else end + 1 - (start or 0))
+
+    def upload_from_filename(self, file_path, content_type=None):
+        self._record("upload")
+        with open(file_path, "rb") as source, self._writer() as target:
+            shutil.copyfileobj(source, target)
+
+    def upload_from_file(self, file_obj, size=None, content_type=None, rewind=False):
+        self._record("upload")
+        if rewind:
+            file_obj.seek(0)
+        with self._writer() as target:
+            target.write(file_obj.read() if size is None else file_obj.read(size))
+
+    def upload_from_string(self, data, content_type=None, checksum=None):
+        self._record("upload")
+        with self._writer() as target:
+            # Text is stored as UTF-8, like the GCS client does
+            target.write(data.encode("utf-8") if isinstance(data, str) else data)
+
+    def compose(self, sources):
+        self._record("compose")
+        with self._writer() as target:
+            for source in sources:
+                with open(source.path, "rb") as f:
+                    shutil.copyfileobj(f, target)
+
+    @property
+    def crc32c(self):
+        if not self.path.is_file():
+            return None
+        checksum = google_crc32c.Checksum()
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                checksum.update(chunk)
+        return base64.b64encode(checksum.digest()).decode("ascii")
+
+    def open(self, mode="r", chunk_size=None, ignore_flush=False, content_type=None):
+        if mode == "rb":
+            self._record("download")
+            return open(self.path, "rb")
+        if mode == "wb":
+            self._record("upload")
+            return self._writer()
+        raise ValueError(f"Unsupported mode: {mode}")
+
+    def _writer(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return LocalBlobWriter(self)
+
+    def finalize(self, temp_path):
+        generation = self.bucket.client.next_generation()
+        os.utime(temp_path, ns=(generation, generation))
+        os.replace(temp_path, self.path)
+        self._load()
+
+    def delete(self, if_generation_match=None):
+        self._record("delete")
+        batch = self.bucket.client.in_batch()
+        if batch:
+            # Like `google.cloud.storage.Batch`, refuse to queue more calls than one request may hold
+            batch["calls"] += 1
+            if batch["calls"] > BATCH_MAX_CALLS:
+                raise ValueError(f"Too many deferred requests (max {BATCH_MAX_CALLS})")
+        try:
+            if not self.path.is_file():
+                raise NotFound(f"{self.bucket.name}/{self.name} not found")
+            if if_generation_match is not None and self.path.stat().st_mtime_ns != if_generation_match:
+                raise PreconditionFailed(f"{self.bucket.name}/{self.name} is not at generation {if_generation_match}")
+            self.path.unlink()
+        except (NotFound, PreconditionFailed):
+            if not batch or batch["raise_exception"]:
+                raise
+
+    def generate_signed_url(self, expiration=None, **kwargs):
+        return self.path.resolve().as_uri()
+
+
+class LocalBlobWriter:
+    """
+    Writes to a temporary file next to the blob and only replaces the blob on
+    `close()`, so an abandoned upload leaves the previous generation in place.
+    """
+
+    def __init__(self, blob):
+        self.blob = blob
+        fd, self.temp_path = tempfile.mkstemp(dir=blob.path.parent, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+        self.closed = False
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+            self.blob.finalize(self.temp_path)
+
+    def discard(self):
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+            os.unlink(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,40 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_COMPRESSION = "zstd"
+# Rows per Parquet row group; each group gets its own zone map, so smaller groups let filters skip more
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", "65536"))
+
+
+def working_copy_name(dataset_name):
+    """Blob name of the compressed columnar working copy of a dataset."""
+    return f"{dataset_name}.parquet"
+
+
+def is_columnar(manifest):
+    return bool(manifest) and manifest.get('format') == 'parquet'
+
+
+def write_parquet(df, target):
+    """Write a working copy to a path, file object or Arrow output stream and return its footer metadata."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(target, table.schema, compression=PARQUET_COMPRESSION) as writer:
+        writer.write_table(table, row_group_size=PARQUET_ROW_GROUP_ROWS)
+    return writer.writer.metadata
+
+
+def read_parquet(file_path, columns=None):
+    """
+    Read a local working copy. The file is memory-mapped, so pages are decoded
+    straight from the page cache instead of being read into a buffer first.
+    """
+    return pd.read_parquet(file_path, columns=columns, memory_map=True)
+
+
+def read_row_groups(source, row_groups, columns=None):
+    """Read only some row groups of a Parquet file object; a remote file only has those byte ranges fetched."""
+    return pq.ParquetFile(source).read_row_groups(row_groups, columns=columns).to_pandas()
+
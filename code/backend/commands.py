@@ -0,0 +1,18 @@
+def parse_command(command):
+    """
+    Parse a transformation command into (operation, arguments).
+
+    Shared by every execution engine so they accept exactly the same commands.
+    """
+    if command.startswith("remove column"):
+        column = command.split("remove column")[-1].strip()
+        return "remove", {"column": column}
+    elif command.startswith("rename column"):
+        parts = command.split("rename column")[-1].strip().split("to")
+        if len(parts) == 2:
+            return "rename", {"old_name": parts[0].strip(), "new_name": parts[1].strip()}
+        raise ValueError("Invalid rename command. Use 'rename column <old_name> to <new_name>'.")
+    elif command.startswith("filter rows where"):
+        condition = command.split("filter rows where")[-1].strip()
+        return "filter", {"condition": condition}
+    raise ValueError("")
@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Text columns with at most this share of distinct values are stored as categories
+CATEGORY_MAX_RATIO = float(os.getenv("CATEGORY_MAX_RATIO", "0.5"))
+ARROW_STRING = "string[pyarrow]"
+
+
+def compact_frame(df):
+    """
+    The same data with the smallest lossless dtypes: integers and floats are
+    downcast, low-cardinality text becomes a category and other text an
+    Arrow-backed string.
+
+    Run once when a dataset is uploaded; the working copy keeps these dtypes,
+    so later loads never infer them again.
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_bool_dtype(values.dtype):
+            columns[col] = values
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            columns[col] = pd.to_numeric(values, downcast="integer")
+        elif pd.api.types.is_float_dtype(values.dtype):
+            columns[col] = _downcast_float(values)
+        elif _is_text(values):
+            distinct = values.nunique(dropna=True)
+            if len(values) and distinct <= len(values) * CATEGORY_MAX_RATIO:
+                columns[col] = values.astype("category")
+            else:
+                columns[col] = values.astype(ARROW_STRING)
+        else:
+            columns[col] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+def memory_bytes(df):
+    """Bytes a DataFrame holds in memory, including the contents of strings."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def read_options(dtypes):
+    """
+    `pd.read_csv` keyword arguments that apply recorded dtypes instead of inferring them.
+    """
+    dtype, parse_dates = {}, []
+    for col, name in (dtypes or {}).items():
+        if name.startswith("datetime64"):
+            parse_dates.append(col)
+        elif name == "string":
+            dtype[col] = ARROW_STRING
+        elif name != "object":
+            dtype[col] = name
+    return {"dtype": dtype, "parse_dates": parse_dates}
+
+
+def append_options(dtypes):
+    """
+    `pd.read_csv` keyword arguments for rows appended to a dataset with recorded `dtypes`.
+
+    Text columns stay text even when a batch only has digits or blanks in them
+    and datetime columns are parsed as such. Numbers are still inferred, so a
+    batch may widen them.
+    """
+    dtype, parse_dates = {}, []
+    for col, name in (dtypes or {}).items():
+        if name.startswith("datetime64"):
+            parse_dates.append(col)
+        elif name in ("category", "str", "string", "object"):
+            dtype[col] = "str"
+    return {"dtype": dtype, "parse_dates": parse_dates}
+
+
+def _downcast_float(values):
+    # float32 only when every value survives the round trip
+    narrow = values.astype(np.float32)
+    if np.array_equal(narrow.astype(np.float64).to_numpy(), values.to_numpy(), equal_nan=True):
+        return narrow
+    return values
+
+
+def _is_text(values):
+    if pd.api.types.is_string_dtype(values.dtype) and not isinstance(values.dtype, pd.CategoricalDtype):
+        return pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty")
+    return False
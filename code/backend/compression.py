@@ -0,0 +1,144 @@
+import io
+import os
+from contextlib import contextmanager
+
+import pyarrow as pa
+
+# Codec for the text copies the service stores: uploads that arrive uncompressed and exports
+STORAGE_COMPRESSION = os.getenv("STORAGE_COMPRESSION", "gzip").lower()
+# Unset means the usual command-line default of the codec
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL")) if os.getenv("COMPRESSION_LEVEL") else None
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+# Input of this size is compressed as one gzip member / zstd frame
+COMPRESSION_CHUNK_BYTES = 1024 * 1024
+
+MAGIC_NUMBERS = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+MAGIC_BYTES = max(len(magic) for magic in MAGIC_NUMBERS)
+
+
+def storage_codec():
+    """The configured codec, or None when stored text stays uncompressed."""
+    return None if STORAGE_COMPRESSION in ("", "none") else STORAGE_COMPRESSION
+
+
+def detect_codec(head):
+    """Codec whose magic number starts `head`, or None for uncompressed data."""
+    for magic, codec in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def sniff_stream(stream):
+    """
+    Codec of a stream that cannot be rewound, and a stream that still yields its first bytes.
+    """
+    head = stream.read(MAGIC_BYTES)
+    return detect_codec(head), _Prefixed(head, stream)
+
+
+def open_text(file_path):
+    """
+    Binary file object of a text file's contents, decompressed on the fly when it is compressed.
+
+    The codec is told by the file's magic number, not its name, so a cached
+    download without an extension is read just like the original.
+    """
+    with open(file_path, "rb") as f:
+        codec = detect_codec(f.read(MAGIC_BYTES))
+    if codec is None:
+        return open(file_path, "rb")
+    return pa.input_stream(file_path, compression=codec)
+
+
+def decompressing(stream, codec):
+    """File object yielding the decompressed bytes of a compressed stream as it is read."""
+    return pa.CompressedInputStream(stream, codec)
+
+
+class CompressingWriter(io.RawIOBase):
+    """
+    File-like object that compresses whatever is written to it into `target`.
+
+    Input is compressed in chunks of `chunk_bytes`, each written as its own
+    gzip member or zstd frame. Both formats allow members to be concatenated,
+    so any decoder reads the result as one stream, while memory stays bounded
+    and the level can be chosen, which Arrow's streaming writer does not allow.
+    `close()` flushes the last chunk but leaves `target` open.
+    """
+
+    def __init__(self, target, codec, level=COMPRESSION_LEVEL, chunk_bytes=COMPRESSION_CHUNK_BYTES):
+        self.target = target
+        self.codec = pa.Codec(codec, compression_level=level or DEFAULT_LEVELS.get(codec))
+        self.chunk_bytes = chunk_bytes
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_in += len(data)
+        if len(self._buffer) >= self.chunk_bytes:
+            self._compress()
+        return len(data)
+
+    def tell(self):
+        return self.bytes_in
+
+    def close(self):
+        if not self.closed:
+            if self._buffer:
+                self._compress()
+            super().close()
+
+    def _compress(self):
+        compressed = self.codec.compress(bytes(self._buffer), asbytes=True)
+        self._buffer.clear()
+        self.target.write(compressed)
+        self.bytes_out += len(compressed)
+
+
+@contextmanager
+def compressed(target, codec):
+    """
+    Writer that compresses into `target` with `codec`, or `target` itself when `codec` is None.
+
+    The last chunk is only flushed when the block exits normally.
+    """
+    if codec is None:
+        yield target
+        return
+    writer = CompressingWriter(target, codec)
+    yield writer
+    writer.close()
+
+
+def set_encoding(blob, codec, delimiter=','):
+    """
+    Declare a text blob's type and `Content-Encoding` before it is uploaded.
+
+    Clients that download it are served the compressed bytes and decode them
+    themselves; GCS transcodes gzip for clients that do not accept it.
+    """
+    blob.content_type = "text/csv" if delimiter == ',' else "text/tab-separated-values"
+    blob.content_encoding = codec
+
+
+class _Prefixed(io.RawIOBase):
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.head:
+            data, self.head = self.head[:len(buffer)], self.head[len(buffer):]
+        else:
+            data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
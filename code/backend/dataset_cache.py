@@ -0,0 +1,83 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class DatasetCache:
+    """
+    Per-process LRU cache of parsed DataFrames.
+
+    Entries are keyed by (bucket, blob name, generation) so a rewritten blob can
+    never be served from a stale entry. The cache is bounded by an approximate
+    memory budget measured with `DataFrame.memory_usage(deep=True)`.
+    Cached frames are shared between requests and must not be mutated in place.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, bucket_name, dataset_name, generation):
+        key = (bucket_name, dataset_name, generation)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, bucket_name, dataset_name, generation, dataframe):
+        size = int(dataframe.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return False
+
+        key = (bucket_name, dataset_name, generation)
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (dataframe, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                self._drop(old_key)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, bucket_name, dataset_name):
+        """Drop every cached generation of a blob."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == bucket_name and k[1] == dataset_name]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+dataset_cache = DatasetCache(int(os.getenv("DATASET_CACHE_MB", "512")) * 1024 * 1024)
@@ -0,0 +1,199 @@
+import os
+
+import duckdb
+
+from columnar import PARQUET_ROW_GROUP_ROWS
+from plan import compile_plan
+from predicates import like_match
+
+TRANSFORM_ENGINE = os.getenv("TRANSFORM_ENGINE", "auto").lower()
+DUCKDB_MIN_BYTES = int(os.getenv("DUCKDB_MIN_MB", "64")) * 1024 * 1024
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", str(os.cpu_count() or 1)))
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "1GB")
+DUCKDB_TEMP_DIRECTORY = os.getenv("DUCKDB_TEMP_DIRECTORY", "/tmp/duckdb")
+PARQUET_COPY_OPTIONS = f"FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {PARQUET_ROW_GROUP_ROWS}"
+
+
+class EngineFallback(Exception):
+    """Raised when an engine cannot run a command and the pandas path should be used instead."""
+
+
+def select_engine(manifest):
+    """
+    Pick the engine for a transformation: "duckdb" or "pandas".
+
+    DuckDB needs a columnar working copy to read; under "auto" it is only used
+    for datasets large enough that building a DataFrame is the bottleneck.
+    """
+    if not manifest or manifest.get('format') != 'parquet' or TRANSFORM_ENGINE == "pandas":
+        return "pandas"
+    if TRANSFORM_ENGINE == "duckdb":
+        return "duckdb"
+    return "duckdb" if (manifest.get('bytes') or 0) >= DUCKDB_MIN_BYTES else "pandas"
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def predicate_sql(tree):
+    """
+    Translate a predicate tree into a SQL condition.
+
+    Every test is wrapped in COALESCE so NULLs behave as missing values do in
+    pandas: they fail every test except `!=`, and negating a test flips them.
+    """
+    kind = tree[0]
+    if kind in ("and", "or"):
+        return f"({predicate_sql(tree[1])} {kind.upper()} {predicate_sql(tree[2])})"
+    if kind == "not":
+        return f"(NOT {predicate_sql(tree[1])})"
+    if kind == "compare":
+        op, left, right = tree[1:]
+        condition = f"{_operand_sql(left)} {'<>' if op == '!=' else op} {_operand_sql(right)}"
+        return f"COALESCE({condition}, {'TRUE' if op == '!=' else 'FALSE'})"
+
+    column = _operand_sql(tree[1])
+    if kind == "is_null":
+        return f"({column} IS NULL)"
+    if kind == "in":
+        condition = f"{column} IN ({', '.join(_value_sql(value) for value in tree[2])})"
+    elif kind == "between":
+        condition = f"{column} BETWEEN {_value_sql(tree[2])} AND {_value_sql(tree[3])}"
+    else:
+        match, text = like_match(tree[2])
+        if match == "prefix":
+            condition = f"starts_with({column}, {quote_literal(text)})"
+        elif match == "suffix":
+            condition = f"suffix({column}, {quote_literal(text)})"
+        elif match == "contains":
+            condition = f"contains({column}, {quote_literal(text)})"
+        else:
+            condition = f"{column} LIKE {quote_literal(tree[2])}"
+    return f"COALESCE({condition}, FALSE)"
+
+
+def parquet_scan(source_path, ordered=False):
+    """`read_parquet` over one file, or over a list of files unified by column name."""
+    if isinstance(source_path, str):
+        return f"read_parquet({quote_literal(source_path)}{', file_row_number = true' if ordered else ''})"
+    options = ", union_by_name = true" + (", filename = true, file_row_number = true" if ordered else "")
+    return f"read_parquet({_paths_sql(source_path)}{options})"
+
+
+def _paths_sql(paths):
+    return "[" + ", ".join(quote_literal(path) for path in paths) + "]"
+
+
+def _operand_sql(operand):
+    return quote_identifier(operand[1]) if operand[0] == "column" else _value_sql(operand[1])
+
+
+def _value_sql(value):
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, str):
+        return quote_literal(value)
+    return repr(value)
+
+
+class DuckDBEngine:
+    """
+    Runs transformation plans as SQL over a staged Parquet file.
+
+    Results are written straight to Parquet with `COPY`, so no DataFrame is ever
+    built and DuckDB is free to stream, spill to disk and use every core.
+    """
+
+    def __init__(self, threads=DUCKDB_THREADS, memory_limit=DUCKDB_MEMORY_LIMIT, temp_directory=DUCKDB_TEMP_DIRECTORY):
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.temp_directory = temp_directory
+
+    def build_query(self, steps, columns, source_path, ordered=False):
+        """
+        Translate plan steps into one query over the Parquet file at `source_path`.
+
+        The plan is merged into a single projection and a conjunction of
+        predicates over the source columns, which DuckDB pushes into the scan.
+        DuckDB may emit the rows that pass an OR filter out of file order, so
+        `ordered` sorts them back by their position in the file.
+        """
+        projection, predicates = compile_plan(steps, columns)
+        select = ", ".join(
+            quote_identifier(source) if source == name else f"{quote_identifier(source)} AS {quote_identifier(name)}"
+            for source, name in projection
+        )
+        ordered = ordered and bool(predicates)
+        query = f"SELECT {select} FROM {parquet_scan(source_path, ordered)}"
+        if predicates:
+            query += " WHERE " + " AND ".join(predicate_sql(tree) for tree in predicates)
+        if ordered:
+            # The parts of a segmented dataset are read in the order they are listed
+            order = "file_row_number" if isinstance(source_path, str) else f"list_position({_paths_sql(source_path)}, filename), file_row_number"
+            query += f" ORDER BY {order}"
+        return query
+
+    def transform_file(self, source_path, target_path, steps, columns):
+        """
+        Apply plan `steps` to the Parquet file at `source_path` and write the result to `target_path`.
+        """
+        self._copy(self.build_query(steps, columns, source_path, ordered=True), target_path, PARQUET_COPY_OPTIONS)
+
+    def count_rows(self, source_path, steps, columns):
+        """
+        Number of rows the plan would produce, without writing anything.
+        """
+        query = self.build_query(steps, columns, source_path)
+        connection = self._connect()
+        try:
+            return connection.execute(f"SELECT count(*) FROM ({query})").fetchone()[0]
+        except duckdb.Error as e:
+            raise EngineFallback(str(e))
+        finally:
+            connection.close()
+
+    def convert_csv(self, source_path, target_path, delimiter=','):
+        """
+        Convert a CSV/TSV file to Parquet out-of-core. Types are sniffed over the whole file.
+        """
+        query = (
+            f"SELECT * FROM read_csv({quote_literal(source_path)}, "
+            f"delim = {quote_literal(delimiter)}, header = true, sample_size = -1)"
+        )
+        self._copy(query, target_path, PARQUET_COPY_OPTIONS)
+
+    def export_file(self, source_path, target_path, delimiter=',', compression=None):
+        """
+        Write the Parquet file at `source_path` out as CSV/TSV, compressed with
+        `compression` (gzip or zstd, at DuckDB's own level) when given.
+        """
+        query = f"SELECT * FROM {parquet_scan(source_path)}"
+        options = f"FORMAT CSV, HEADER, DELIMITER {quote_literal(delimiter)}"
+        if compression:
+            options += f", COMPRESSION {quote_literal(compression)}"
+        self._copy(query, target_path, options)
+
+    def _connect(self):
+        connection = duckdb.connect()
+        connection.execute(f"SET threads TO {int(self.threads)}")
+        connection.execute(f"SET memory_limit = {quote_literal(self.memory_limit)}")
+        connection.execute(f"SET temp_directory = {quote_literal(self.temp_directory)}")
+        return connection
+
+    def _copy(self, query, target_path, options):
+        connection = self._connect()
+        try:
+            connection.execute(f"COPY ({query}) TO {quote_literal(target_path)} ({options})")
+        except duckdb.Error as e:
+            # Bad conditions are reported by the pandas path with its usual message
+            raise EngineFallback(str(e))
+        finally:
+            connection.close()
+
+
+duckdb_engine = DuckDBEngine()
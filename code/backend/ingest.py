@@ -0,0 +1,109 @@
+import csv
+import io
+
+HEAD_BYTES = 64 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+DELIMITER_NAMES = {',': 'CSV', '\t': 'TSV', ';': 'semicolon', '|': 'pipe'}
+
+
+class UploadInspector:
+    """
+    Validates and measures an upload while its bytes pass through.
+
+    The head of the stream is checked as soon as it has arrived (declared
+    delimiter, header and a consistent column count), so a bad file is rejected
+    before the rest of it is forwarded anywhere. Bytes and lines are counted on
+    the way through.
+    """
+
+    def __init__(self, delimiter=',', head_bytes=HEAD_BYTES):
+        self.delimiter = delimiter
+        self.head_bytes = head_bytes
+        self.bytes = 0
+        self.lines = 0
+        self.columns = None
+        self._head = bytearray()
+        self._validated = False
+
+    def feed(self, chunk):
+        self.bytes += len(chunk)
+        self.lines += chunk.count(b'\n')
+        if not self._validated:
+            self._head.extend(chunk)
+            if len(self._head) >= self.head_bytes:
+                self._validate(complete=False)
+
+    def finish(self):
+        """Validate files shorter than the head once the whole stream has been seen."""
+        if not self._validated:
+            self._validate(complete=True)
+
+    def _validate(self, complete):
+        self._validated = True
+        text = bytes(self._head).decode('utf-8', errors='replace')
+        self._head = bytearray()
+
+        # Records with the line each starts on; a quoted field may span several lines
+        reader = csv.reader(io.StringIO(text), delimiter=self.delimiter)
+        records, start = [], 1
+        for row in reader:
+            records.append((start, row))
+            start = reader.line_num + 1
+        if not complete and len(records) > 1:
+            # The last record may be cut off, even inside a quoted field
+            records.pop()
+
+        if not records or not any(field.strip() for field in records[0][1]):
+            raise ValueError("The file is empty or has no header row.")
+
+        header = records[0][1]
+        if len(header) == 1:
+            self._check_delimiter(text.partition('\n')[0])
+        self.columns = len(header)
+
+        for line_number, row in records[1:]:
+            if row and len(row) != len(header):
+                raise ValueError(f"Line {line_number} has {len(row)} fields, expected {len(header)}.")
+
+    def _check_delimiter(self, header_line):
+        try:
+            sniffed = csv.Sniffer().sniff(header_line, delimiters=''.join(DELIMITER_NAMES)).delimiter
+        except csv.Error:
+            return
+        if sniffed != self.delimiter:
+            raise ValueError(
+                f"The file looks {DELIMITER_NAMES[sniffed]}-delimited, not {DELIMITER_NAMES.get(self.delimiter, self.delimiter)}."
+            )
+
+
+class TeeReader(io.RawIOBase):
+    """
+    File object that forwards every byte read from `source` to `sinks` and, when given, an inspector.
+
+    Lets a parser consume an upload while the same bytes go to storage, so the
+    upload is only read once.
+    """
+
+    def __init__(self, source, sinks, inspector=None):
+        self.source = source
+        self.sinks = sinks
+        self.inspector = inspector
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.source.read(len(buffer))
+        if not data:
+            return 0
+        if self.inspector is not None:
+            self.inspector.feed(data)
+        for sink in self.sinks:
+            sink.write(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def drain(self):
+        """Read whatever the consumer left unread so the sinks see the whole stream."""
+        while self.read(COPY_CHUNK_BYTES):
+            pass
@@ -0,0 +1,139 @@
+import contextvars
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from streaming import STREAMING_CHUNK_BYTES
+
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+# Serialized chunks an upload may fall behind by before the producer waits for it
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", "4"))
+# In-memory frames at least this large are uploaded while they are serialized instead of after
+PIPELINED_UPLOAD_MIN_BYTES = int(os.getenv("PIPELINED_UPLOAD_MIN_MB", "16")) * 1024 * 1024
+
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+
+def submit_io(fn, *args, **kwargs):
+    """
+    Run `fn` on the shared I/O pool and return its future.
+
+    It runs in a copy of the caller's context, so its spans and storage calls
+    are attributed to the request or job that submitted it.
+    """
+    context = contextvars.copy_context()
+    return io_executor.submit(context.run, fn, *args, **kwargs)
+
+
+class _Aborted(Exception):
+    pass
+
+
+_ABORT = object()
+
+
+class PipeWriter:
+    """
+    File-like object whose bytes are handed to an upload running on the I/O pool.
+
+    Writes are collected into chunks of `chunk_bytes`; at most `depth` chunks
+    wait for the upload, so serialization and the network transfer overlap
+    while memory stays bounded.
+    """
+
+    def __init__(self, future_factory, chunk_bytes=STREAMING_CHUNK_BYTES, depth=PIPELINE_DEPTH):
+        self.chunk_bytes = chunk_bytes
+        self.chunks = queue.Queue(maxsize=depth)
+        self.closed = False
+        self._buffer = bytearray()
+        self._position = 0
+        self.future = future_factory(self.chunks)
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self.chunk_bytes:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Send the remaining bytes and wait for the upload to be finalized."""
+        if not self.closed:
+            self.closed = True
+            if self._buffer:
+                self._put(bytes(self._buffer))
+            self._put(None)
+            self.future.result()
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self._put(_ABORT, wait=False)
+            self.future.exception()
+
+    def _put(self, item, wait=True):
+        # Stop waiting as soon as the upload has failed, or the producer would block forever
+        while True:
+            if self.future.done() and self.future.exception() is not None:
+                if wait:
+                    self.future.result()
+                return
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+def _upload_chunks(blob, chunks, open_kwargs):
+    target = blob.open("wb", **open_kwargs)
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if chunk is _ABORT:
+                raise _Aborted()
+            target.write(chunk)
+    except BaseException:
+        # An unfinished upload is never finalized, so the previous generation stays in place
+        discard = getattr(target, "discard", None)
+        if discard is not None:
+            discard()
+        raise
+    target.close()
+
+
+@contextmanager
+def pipelined_upload(blob, chunk_size=STREAMING_CHUNK_BYTES, content_type=None):
+    """
+    Writer whose bytes are uploaded to `blob` by a resumable upload on the I/O pool as they are written.
+
+    The upload is finalized when the block exits normally and abandoned when it
+    raises. Like any resumable upload, the blob's new generation has to be
+    fetched with `reload()` afterwards.
+    """
+    open_kwargs = {"chunk_size": chunk_size, "ignore_flush": True}
+    if content_type:
+        open_kwargs["content_type"] = content_type
+    writer = PipeWriter(lambda chunks: submit_io(_upload_chunks, blob, chunks, open_kwargs), chunk_bytes=chunk_size)
+    try:
+        yield writer
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
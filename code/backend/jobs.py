@@ -0,0 +1,169 @@
+import contextvars
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+_current = threading.local()
+
+
+def report_progress(stage, fraction=None):
+    """Record the progress of the job running on this thread; a no-op outside a job."""
+    job = getattr(_current, "job", None)
+    if job is not None:
+        job["progress"] = {"stage": stage, "fraction": fraction}
+
+
+def record_metrics(**metrics):
+    """Attach measurements to the job running on this thread; a no-op outside a job."""
+    job = getattr(_current, "job", None)
+    if job is not None:
+        job["metrics"].update(metrics)
+
+
+class JobQueue:
+    """
+    In-process job queue with a pool of worker threads.
+
+    Jobs submitted under the same key run one at a time in submission order,
+    while jobs for different keys run in parallel. This is the local stand-in
+    for a Pub/Sub topic with ordering keys: `submit` is the publish side and the
+    workers are the subscribers.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, retention_seconds=JOB_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._jobs = {}
+        self._pending = {}
+        self._ready = deque()
+        self._condition = threading.Condition()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, description, fn, *args):
+        """
+        Queue `fn(*args)` behind every earlier job with the same key and return its job id.
+
+        `fn` returns a (body, status_code) pair, which becomes the job's result.
+        It runs in a copy of the submitter's context, so the request's trace
+        and route carry over to the worker.
+        """
+        job = {
+            "id": str(uuid.uuid4()),
+            "key": key,
+            "description": description,
+            "status": "queued",
+            "progress": {"stage": "queued", "fraction": None},
+            "metrics": {},
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "status_code": None,
+        }
+        with self._condition:
+            self._prune()
+            self._jobs[job["id"]] = job
+            queue = self._pending.setdefault(key, deque())
+            queue.append((job, contextvars.copy_context(), fn, args))
+            # A key with jobs already queued is either running or waiting in `_ready`
+            if len(queue) == 1:
+                self._ready.append(key)
+                self._condition.notify_all()
+        return job["id"]
+
+    def get(self, job_id):
+        """Snapshot of a job's state, or None for unknown (or expired) jobs."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job, metrics=dict(job["metrics"]))
+
+        now = time.time()
+        started, finished = snapshot["started_at"], snapshot["finished_at"]
+        snapshot["timing"] = {
+            "queued_seconds": (started or now) - snapshot["created_at"],
+            "run_seconds": (finished or now) - started if started else None,
+        }
+        return snapshot
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job has finished; returns its snapshot."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._jobs[job_id]["finished_at"] is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        return self.get(job_id)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._ready:
+                    self._condition.wait()
+                key = self._ready.popleft()
+                job, job_context, fn, args = self._pending[key][0]
+                job["status"] = "running"
+                job["started_at"] = time.time()
+
+            _current.job = job
+            try:
+                body, status_code = job_context.run(fn, *args)
+            except Exception as e:
+                traceback.print_exc()
+                body, status_code = {"message": f"Error: {e}"}, 500
+            finally:
+                _current.job = None
+
+            with self._condition:
+                job["result"], job["status_code"] = body, status_code
+                job["status"] = "succeeded" if status_code < 400 else "failed"
+                job["progress"] = {"stage": "finished", "fraction": 1.0}
+                job["finished_at"] = time.time()
+
+                queue = self._pending[key]
+                queue.popleft()
+                if queue:
+                    self._ready.append(key)
+                else:
+                    del self._pending[key]
+                self._condition.notify_all()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if (job["finished_at"] or time.time()) < cutoff]:
+            del self._jobs[job_id]
+
+
+def run_periodically(interval_seconds, fn, name):
+    """
+    Call `fn()` every `interval_seconds` on a daemon thread named `name`, the
+    first time after one interval. Errors are printed and the next round runs
+    anyway. Returns the thread, or None when `interval_seconds` is not positive.
+    """
+    if interval_seconds <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                fn()
+            except Exception:
+                traceback.print_exc()
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+job_queue = JobQueue()
@@ -0,0 +1,63 @@
+import pyarrow.parquet as pq
+
+from compact import memory_bytes
+from zone_maps import build_zone_maps
+
+
+def build_manifest(df, blob, metadata=None):
+    """
+    Build the metadata manifest stored alongside a dataset's columnar working copy.
+
+    The manifest lets metadata commands (`columns`, `size`) answer without
+    downloading or parsing the dataset. Given the working copy's Parquet
+    footer, it also records zone maps that let filters skip row groups.
+    `memory_bytes` is what the frame takes once loaded, for sizing workers.
+    """
+    return {
+        **describe_frame(df),
+        "memory_bytes": memory_bytes(df),
+        "bytes": blob.size,
+        "generation": blob.generation,
+        "format": "parquet",
+        "zone_maps": build_zone_maps(metadata, df) if metadata is not None else None,
+    }
+
+
+def describe_frame(df):
+    """Schema and row count of an in-memory DataFrame."""
+    return {
+        "columns": [str(col) for col in df.columns],
+        "dtypes": {str(col): str(dtype) for col, dtype in df.dtypes.items()},
+        "rows": int(df.shape[0]),
+    }
+
+
+def build_manifest_from_parquet(file_path, blob):
+    """
+    Build a manifest from a Parquet file's footer without reading its data.
+    """
+    metadata = pq.read_metadata(file_path)
+    return build_manifest_from_schema(pq.read_schema(file_path), metadata.num_rows, blob, metadata)
+
+
+def build_manifest_from_schema(schema, rows, blob, metadata=None):
+    """
+    Build a manifest from an Arrow schema and a row count, for results that were never held in memory.
+    """
+    dtypes = schema.empty_table().to_pandas().dtypes
+    return {
+        "columns": list(schema.names),
+        "dtypes": {str(col): str(dtype) for col, dtype in dtypes.items()},
+        "rows": int(rows),
+        "bytes": blob.size,
+        "generation": blob.generation,
+        "format": "parquet",
+        "zone_maps": build_zone_maps(metadata) if metadata is not None else None,
+    }
+
+
+def manifest_for(user_data):
+    """Return the manifest of the dataset that transformations currently run against."""
+    if user_data.get('updated_dataset'):
+        return user_data.get('updated_manifest')
+    return user_data.get('manifest')
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from telemetry import span, annotate, charge_cpu
+
+# bcrypt cost factor for new hashes; each step doubles the CPU time of a hash and of every check
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads that hash and check passwords; the rest of the cores stay free for other routes
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Hashes and checks allowed to wait for a worker; callers beyond that are turned away at once
+PASSWORD_QUEUE = int(os.getenv("PASSWORD_QUEUE", "32"))
+
+
+class PasswordBusy(Exception):
+    """Too many password hashes are already queued; the caller should retry later."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated thread pool instead of the request thread.
+
+    bcrypt releases the GIL, so the pool bounds how many cores a burst of
+    logins can take. At most `workers + queue` operations are admitted at a
+    time; further ones raise PasswordBusy rather than queueing without bound.
+    The CPU time of every operation is charged to the request that asked for it.
+    """
+
+    def __init__(self, workers=PASSWORD_WORKERS, queue=PASSWORD_QUEUE, rounds=BCRYPT_ROUNDS):
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._lock = threading.Lock()
+        self.completed = {"hash": 0, "check": 0}
+        self.rejected = {"hash": 0, "check": 0}
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run("hash", bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, password, hashed):
+        return self._run("check", bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """Whether a stored hash was made with another cost than the configured one."""
+        return int(hashed.split('$')[2]) != self.rounds
+
+    def stats(self):
+        with self._lock:
+            return {"rounds": self.rounds, "completed": dict(self.completed), "rejected": dict(self.rejected)}
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected[operation] += 1
+            raise PasswordBusy(f"Too many password operations are queued; the {operation} was turned away.")
+        try:
+            with span(f"bcrypt.{operation}", rounds=self.rounds):
+                result, cpu_seconds = self._executor.submit(_timed, fn, *args).result()
+                annotate(cpu_seconds=cpu_seconds)
+            charge_cpu("bcrypt", cpu_seconds)
+            with self._lock:
+                self.completed[operation] += 1
+            return result
+        finally:
+            self._slots.release()
+
+
+def _timed(fn, *args):
+    # CPU time of this worker thread only, so time spent waiting in the queue is not counted
+    started = time.thread_time()
+    result = fn(*args)
+    return result, time.thread_time() - started
+
+
+password_hasher = PasswordHasher()
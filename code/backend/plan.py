@@ -0,0 +1,117 @@
+from commands import parse_command
+from predicates import compile_condition, predicate_columns, predicate_mask, rename_columns
+
+
+def plan_step(command):
+    """Normalize a transformation command into a plan step."""
+    operation, args = parse_command(command)
+    return {"op": operation, **args}
+
+
+def plan_schema(manifest, steps):
+    """
+    Columns, dtypes and row count of a dataset after `steps`, without touching the data.
+
+    Raises ValueError for steps that reference missing columns. The row count is
+    None once a filter is pending, since only the data can answer it.
+    """
+    columns = list(manifest['columns'])
+    dtypes = dict(manifest.get('dtypes') or {})
+    rows = manifest.get('rows')
+    for step in steps:
+        if step['op'] == "remove":
+            if step['column'] not in columns:
+                raise ValueError(f"Column '{step['column']}' does not exist in the dataset.")
+            columns.remove(step['column'])
+            dtypes.pop(step['column'], None)
+        elif step['op'] == "rename":
+            if step['old_name'] not in columns:
+                raise ValueError(f"Column '{step['old_name']}' does not exist in the dataset.")
+            columns[columns.index(step['old_name'])] = step['new_name']
+            dtypes[step['new_name']] = dtypes.pop(step['old_name'], 'object')
+        elif step['op'] == "filter":
+            rows = None
+    return {"columns": columns, "dtypes": dtypes, "rows": rows}
+
+
+def filter_predicate(condition, columns, dtypes=None):
+    """
+    Predicate tree of a filter condition, checked against the columns (and dtypes) it runs on.
+    """
+    try:
+        return compile_condition(condition, columns, dtypes)
+    except ValueError as e:
+        raise ValueError(f"Error in filter condition: {e}")
+
+
+def validate_filter(schema, condition):
+    """
+    Check a filter condition against the dataset's schema.
+
+    Catches syntax errors, unknown columns and type mismatches before the plan is ever executed.
+    """
+    filter_predicate(condition, schema['columns'], schema['dtypes'])
+
+
+def compile_plan(steps, source_columns, dtypes=None):
+    """
+    Merge a plan into one projection and a list of predicates over the source columns.
+
+    Returns (projection, predicates): projection is a list of (source, output)
+    column pairs, and each predicate is a predicate tree whose columns have been
+    mapped back from the names they had when the filter was issued to source
+    columns, so filters can all be evaluated against the source in one pass.
+    """
+    names = {col: col for col in source_columns}
+    dtypes = dtypes or {}
+    predicates = []
+    for step in steps:
+        if step['op'] == "remove":
+            names[_source_of(names, step['column'])] = None
+        elif step['op'] == "rename":
+            names[_source_of(names, step['old_name'])] = step['new_name']
+        elif step['op'] == "filter":
+            sources = {name: source for source, name in names.items() if name is not None}
+            step_dtypes = {name: dtypes[source] for name, source in sources.items() if source in dtypes}
+            tree = filter_predicate(step['condition'], list(sources), step_dtypes)
+            predicates.append(rename_columns(tree, sources))
+    projection = [(source, name) for source, name in names.items() if name is not None]
+    return projection, predicates
+
+
+def required_columns(steps, source_columns):
+    """Source columns a plan has to read: the ones it keeps plus the ones its filters test."""
+    projection, predicates = compile_plan(steps, source_columns)
+    needed = {source for source, _ in projection}.union(*(predicate_columns(tree) for tree in predicates))
+    return [col for col in source_columns if col in needed]
+
+
+def execute_plan(df, steps, source_columns=None):
+    """
+    Execute a plan over a DataFrame with a single row selection and a single projection.
+
+    `source_columns` are the columns of the whole dataset when `df` only holds
+    the `required_columns` of the plan.
+    """
+    dtypes = {col: str(dtype) for col, dtype in df.dtypes.items()}
+    projection, predicates = compile_plan(steps, list(df.columns) if source_columns is None else source_columns, dtypes)
+    mask = None
+    for tree in predicates:
+        try:
+            step_mask = predicate_mask(tree, df)
+        except Exception as e:
+            raise ValueError(f"Error in filter condition: {e}")
+        mask = step_mask if mask is None else mask & step_mask
+
+    if mask is not None:
+        df = df[mask]
+    if [source for source, _ in projection] != list(df.columns):
+        df = df[[source for source, _ in projection]]
+    return df.rename(columns={source: name for source, name in projection if source != name})
+
+
+def _source_of(names, column):
+    for source, name in names.items():
+        if name == column:
+            return source
+    raise ValueError(f"Column '{column}' does not exist in the dataset.")
@@ -0,0 +1,316 @@
+import operator
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+
+PREDICATE_CACHE_SIZE = int(os.getenv("PREDICATE_CACHE_SIZE", "1024"))
+
+COMPARISONS = {
+    exp.EQ: "=",
+    exp.NEQ: "!=",
+    exp.GT: ">",
+    exp.GTE: ">=",
+    exp.LT: "<",
+    exp.LTE: "<=",
+}
+# Operator that gives the same result with the operands swapped
+FLIPPED = {"=": "=", "!=": "!=", ">": "<", ">=": "<=", "<": ">", "<=": ">="}
+OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+# Words of the condition syntax itself; a column with one of these names cannot be referenced
+KEYWORDS = {"AND", "OR", "NOT", "IN", "BETWEEN", "IS", "NULL", "LIKE", "TRUE", "FALSE"}
+# String literals and quoted names, `&`/`|` operators and bare names
+_TOKENS = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|(&&?|\|\|?)|(?<![\w.])([A-Za-z_]\w*)""")
+
+
+def normalize_condition(condition):
+    return " ".join(condition.split())
+
+
+def _to_sql(condition, columns=()):
+    """
+    The condition in MySQL syntax. `&` and `|` become AND and OR, which bind
+    looser than comparisons, as in pandas `query`; MySQL's bitwise operators
+    bind tighter. Names of `columns` are quoted, so columns called e.g. `Key`
+    are not read as keywords.
+    """
+    def rewrite(match):
+        quoted, logical, name = match.groups()
+        if logical:
+            return " AND " if logical[0] == "&" else " OR "
+        if name and name in columns and name.upper() not in KEYWORDS:
+            return f"`{name}`"
+        return match.group(0)
+
+    return _TOKENS.sub(rewrite, condition)
+
+
+@lru_cache(maxsize=PREDICATE_CACHE_SIZE)
+def _parse(condition, columns=()):
+    # MySQL's dialect reads "text" as a string and `name` as a column, like pandas `query`
+    try:
+        tree = sqlglot.parse_one(_to_sql(condition, columns), read="mysql")
+    except sqlglot.errors.SqlglotError:
+        raise ValueError(f"Could not parse the condition '{condition}'.")
+    return _convert(tree)
+
+
+def parse_condition(condition, columns=()):
+    """
+    Parse a filter condition into a predicate tree.
+
+    The tree is built from nested tuples:
+
+    - ("and" | "or", left, right), ("not", operand)
+    - ("compare", op, ("column", name), ("column", name) | ("literal", value))
+    - ("in", column, values), ("between", column, low, high)
+    - ("is_null", column), ("like", column, pattern)
+
+    Only these forms are accepted, so a condition can never run arbitrary
+    code. Given the dataset's `columns`, names that are also SQL keywords can
+    be referenced. Trees are cached by the condition's normalized text.
+    """
+    return _parse(normalize_condition(condition), tuple(columns))
+
+
+@lru_cache(maxsize=PREDICATE_CACHE_SIZE)
+def _compile(condition, columns, dtypes):
+    tree = _parse(condition, columns)
+    _check(tree, set(columns), dict(dtypes))
+    return tree
+
+
+def compile_condition(condition, columns, dtypes=None):
+    """
+    Parse a condition and check it against a schema; raises ValueError for
+    unknown columns and for comparisons the column's type cannot support.
+
+    Results are cached by normalized text and schema.
+    """
+    dtypes = tuple(sorted((col, str(dtype)) for col, dtype in (dtypes or {}).items()))
+    return _compile(normalize_condition(condition), tuple(columns), dtypes)
+
+
+def predicate_columns(tree):
+    """Names of the columns a predicate reads."""
+    kind = tree[0]
+    if kind in ("and", "or", "not"):
+        return set().union(*(predicate_columns(part) for part in tree[1:]))
+    if kind == "compare":
+        return {operand[1] for operand in tree[2:] if operand[0] == "column"}
+    return {tree[1][1]}
+
+
+def rename_columns(tree, names):
+    """Predicate tree with its column references renamed through `names`."""
+    kind = tree[0]
+    if kind in ("and", "or", "not"):
+        return (kind,) + tuple(rename_columns(part, names) for part in tree[1:])
+    if kind == "compare":
+        return tree[:2] + tuple(
+            ("column", names.get(operand[1], operand[1])) if operand[0] == "column" else operand for operand in tree[2:]
+        )
+    return (kind, ("column", names.get(tree[1][1], tree[1][1]))) + tree[2:]
+
+
+def predicate_mask(tree, df):
+    """
+    Evaluate a predicate over a DataFrame as a NumPy boolean mask.
+
+    Missing values never match, except for `!=`, which keeps them, as pandas
+    comparisons do.
+    """
+    kind = tree[0]
+    if kind == "and":
+        return predicate_mask(tree[1], df) & predicate_mask(tree[2], df)
+    if kind == "or":
+        return predicate_mask(tree[1], df) | predicate_mask(tree[2], df)
+    if kind == "not":
+        return ~predicate_mask(tree[1], df)
+
+    if kind == "compare":
+        op, left, right = tree[1:]
+        ordering = op not in ("=", "!=")
+        other = _values(df, right[1], ordering) if right[0] == "column" else right[1]
+        return _as_mask(OPERATORS[op](_values(df, left[1], ordering), other), missing=op == "!=")
+
+    values = df[tree[1][1]]
+    if kind == "in":
+        return _as_mask(values.isin(tree[2]))
+    if kind == "between":
+        values = _values(df, tree[1][1], ordering=True)
+        return _as_mask(values >= tree[2]) & _as_mask(values <= tree[3])
+    if kind == "is_null":
+        return values.isna().to_numpy(dtype=bool)
+    if kind == "like":
+        match, text = like_match(tree[2])
+        strings = values.str
+        if match == "prefix":
+            result = strings.startswith(text)
+        elif match == "suffix":
+            result = strings.endswith(text)
+        elif match == "contains":
+            result = strings.contains(text, regex=False)
+        elif match == "equals":
+            result = values == text
+        else:
+            result = strings.fullmatch(text)
+        return _as_mask(result)
+    raise ValueError(f"Unsupported predicate: {kind}")
+
+
+def like_match(pattern):
+    """
+    Classify a LIKE pattern as ("prefix" | "suffix" | "contains" | "equals", text)
+    or ("regex", expression), so the common forms avoid regular expressions.
+    """
+    body = pattern.strip("%")
+    if "%" not in body and "_" not in body:
+        starts, ends = pattern.startswith("%"), pattern.endswith("%")
+        if starts and ends:
+            return "contains", body
+        if ends:
+            return "prefix", body
+        if starts:
+            return "suffix", body
+        return "equals", body
+    regex = "".join(".*" if char == "%" else "." if char == "_" else re.escape(char) for char in pattern)
+    return "regex", regex
+
+
+def _values(df, column, ordering=False):
+    values = df[column]
+    # Unordered categories only support equality, so order by the underlying values instead
+    if ordering and isinstance(values.dtype, pd.CategoricalDtype) and not values.cat.ordered:
+        return values.astype(values.cat.categories.dtype)
+    return values
+
+
+def _as_mask(result, missing=False):
+    if isinstance(result, pd.Series):
+        if result.dtype != bool:
+            result = result.astype(object).where(result.notna(), missing).astype(bool)
+        return result.to_numpy(dtype=bool)
+    return np.asarray(result, dtype=bool)
+
+
+def _convert(node):
+    if isinstance(node, exp.Paren):
+        return _convert(node.this)
+    if isinstance(node, (exp.And, exp.BitwiseAnd)):
+        return ("and", _convert(node.this), _convert(node.expression))
+    if isinstance(node, (exp.Or, exp.BitwiseOr)):
+        return ("or", _convert(node.this), _convert(node.expression))
+    if isinstance(node, (exp.Not, exp.BitwiseNot)):
+        return ("not", _convert(node.this))
+    if type(node) in COMPARISONS:
+        op = COMPARISONS[type(node)]
+        left, right = _operand(node.this), _operand(node.expression)
+        if left[0] == "literal":
+            if right[0] == "literal":
+                raise ValueError(f"The condition '{node.sql()}' does not reference a column.")
+            left, right, op = right, left, FLIPPED[op]
+        return ("compare", op, left, right)
+    if isinstance(node, exp.In):
+        values = tuple(_literal(value) for value in node.expressions)
+        if not values:
+            raise ValueError(f"'{node.sql()}' needs a list of values.")
+        return ("in", _column(node.this), values)
+    if isinstance(node, exp.Between):
+        return ("between", _column(node.this), _literal(node.args['low']), _literal(node.args['high']))
+    if isinstance(node, exp.Is) and isinstance(node.expression, exp.Null):
+        return ("is_null", _column(node.this))
+    if isinstance(node, exp.Like):
+        pattern = _literal(node.expression)
+        if not isinstance(pattern, str):
+            raise ValueError(f"LIKE needs a text pattern: '{node.sql()}'.")
+        return ("like", _column(node.this), pattern)
+    raise ValueError(f"Unsupported expression in the condition: '{node.sql()}'.")
+
+
+def _operand(node):
+    if isinstance(node, exp.Paren):
+        return _operand(node.this)
+    if isinstance(node, exp.Column):
+        return _column(node)
+    return ("literal", _literal(node))
+
+
+def _column(node):
+    if not isinstance(node, exp.Column) or node.table:
+        raise ValueError(f"Expected a column name, got '{node.sql()}'.")
+    return ("column", node.name)
+
+
+def _literal(node):
+    if isinstance(node, exp.Neg):
+        value = _literal(node.this)
+        if isinstance(value, (bool, str)):
+            raise ValueError(f"Cannot negate '{node.this.sql()}'.")
+        return -value
+    if isinstance(node, exp.Boolean):
+        return node.this
+    if isinstance(node, exp.Literal):
+        if node.is_string:
+            return node.this
+        number = float(node.this)
+        return int(number) if number.is_integer() and "." not in node.this and "e" not in node.this.lower() else number
+    if isinstance(node, exp.Null):
+        raise ValueError("Use 'IS NULL' or 'IS NOT NULL' to check for missing values.")
+    raise ValueError(f"Expected a value, got '{node.sql()}'.")
+
+
+def _type_of(dtype):
+    if dtype is None:
+        return None
+    dtype = dtype.lower()
+    if dtype.startswith(("int", "uint", "float")):
+        return "number"
+    if dtype in ("str", "string") or dtype.startswith("string"):
+        return "text"
+    if dtype.startswith("bool"):
+        return "bool"
+    return None
+
+
+def _check(tree, columns, dtypes):
+    kind = tree[0]
+    if kind in ("and", "or", "not"):
+        for part in tree[1:]:
+            _check(part, columns, dtypes)
+        return
+
+    column = tree[2][1] if kind == "compare" else tree[1][1]
+    for name in predicate_columns(tree):
+        if name not in columns:
+            raise ValueError(f"Column '{name}' does not exist in the dataset.")
+
+    column_type = _type_of(dtypes.get(column))
+    if kind == "compare":
+        values = [tree[3][1]] if tree[3][0] == "literal" else []
+    elif kind == "in":
+        values = list(tree[2])
+    elif kind == "between":
+        values = [tree[2], tree[3]]
+    elif kind == "like":
+        if column_type in ("number", "bool"):
+            raise ValueError(f"Column '{column}' is not text, so it cannot be matched with LIKE.")
+        values = []
+    else:
+        values = []
+
+    for value in values:
+        value_type = "text" if isinstance(value, str) else "bool" if isinstance(value, bool) else "number"
+        if column_type == "number" and value_type == "text" or column_type == "text" and value_type != "text":
+            raise ValueError(f"Column '{column}' holds {column_type} values and cannot be compared with {value!r}.")
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+
+from sketches import HyperLogLog, TDigest, hash_values
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+def profile_name(dataset_name):
+    """Blob name of the persisted profile of a dataset's working copy."""
+    return f"{dataset_name}.profile.json"
+
+
+class ColumnProfile:
+    """
+    Mergeable summary of one column: null count, min/max, mean and variance,
+    plus sketches for the distinct count and quantiles.
+
+    Numbers, booleans and datetimes (as nanoseconds) get moments and quantiles;
+    text only gets its distinct count and lexicographic min/max. Moments are
+    combined with Chan's parallel formulas, so profiling a file chunk by chunk
+    and merging gives the same result as profiling it at once.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.distinct = HyperLogLog()
+        self.digest = TDigest() if kind != "text" else None
+
+    @classmethod
+    def of_series(cls, values):
+        profile = cls(column_kind(values.dtype))
+        present = values.dropna()
+        profile.count = len(present)
+        profile.nulls = len(values) - len(present)
+        profile.distinct.add(hash_values(present))
+        if not len(present):
+            return profile
+
+        if profile.kind == "text":
+            text = present.astype(str)
+            profile.min, profile.max = text.min(), text.max()
+            return profile
+
+        numbers = _numbers(present, profile.kind)
+        profile.min, profile.max = _scalar(numbers.min()), _scalar(numbers.max())
+        profile.mean = float(numbers.mean())
+        profile.m2 = float(((numbers - profile.mean) ** 2).sum())
+        profile.digest.add(numbers)
+        return profile
+
+    def merge(self, other):
+        merged = ColumnProfile(self.kind)
+        merged.count = self.count + other.count
+        merged.nulls = self.nulls + other.nulls
+        merged.min = _pick(min, self.min, other.min)
+        merged.max = _pick(max, self.max, other.max)
+        if merged.count:
+            delta = other.mean - self.mean
+            merged.mean = self.mean + delta * other.count / merged.count
+            merged.m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / merged.count
+        merged.distinct = self.distinct.merge(other.distinct)
+        if self.digest is not None:
+            merged.digest = self.digest.merge(other.digest)
+        return merged
+
+    def std(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else None
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "count": self.count,
+            "nulls": self.nulls,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "m2": self.m2,
+            "distinct": self.distinct.to_dict(),
+            "digest": self.digest.to_dict() if self.digest is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        profile = cls(data["kind"])
+        profile.count, profile.nulls = data["count"], data["nulls"]
+        profile.min, profile.max = data["min"], data["max"]
+        profile.mean, profile.m2 = data["mean"], data["m2"]
+        profile.distinct = HyperLogLog.from_dict(data["distinct"])
+        profile.digest = TDigest.from_dict(data["digest"]) if data["digest"] is not None else None
+        return profile
+
+
+class DatasetProfile:
+    """Column profiles of a dataset, in column order; merges chunk by chunk."""
+
+    def __init__(self, columns=None, rows=0):
+        self.columns = columns or {}
+        self.rows = rows
+
+    @classmethod
+    def of_frame(cls, df):
+        return cls({col: ColumnProfile.of_series(df[col]) for col in df.columns}, len(df))
+
+    def merge(self, other):
+        if not self.columns:
+            return other
+        columns = {col: profile.merge(other.columns[col]) for col, profile in self.columns.items()}
+        return DatasetProfile(columns, self.rows + other.rows)
+
+    def to_dict(self):
+        return {"rows": self.rows, "columns": {col: profile.to_dict() for col, profile in self.columns.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({col: ColumnProfile.from_dict(profile) for col, profile in data["columns"].items()}, data["rows"])
+
+
+def profile_chunks(chunks):
+    """Profile of a dataset read as a sequence of DataFrames, in one pass."""
+    profile = DatasetProfile()
+    for chunk in chunks:
+        profile = profile.merge(DatasetProfile.of_frame(chunk))
+    return profile
+
+
+def column_kind(dtype):
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_numeric_dtype(dtype):
+        return "numeric"
+    return "text"
+
+
+def format_profile(profile, column=None):
+    """Chat message describing every column, or just `column`."""
+    if column is not None and column not in profile.columns:
+        raise ValueError(f"Column '{column}' does not exist in the dataset.")
+    columns = [column] if column is not None else list(profile.columns)
+    blocks = [f"Rows: {profile.rows}"]
+    for col in columns:
+        blocks.append(_format_column(col, profile.columns[col]))
+    return "\n\n".join(blocks)
+
+
+def _format_column(name, profile):
+    show = (lambda v: _timestamp(v)) if profile.kind == "datetime" else _number
+    lines = [
+        f"{name} ({profile.kind})",
+        f"● nulls: {profile.nulls}",
+        f"● distinct: ~{profile.distinct.estimate()}",
+    ]
+    if profile.count:
+        lines.append(f"● min: {show(profile.min)}, max: {show(profile.max)}")
+    if profile.kind != "text" and profile.count:
+        std = profile.std()
+        if profile.kind == "datetime":
+            spread = pd.Timedelta(int(std), unit="ns") if std is not None else "n/a"
+        else:
+            spread = _number(std) if std is not None else "n/a"
+        lines.append(f"● mean: {show(profile.mean)}, std: {spread}")
+        quantiles = ", ".join(f"p{int(q * 100)}: {show(profile.digest.quantile(q))}" for q in QUANTILES)
+        lines.append(f"● ~{quantiles}")
+    return "\n".join(lines)
+
+
+def _numbers(values, kind):
+    if kind == "datetime":
+        return values.astype("datetime64[ns]").astype(np.int64).to_numpy(dtype=np.float64)
+    return values.astype(np.float64).to_numpy()
+
+
+def _scalar(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _pick(choose, a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return choose(a, b)
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+def _timestamp(value):
+    return str(pd.Timestamp(int(value))) if value is not None else "n/a"
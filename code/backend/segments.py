@@ -0,0 +1,184 @@
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from columnar import working_copy_name
+
+# Appended segments smaller than this are merged by compaction
+SEGMENT_COMPACT_BYTES = int(os.getenv("SEGMENT_COMPACT_MB", "64")) * 1024 * 1024
+# Compaction runs once this many small segments follow each other
+SEGMENT_COMPACT_COUNT = int(os.getenv("SEGMENT_COMPACT_COUNT", "8"))
+
+
+def segment_name(dataset_name):
+    """Name of a new segment of a dataset; like a dataset, it has a working copy of its own."""
+    return f"{dataset_name}.segment-{uuid.uuid4().hex[:12]}"
+
+
+def dataset_segments(manifest):
+    """Segments appended to a dataset, in row order after the base working copy."""
+    return list((manifest or {}).get('segments') or [])
+
+
+def part_names(dataset_name, segments=None):
+    """Working copy blob names of every part of a dataset, in row order."""
+    return [working_copy_name(dataset_name)] + [working_copy_name(segment['name']) for segment in segments or []]
+
+
+def dataset_version(manifest):
+    """
+    Generations of every part of a dataset. It changes whenever rows are
+    appended or segments are compacted, unlike the base generation.
+    """
+    return [(manifest or {}).get('generation')] + [segment['generation'] for segment in dataset_segments(manifest)]
+
+
+def check_segment(manifest, segment_manifest):
+    """
+    Raise ValueError unless rows with `segment_manifest`'s schema can be appended to the dataset.
+
+    Columns must match by name and order. Types may differ in width, e.g.
+    int16 and int64, but not in kind: text cannot be added to a number column.
+    """
+    expected, got = manifest['columns'], segment_manifest['columns']
+    if expected != got:
+        raise ValueError(f"Appended rows must have the columns {expected}, got {got}.")
+    for col in expected:
+        kind, new_kind = _kind(manifest['dtypes'][col]), _kind(segment_manifest['dtypes'][col])
+        if kind != new_kind:
+            raise ValueError(f"Column '{col}' holds {kind} values, but the appended rows have {new_kind} values.")
+
+
+def append_segment(manifest, name, segment_manifest):
+    """Manifest of a dataset after the segment `name` has been appended to it."""
+    segments = dataset_segments(manifest) + [segment_entry(name, segment_manifest)]
+    manifest = _with_segments(manifest, segments)
+    manifest['dtypes'] = {col: _widen(dtype, segment_manifest['dtypes'][col]) for col, dtype in manifest['dtypes'].items()}
+    # The downloadable copy lacks the new rows; it is exported again on the next download
+    manifest['export_generation'] = None
+    return manifest
+
+
+def replace_segments(manifest, start, end, name, segment_manifest):
+    """Manifest of a dataset after segments[start:end] have been merged into the segment `name`."""
+    segments = dataset_segments(manifest)
+    segments[start:end] = [segment_entry(name, segment_manifest)]
+    return _with_segments(manifest, segments)
+
+
+def segment_entry(name, segment_manifest):
+    return {
+        "name": name,
+        "rows": segment_manifest['rows'],
+        "bytes": segment_manifest['bytes'],
+        "memory_bytes": segment_manifest.get('memory_bytes') or 0,
+        "generation": segment_manifest['generation'],
+        # The uploaded original of the segment, kept until it is compacted
+        "export_generation": segment_manifest.get('export_generation'),
+    }
+
+
+def segment_blobs(segment):
+    """Blob names of a segment mapped to their recorded generations, for `delete_blobs`."""
+    return {segment['name']: segment.get('export_generation'), working_copy_name(segment['name']): segment['generation']}
+
+
+def compaction_run(manifest):
+    """
+    (start, end) of the longest run of consecutive small segments, when it is
+    long enough to be worth merging; None otherwise.
+    """
+    best, start = None, None
+    segments = dataset_segments(manifest)
+    for index, segment in enumerate(segments + [None]):
+        if segment is not None and segment['bytes'] < SEGMENT_COMPACT_BYTES:
+            start = index if start is None else start
+            continue
+        if start is not None and (best is None or index - start > best[1] - best[0]):
+            best = (start, index)
+        start = None
+    if best is None or best[1] - best[0] < SEGMENT_COMPACT_COUNT:
+        return None
+    return best
+
+
+def unify_schemas(schemas):
+    """
+    Arrow schema every part of a dataset is read as.
+
+    Numbers are widened to a type that holds every part's values, and a text
+    column that is dictionary-encoded in some parts only is read as plain text.
+    """
+    if len(schemas) == 1:
+        return schemas[0]
+    encoded = set()
+    for name in schemas[0].names:
+        types = [schema.field(name).type for schema in schemas]
+        if all(pa.types.is_dictionary(t) for t in types) and len({t.value_type for t in types}) == 1:
+            encoded.add(name)
+    normalized = []
+    for schema in schemas:
+        fields = [
+            field.with_type(field.type.value_type)
+            if pa.types.is_dictionary(field.type) and field.name not in encoded else field
+            for field in schema.remove_metadata()
+        ]
+        normalized.append(pa.schema(fields))
+    try:
+        return pa.unify_schemas(normalized, promote_options="permissive")
+    except (pa.ArrowTypeError, pa.ArrowInvalid) as e:
+        raise ValueError(f"The segments of the dataset have incompatible types: {e}")
+
+
+def concat_parts(tables):
+    """One table of the parts of a dataset, in order, with their types unified."""
+    schema = unify_schemas([table.schema for table in tables])
+    return pa.concat_tables([cast_part(table, schema) for table in tables])
+
+
+def read_parts(file_paths, columns=None):
+    """Read local working copies of the parts of a dataset as one DataFrame."""
+    return concat_parts([pq.read_table(path, columns=columns, memory_map=True) for path in file_paths]).to_pandas()
+
+
+def cast_part(table, schema):
+    """`table` with the types of `schema`, for the columns it has."""
+    target = pa.schema([schema.field(name) for name in table.schema.names])
+    return table if table.schema.equals(target) else table.cast(target)
+
+
+def _with_segments(manifest, segments):
+    manifest = dict(manifest, segments=segments)
+    base = manifest.get('base') or {key: manifest.get(key) for key in ('rows', 'bytes', 'memory_bytes')}
+    manifest['base'] = base
+    # Totals over every part, so size and engine choices see the whole dataset
+    manifest['rows'] = base['rows'] + sum(segment['rows'] for segment in segments)
+    manifest['bytes'] = (base['bytes'] or 0) + sum(segment['bytes'] for segment in segments)
+    manifest['memory_bytes'] = (base['memory_bytes'] or 0) + sum(segment['memory_bytes'] for segment in segments)
+    return manifest
+
+
+def _widen(dtype, other):
+    # The dtype a column is read as once both parts are unified; see `unify_schemas`
+    if dtype == other:
+        return dtype
+    if _kind(dtype) == "numeric":
+        return str(np.result_type(pd.api.types.pandas_dtype(dtype), pd.api.types.pandas_dtype(other)))
+    if _kind(dtype) == "text":
+        return "str"
+    return dtype
+
+
+def _kind(dtype):
+    dtype = pd.api.types.pandas_dtype(dtype)
+    if pd.api.types.is_bool_dtype(dtype):
+        return "boolean"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    return "text"
@@ -0,0 +1,140 @@
+import base64
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+# 2^HLL_PRECISION one-byte registers per column; the standard error is 1.04 / sqrt(2^precision)
+HLL_PRECISION = int(os.getenv("HLL_PRECISION", "12"))
+# Centroids kept per column is about half of this; more centroids give more accurate quantiles
+TDIGEST_COMPRESSION = int(os.getenv("TDIGEST_COMPRESSION", "200"))
+
+
+def hash_values(values):
+    """
+    64-bit hashes of a Series' non-null values, stable across processes.
+
+    Numbers are hashed at full width, since segments of one column may be
+    downcast differently and a value must hash alike in all of them.
+    """
+    values = values.dropna()
+    if pd.api.types.is_bool_dtype(values.dtype):
+        pass
+    elif pd.api.types.is_unsigned_integer_dtype(values.dtype):
+        values = values.astype(np.uint64)
+    elif pd.api.types.is_integer_dtype(values.dtype):
+        values = values.astype(np.int64)
+    elif pd.api.types.is_float_dtype(values.dtype):
+        values = values.astype(np.float64)
+    return pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter over 64-bit hashes.
+
+    Two sketches with the same precision merge by taking the larger register,
+    so per-chunk sketches combine into the sketch of the whole column.
+    """
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def add(self, hashes):
+        width = 64 - self.precision
+        index = (hashes >> np.uint64(width)).astype(np.intp)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # Rank is the position of the leftmost 1-bit; `rest` is below 2^53, so log2 is exact
+        bits = np.zeros(len(rest), dtype=np.int64)
+        nonzero = rest > 0
+        bits[nonzero] = np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64) + 1
+        np.maximum.at(self.registers, index, (width - bits + 1).astype(np.uint8))
+
+    def merge(self, other):
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {"precision": self.precision, "registers": base64.b64encode(self.registers.tobytes()).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        registers = np.frombuffer(base64.b64decode(data["registers"]), dtype=np.uint8).copy()
+        return cls(data["precision"], registers)
+
+
+class TDigest:
+    """
+    Merging t-digest for approximate quantiles of a numeric column.
+
+    Values are kept as weighted centroids, small at the tails and larger in the
+    middle, so extreme quantiles stay accurate. Digests merge by pooling their
+    centroids and compressing again, which is also how values are added.
+    """
+
+    def __init__(self, compression=TDIGEST_COMPRESSION, means=None, weights=None, minimum=None, maximum=None):
+        self.compression = compression
+        self.means = np.asarray([] if means is None else means, dtype=np.float64)
+        self.weights = np.asarray([] if weights is None else weights, dtype=np.float64)
+        self.min = minimum
+        self.max = maximum
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values):
+            self._merge(values, np.ones(len(values)), float(values.min()), float(values.max()))
+
+    def merge(self, other):
+        result = TDigest(self.compression, self.means, self.weights, self.min, self.max)
+        if len(other.means):
+            result._merge(other.means, other.weights, other.min, other.max)
+        return result
+
+    def quantile(self, q):
+        if not len(self.means):
+            return None
+        # Centroid means sit at the middle of their weight; the exact extremes anchor both ends
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * total, np.r_[0.0, centers, total], np.r_[self.min, self.means, self.max]))
+
+    def _merge(self, means, weights, minimum, maximum):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+
+        # Every centroid joins the cluster of the k-scale unit its left edge falls in
+        total = weights.sum()
+        left = (np.cumsum(weights) - weights) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * left - 1, -1, 1))
+        cluster = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, cluster[1:] != cluster[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+        self.min = minimum if self.min is None else min(self.min, minimum)
+        self.max = maximum if self.max is None else max(self.max, maximum)
+
+    def to_dict(self):
+        return {
+            "compression": self.compression,
+            "means": self.means.tolist(),
+            "weights": self.weights.tolist(),
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["compression"], data["means"], data["weights"], data["min"], data["max"])
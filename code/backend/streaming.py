@@ -0,0 +1,101 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from columnar import PARQUET_COMPRESSION, PARQUET_ROW_GROUP_ROWS
+from plan import compile_plan, required_columns, execute_plan
+from profiling import profile_chunks
+from segments import unify_schemas, cast_part
+
+STREAMING_MIN_BYTES = int(os.getenv("STREAMING_MIN_MB", "128")) * 1024 * 1024
+STREAMING_BATCH_ROWS = int(os.getenv("STREAMING_BATCH_ROWS", "100000"))
+# Resumable upload/download chunk size; GCS requires a multiple of 256 KiB
+STREAMING_CHUNK_BYTES = int(os.getenv("STREAMING_CHUNK_MB", "8")) * 1024 * 1024
+
+
+def use_streaming(manifest):
+    """
+    Whether a dataset is large enough that it must not be loaded into memory at once.
+
+    The size comes from the working copy's blob metadata recorded in the manifest.
+    """
+    return bool(manifest) and manifest.get('format') == 'parquet' and (manifest.get('bytes') or 0) >= STREAMING_MIN_BYTES
+
+
+def plan_output_schema(source_schema, steps):
+    """Arrow schema a plan produces: the projected source fields under their new names."""
+    projection, _ = compile_plan(steps, source_schema.names)
+    return pa.schema([source_schema.field(source).with_name(name) for source, name in projection])
+
+
+def parquet_parts(source):
+    """
+    ParquetFiles of a Parquet file object, or of a list of them, the parts of
+    a segmented dataset, which are read in order as one dataset.
+    """
+    return [pq.ParquetFile(part) for part in (source if isinstance(source, list) else [source])]
+
+
+def parts_schema(parquet_files):
+    return unify_schemas([parquet_file.schema_arrow for parquet_file in parquet_files])
+
+
+def iter_plan_batches(parquet_files, steps, batch_rows=STREAMING_BATCH_ROWS, row_groups=None):
+    """
+    Yield the plan's result as DataFrames of at most `batch_rows` source rows.
+
+    Only the columns the plan needs are read, from `row_groups` when given, and
+    each batch is discarded before the next one is decoded, so memory is
+    bounded by the batch size. Batches of several parts are cast to the types
+    of their unified schema.
+    """
+    schema = parts_schema(parquet_files)
+    columns = required_columns(steps, schema.names)
+    for parquet_file in parquet_files:
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns, row_groups=row_groups):
+            if len(parquet_files) > 1:
+                batch = cast_part(pa.Table.from_batches([batch]), schema)
+            yield execute_plan(batch.to_pandas(), steps, schema.names)
+
+
+def stream_plan(source, target, steps, batch_rows=STREAMING_BATCH_ROWS, row_groups=None):
+    """
+    Execute a plan chunk by chunk from a Parquet file object, or a list of
+    them, into a Parquet file object.
+
+    Returns (schema, rows, metadata) of the written result, where metadata is its Parquet footer.
+    """
+    parquet_files = parquet_parts(source)
+    schema = plan_output_schema(parts_schema(parquet_files), steps)
+    rows = 0
+    with pq.ParquetWriter(target, schema, compression=PARQUET_COMPRESSION) as writer:
+        for chunk in iter_plan_batches(parquet_files, steps, batch_rows, row_groups):
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            writer.write_table(table, row_group_size=PARQUET_ROW_GROUP_ROWS)
+            rows += len(chunk)
+    return schema, rows, writer.writer.metadata
+
+
+def count_plan_rows_streaming(source, steps, batch_rows=STREAMING_BATCH_ROWS, row_groups=None):
+    return sum(len(chunk) for chunk in iter_plan_batches(parquet_parts(source), steps, batch_rows, row_groups))
+
+
+def profile_plan_streaming(source, steps, batch_rows=STREAMING_BATCH_ROWS):
+    """
+    Profile of a plan's result over a Parquet file object, merged batch by batch in one pass.
+    """
+    return profile_chunks(iter_plan_batches(parquet_parts(source), steps, batch_rows))
+
+
+def stream_export(source, target, delimiter=',', batch_rows=STREAMING_BATCH_ROWS):
+    """
+    Write a Parquet file object, or a list of them, out as CSV/TSV text chunk by chunk.
+    """
+    parquet_files = parquet_parts(source)
+    header = True
+    for chunk in iter_plan_batches(parquet_files, [], batch_rows):
+        target.write(chunk.to_csv(index=False, sep=delimiter, header=header).encode('utf-8'))
+        header = False
+    if header:
+        target.write((delimiter.join(parts_schema(parquet_files).names) + "\n").encode('utf-8'))
@@ -0,0 +1,193 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from opentelemetry import context, trace
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor, SpanExporter, SpanExportResult
+
+# Finished spans kept in memory for inspection; older ones are dropped
+TRACE_BUFFER_SPANS = int(os.getenv("TRACE_BUFFER_SPANS", "2048"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Route of the request a span belongs to; carried into job workers with the rest of the context
+current_route = contextvars.ContextVar("current_route", default=None)
+# CPU time of the current request: its start on the request thread and the seconds charged by helper threads
+request_cpu = contextvars.ContextVar("request_cpu", default=None)
+
+
+class SpanBuffer(SpanExporter):
+    """In-memory exporter holding the most recent finished spans."""
+
+    def __init__(self, max_spans=TRACE_BUFFER_SPANS):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        with self._lock:
+            self._spans.extend(spans)
+        return SpanExportResult.SUCCESS
+
+    def get_finished_spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def shutdown(self):
+        self.clear()
+
+
+class LatencyHistograms(SpanProcessor):
+    """
+    Aggregates span durations into latency histograms keyed by route and phase.
+
+    Every span started while a route is current is tagged with it; the phase is
+    the span's `phase` attribute, or its name.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context=None):
+        route = current_route.get()
+        if route is not None and "route" not in span.attributes:
+            span.set_attribute("route", route)
+
+    def on_end(self, span):
+        route = span.attributes.get("route")
+        if route is None:
+            return
+        self.observe(route, span.attributes.get("phase", span.name), (span.end_time - span.start_time) / 1e9)
+
+    def observe(self, route, phase, seconds):
+        key = (route, phase)
+        with self._lock:
+            histogram = self._histograms.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0})
+            histogram["counts"][bisect_left(self.buckets, seconds)] += 1
+            histogram["sum"] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {"counts": list(h["counts"]), "sum": h["sum"]} for key, h in self._histograms.items()}
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self, name="idts_phase_duration_seconds", description="Duration of each phase of a request, by route."):
+        """The histograms in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {name} {description}",
+            f"# TYPE {name} histogram",
+        ]
+        for (route, phase), histogram in sorted(self.snapshot().items()):
+            labels = f'route="{_escape(route)}",phase="{_escape(phase)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram["counts"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def render_counter(name, description, label, values):
+    """A labelled counter in the Prometheus text exposition format."""
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+    for key, value in sorted(values.items()):
+        lines.append(f'{name}{{{label}="{_escape(key)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+span_buffer = SpanBuffer()
+latency_histograms = LatencyHistograms()
+# Same layout, fed with CPU seconds: "request" for the whole request, other phases for work done off its thread
+cpu_histograms = LatencyHistograms()
+tracer_provider = TracerProvider()
+tracer_provider.add_span_processor(latency_histograms)
+tracer_provider.add_span_processor(SimpleSpanProcessor(span_buffer))
+tracer = tracer_provider.get_tracer("intelligent-data-transformation-service")
+
+
+@contextmanager
+def span(name, **attributes):
+    """Run the block inside a child span of the current one; non-scalar attributes are left out."""
+    with tracer.start_as_current_span(name, attributes=_attributes(attributes)) as current:
+        yield current
+
+
+def traced(name):
+    """Decorator that runs the function inside a span called `name`."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+def annotate(**attributes):
+    """Add attributes to the current span; a no-op outside a span."""
+    trace.get_current_span().set_attributes(_attributes(attributes))
+
+
+def start_request(method, route):
+    """
+    Open the root span of an HTTP request and make it current; returns a handle for `end_request`.
+    """
+    route_token = current_route.set(route)
+    cpu_token = request_cpu.set({"start": time.thread_time(), "charged": 0.0})
+    request_span = tracer.start_span(
+        f"{method} {route}",
+        context=context.Context(),
+        attributes={"http.method": method, "http.route": route, "phase": "request"},
+    )
+    context_token = context.attach(trace.set_span_in_context(request_span))
+    return request_span, context_token, route_token, cpu_token
+
+
+def end_request(handle, status_code=None):
+    request_span, context_token, route_token, cpu_token = handle
+    if status_code is not None:
+        request_span.set_attribute("http.status_code", status_code)
+    cpu = request_cpu.get()
+    if cpu is not None:
+        cpu_seconds = time.thread_time() - cpu["start"] + cpu["charged"]
+        request_span.set_attribute("cpu_seconds", cpu_seconds)
+        cpu_histograms.observe(current_route.get(), "request", cpu_seconds)
+    context.detach(context_token)
+    current_route.reset(route_token)
+    request_cpu.reset(cpu_token)
+    request_span.end()
+
+
+def charge_cpu(phase, seconds):
+    """
+    Add CPU time spent on another thread on behalf of the current request, e.g.
+    by a worker pool, to the request's total and to the `phase` histogram.
+    """
+    cpu, route = request_cpu.get(), current_route.get()
+    if cpu is not None:
+        cpu["charged"] += seconds
+    if route is not None:
+        cpu_histograms.observe(route, phase, seconds)
+
+
+def _attributes(attributes):
+    # Only values OpenTelemetry can store; anything else would be dropped with a warning
+    return {key: value for key, value in attributes.items() if isinstance(value, (bool, str, int, float))}
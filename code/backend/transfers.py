@@ -0,0 +1,156 @@
+import base64
+import contextvars
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import google_crc32c
+
+from blob_store import delete_blobs
+from telemetry import span, annotate
+
+# Files at least this large are moved in parts over parallel connections instead of one stream
+PARALLEL_TRANSFER_MIN_BYTES = int(os.getenv("PARALLEL_TRANSFER_MIN_MB", "256")) * 1024 * 1024
+TRANSFER_PART_BYTES = int(os.getenv("TRANSFER_PART_MB", "32")) * 1024 * 1024
+TRANSFER_WORKERS = int(os.getenv("TRANSFER_WORKERS", "8"))
+# Attempts per part before the whole transfer fails
+TRANSFER_ATTEMPTS = int(os.getenv("TRANSFER_ATTEMPTS", "3"))
+# Cloud Storage composes at most this many objects per request
+COMPOSE_MAX_SOURCES = 32
+
+transfer_executor = ThreadPoolExecutor(max_workers=TRANSFER_WORKERS, thread_name_prefix="transfer")
+
+
+class ChecksumMismatch(Exception):
+    """A transferred file or part does not match the CRC32C reported by Cloud Storage."""
+
+
+def download_file(blob, file_path, **kwargs):
+    """
+    Download `blob` to `file_path`, in parallel ranged GETs when it is large.
+
+    The parts are written straight into their place in a preallocated file and
+    are all read from the generation `blob` was loaded at, so a concurrent
+    rewrite cannot mix two versions. Each part is retried on its own; the
+    assembled file is checked against the object's CRC32C.
+    """
+    size = blob.size if isinstance(blob.size, int) else 0
+    if size < PARALLEL_TRANSFER_MIN_BYTES:
+        blob.download_to_filename(file_path, **kwargs)
+        return
+
+    ranges = _parts(size)
+    with span("gcs.parallel_download", bytes=size, parts=len(ranges)):
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            _run_parts(lambda part: _download_part(blob, fd, *part), ranges)
+        finally:
+            os.close(fd)
+        _verify(blob, file_crc32c(file_path))
+
+
+def upload_file(blob, file_path, **kwargs):
+    """
+    Upload `file_path` as `blob`, in parallel part uploads composed server-side when it is large.
+
+    Each part is an object of its own whose CRC32C is checked against the bytes
+    sent, and retried on its own. The parts are composed into `blob`, keeping
+    the content type and encoding set on it, and deleted afterwards. Like
+    `upload_from_filename`, the blob's new generation is known on return.
+    """
+    size = os.path.getsize(file_path)
+    if size < PARALLEL_TRANSFER_MIN_BYTES:
+        blob.upload_from_filename(file_path, **kwargs)
+        return
+
+    if kwargs.get("content_type"):
+        blob.content_type = kwargs["content_type"]
+    bucket = blob.bucket
+    prefix = f"{blob.name}.part-{uuid.uuid4().hex}-"
+    ranges = _parts(size)
+    with span("gcs.parallel_upload", bytes=size, parts=len(ranges)):
+        names = [f"{prefix}{index:05d}" for index in range(len(ranges))]
+        created = list(names)
+        try:
+            with open(file_path, "rb") as source:
+                fd = source.fileno()
+                _run_parts(lambda part: _upload_part(bucket.blob(part[0]), fd, *part[1]), list(zip(names, ranges)))
+            checksum = file_crc32c(file_path)
+
+            # Compose in rounds of at most COMPOSE_MAX_SOURCES until one object is left
+            sources, level = [bucket.blob(name) for name in names], 0
+            while len(sources) > COMPOSE_MAX_SOURCES:
+                groups = [sources[i:i + COMPOSE_MAX_SOURCES] for i in range(0, len(sources), COMPOSE_MAX_SOURCES)]
+                sources = []
+                for index, group in enumerate(groups):
+                    target = bucket.blob(f"{prefix}compose-{level}-{index:05d}")
+                    created.append(target.name)
+                    target.compose(group)
+                    sources.append(target)
+                level += 1
+            blob.compose(sources)
+            annotate(compose_rounds=level + 1)
+        finally:
+            # Parts are never needed again, whether or not the upload succeeded
+            delete_blobs(bucket.client, bucket, {name: None for name in created})
+        _verify(blob, checksum)
+
+
+def file_crc32c(file_path):
+    """CRC32C of a file, encoded the way Cloud Storage reports it."""
+    checksum = google_crc32c.Checksum()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(TRANSFER_PART_BYTES)
+            if not chunk:
+                break
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode("ascii")
+
+
+def _parts(size):
+    return [(start, min(start + TRANSFER_PART_BYTES, size)) for start in range(0, size, TRANSFER_PART_BYTES)]
+
+
+def _run_parts(fn, parts):
+    # Parts run in a copy of the caller's context, so their storage calls are counted for it
+    futures = [transfer_executor.submit(contextvars.copy_context().run, _with_retries, fn, part) for part in parts]
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+
+
+def _with_retries(fn, part):
+    for attempt in range(TRANSFER_ATTEMPTS):
+        try:
+            return fn(part)
+        except Exception as e:
+            if attempt == TRANSFER_ATTEMPTS - 1:
+                raise
+            print(f"Retrying part {part} after error: {e}")
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def _download_part(blob, fd, start, end):
+    # Content-encoded blobs are ranged over their stored bytes, which is what the CRC32C covers
+    data = blob.download_as_bytes(start=start, end=end - 1, raw_download=True,
+                                  if_generation_match=blob.generation, checksum=None)
+    if len(data) != end - start:
+        raise ChecksumMismatch(f"Part {start}-{end} of {blob.name} returned {len(data)} bytes")
+    os.pwrite(fd, data, start)
+
+
+def _upload_part(part_blob, fd, start, end):
+    data = os.pread(fd, end - start, start)
+    part_blob.upload_from_string(data, content_type="application/octet-stream", checksum="crc32c")
+    expected = base64.b64encode(google_crc32c.Checksum(data).digest()).decode("ascii")
+    if part_blob.crc32c != expected:
+        raise ChecksumMismatch(f"Part {part_blob.name} was stored with CRC32C {part_blob.crc32c}, expected {expected}")
+
+
+def _verify(blob, checksum):
+    if isinstance(blob.crc32c, str) and blob.crc32c != checksum:
+        raise ChecksumMismatch(f"{blob.name} has CRC32C {blob.crc32c}, but the local file has {checksum}")
@@ -0,0 +1,85 @@
+import copy
+import os
+import threading
+import time
+
+
+class UserCache:
+    """
+    Short-lived read-through cache of Firestore user documents.
+
+    Writes made through this process are applied to the cached copy, so the
+    TTL only bounds how long a write from another process can go unseen.
+    Callers always get their own copy of the document.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._user_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, user_id, data):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(data))
+
+    def apply(self, user_id, fields):
+        """Write-through: apply a Firestore `update()` to the cached copy."""
+        with self._lock:
+            self.writes += 1
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            # Nested field paths are not worth mirroring; drop the entry instead
+            if any('.' in key for key in fields):
+                del self._entries[user_id]
+                return
+            entry[1].update(copy.deepcopy(fields))
+
+    def lock(self, user_id):
+        """
+        Lock that serializes read-modify-write updates of one user's document
+        made outside the user's job queue, e.g. by uploads. Like the cache, it
+        only covers this process.
+        """
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.writes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "firestore_reads": self.misses,
+                "firestore_reads_saved": self.hits,
+                "firestore_writes": self.writes,
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+user_cache = UserCache(float(os.getenv("USER_CACHE_TTL_SECONDS", "5")))
@@ -0,0 +1,189 @@
+import json
+import os
+
+# Firestore documents are capped at 1 MiB, so very large zone maps are left out of the manifest
+ZONE_MAP_MAX_ENTRIES = int(os.getenv("ZONE_MAP_MAX_ENTRIES", "4000"))
+# Serialized size a zone map may take; a user document can hold two manifests (current and updated)
+ZONE_MAP_MAX_BYTES = int(os.getenv("ZONE_MAP_MAX_KB", "256")) * 1024
+# Text bounds longer than this are stored as prefixes that still bound every value
+ZONE_MAP_TEXT_CHARS = int(os.getenv("ZONE_MAP_TEXT_CHARS", "64"))
+
+NONE, SOME, ALL = "none", "some", "all"
+
+
+def build_zone_maps(metadata, df=None):
+    """
+    Per-row-group min, max and null count of every column, read from a Parquet footer.
+
+    With the DataFrame that was written, distinct counts are added too. Long
+    text bounds are truncated, see `_text_bounds`. Returns None when the file
+    has too many groups and columns to store them, or they take too many bytes.
+    """
+    columns = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    if metadata.num_row_groups * len(columns) > ZONE_MAP_MAX_ENTRIES:
+        return None
+
+    rows, zones = [], {col: [] for col in columns}
+    for group in range(metadata.num_row_groups):
+        row_group = metadata.row_group(group)
+        start = sum(rows)
+        rows.append(row_group.num_rows)
+        for index, col in enumerate(columns):
+            stats = row_group.column(index).statistics
+            zone = {"min": None, "max": None, "nulls": None}
+            if stats is not None:
+                if stats.has_min_max and _storable(stats.min) and _storable(stats.max):
+                    zone["min"], zone["max"] = _text_bounds(stats.min, stats.max)
+                if stats.has_null_count:
+                    zone["nulls"] = stats.null_count
+            if df is not None:
+                zone["distinct"] = int(df[col].iloc[start:start + row_group.num_rows].nunique())
+            zones[col].append(zone)
+    zone_maps = {"rows": rows, "columns": zones}
+    if len(json.dumps(zone_maps).encode('utf-8')) > ZONE_MAP_MAX_BYTES:
+        return None
+    return zone_maps
+
+
+def group_verdicts(tree, zone_maps):
+    """
+    Whether each row group can match a predicate tree: "none", "all" or "some" of its rows.
+    """
+    rows = zone_maps["rows"]
+    kind = tree[0]
+    if kind == "and":
+        return [_and(a, b) for a, b in zip(group_verdicts(tree[1], zone_maps), group_verdicts(tree[2], zone_maps))]
+    if kind == "or":
+        return [_or(a, b) for a, b in zip(group_verdicts(tree[1], zone_maps), group_verdicts(tree[2], zone_maps))]
+    if kind == "not":
+        return [{NONE: ALL, ALL: NONE}.get(verdict, SOME) for verdict in group_verdicts(tree[1], zone_maps)]
+    if kind == "compare" and tree[3][0] == "column":
+        return [SOME] * len(rows)
+
+    column = tree[2][1] if kind == "compare" else tree[1][1]
+    zones = zone_maps["columns"].get(column)
+    if zones is None:
+        return [SOME] * len(rows)
+    verdicts = []
+    for zone, count in zip(zones, rows):
+        try:
+            verdicts.append(_zone_verdict(tree, zone, count))
+        except TypeError:
+            # The literal is not comparable with the column's values
+            verdicts.append(SOME)
+    return verdicts
+
+
+def prune_row_groups(manifest, predicates):
+    """
+    Use a manifest's zone maps to decide which row groups a plan's predicates need.
+
+    Returns (row_groups, rows): the indexes of the groups that may hold
+    matching rows (None when every group has to be read), and the exact
+    number of matching rows when the statistics settle it for every group
+    (None otherwise).
+    """
+    zone_maps = (manifest or {}).get('zone_maps')
+    if not predicates or not zone_maps:
+        return None, None
+
+    verdicts = [ALL] * len(zone_maps["rows"])
+    for tree in predicates:
+        verdicts = [_and(a, b) for a, b in zip(verdicts, group_verdicts(tree, zone_maps))]
+
+    row_groups = [group for group, verdict in enumerate(verdicts) if verdict != NONE]
+    rows = None
+    if SOME not in verdicts:
+        rows = sum(count for count, verdict in zip(zone_maps["rows"], verdicts) if verdict == ALL)
+    return (None if len(row_groups) == len(verdicts) else row_groups), rows
+
+
+def _zone_verdict(tree, zone, count):
+    kind = tree[0]
+    low, high, nulls = zone["min"], zone["max"], zone["nulls"]
+    if kind == "is_null":
+        if nulls is None:
+            return SOME
+        return NONE if nulls == 0 else ALL if nulls == count else SOME
+    if low is None or high is None:
+        return SOME
+    complete = nulls == 0
+
+    if kind == "compare":
+        op, value = tree[1], tree[3][1]
+        if op == "=":
+            if value < low or value > high:
+                return NONE
+            return ALL if complete and low == high == value else SOME
+        if op == "!=":
+            # Missing values pass `!=`
+            if value < low or value > high:
+                return ALL
+            return NONE if complete and low == high == value else SOME
+        if op in (">", ">="):
+            passes_all = low > value if op == ">" else low >= value
+            passes_none = high <= value if op == ">" else high < value
+        else:
+            passes_all = high < value if op == "<" else high <= value
+            passes_none = low >= value if op == "<" else low > value
+        if passes_none:
+            return NONE
+        return ALL if complete and passes_all else SOME
+    if kind == "in":
+        if all(value < low or value > high for value in tree[2]):
+            return NONE
+        return ALL if complete and low == high and low in tree[2] else SOME
+    if kind == "between":
+        lower, upper = tree[2], tree[3]
+        if high < lower or low > upper:
+            return NONE
+        return ALL if complete and low >= lower and high <= upper else SOME
+    if kind == "like" and isinstance(low, str) and not tree[2].startswith(("%", "_")):
+        prefix = tree[2].split("%")[0].split("_")[0]
+        if high[:len(prefix)] < prefix or low[:len(prefix)] > prefix:
+            return NONE
+        if complete and tree[2] == prefix + "%" and low.startswith(prefix) and high.startswith(prefix):
+            return ALL
+    return SOME
+
+
+def _and(a, b):
+    if NONE in (a, b):
+        return NONE
+    return ALL if a == b == ALL else SOME
+
+
+def _or(a, b):
+    if ALL in (a, b):
+        return ALL
+    return NONE if a == b == NONE else SOME
+
+
+def _text_bounds(low, high):
+    """
+    (min, max) with long strings cut to ZONE_MAP_TEXT_CHARS. A prefix of the
+    min is still a lower bound; the max's prefix gets its last character
+    bumped so it stays an upper bound. Both are None when no such bound exists.
+    """
+    if isinstance(low, str) and len(low) > ZONE_MAP_TEXT_CHARS:
+        low = low[:ZONE_MAP_TEXT_CHARS]
+    if isinstance(high, str) and len(high) > ZONE_MAP_TEXT_CHARS:
+        high = _bumped_prefix(high[:ZONE_MAP_TEXT_CHARS])
+        if high is None:
+            return None, None
+    return low, high
+
+
+def _bumped_prefix(prefix):
+    # Smallest string above every string starting with `prefix`; surrogates cannot be stored as UTF-8
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code <= 0x10FFFF:
+            return prefix[:-1] + chr(0xE000 if 0xD800 <= code <= 0xDFFF else code)
+        prefix = prefix[:-1]
+    return None
+
+
+def _storable(value):
+    # Firestore-friendly scalars; other types (timestamps, bytes, decimals) are not used for pruning
+    return isinstance(value, (bool, int, float, str))
@@ -35,10 +35,16 @@ Supported Commands:
   Example: rename column Age to Years
 ● filter rows where <condition>  
   Example: filter rows where Age > 25
+● several transformations separated by ;
+  Example: remove column Age; rename column Name to Who
 ● columns  
   Example: columns (to list all column names)
 ● size  
   Example: size (to get the dataset dimensions)
+● describe [column_name]  
+  Example: describe Age (to get approximate statistics of one or all columns)
+● download  
+  Example: download (to get a download link for the dataset)
 ● change dataset  
   Example: change dataset (to upload or replace your dataset)
         `;
@@ -75,18 +81,33 @@ Supported Commands:
         setIsLoading(true);
 
         try {
+            const headers = { Authorization: `Bearer ${localStorage.getItem('token')}` };
             const response = await axios.post(
                 '/transform',
                 { command: input, useUpdatedDataset },
-                { headers: { Authorization: `Bearer ${localStorage.getItem('token')}` } }
+                { headers }
             );
 
-            const { message, download_url, prompt } = response.data;
+            // Commands run as background jobs; poll until this one has finished
+            let job = (await axios.get(response.data.status_url, { headers })).data;
+            while (job.status === 'queued' || job.status === 'running') {
+                await new Promise((resolve) => setTimeout(resolve, 500));
+                job = (await axios.get(response.data.status_url, { headers })).data;
+            }
+            if (job.status === 'failed') {
+                throw { response: { data: job.result } };
+            }
+
+            const { message, download_url, prompt, steps } = job.result;
+            const stepSummary = steps?.map(
+                (step, index) => `${index + 1}. ${step.command}: ${step.rows ?? '?'} rows, ${step.columns} columns (${step.seconds}s)`
+            ).join('\n');
 
             setMessages((prev) => [
                 ...prev,
                 { sender: 'user', text: input },
                 { sender: 'ai', text: message },
+                ...(stepSummary ? [{ sender: 'ai', text: stepSummary }] : []),
                 ...(download_url ? [{ sender: 'ai', text: `Download your transformed dataset here:`, downloadUrl: download_url }] : []),
                 ...(prompt ? [{ sender: 'system', text: prompt }] : []),
             ]);
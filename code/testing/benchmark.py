@@ -0,0 +1,322 @@
+"""
+Micro-benchmarks for the transformation engines on synthetic datasets.
+
+Generates mixed-type CSV/TSV datasets with Faker and NumPy, then times
+`load_dataset`, every `apply_predefined_transformation` operation,
+`save_dataset`, the plan executor and the DuckDB engine against the
+local-filesystem storage backend, and compresses each dataset with every
+codec and level in COMPRESSION_LEVELS to weigh CPU time against bytes saved.
+Results are written as JSON with throughput, peak RSS and the peak number
+of copies of the data held in memory, and can be compared against a stored
+baseline:
+
+    python benchmark.py --profile quick --output results.json --baseline baseline.json
+    python benchmark.py --profile quick --save-baseline baseline.json
+
+The exit status is 1 when any case is slower than the baseline by more than
+the tolerance.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from faker import Faker
+
+backend_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../backend')
+sys.path.insert(0, backend_path)
+
+import app as service
+from blob_store import LocalStorageClient
+from columnar import working_copy_name
+from compression import CompressingWriter, open_text
+from blob_cache import blob_cache
+from dataset_cache import dataset_cache
+from engines import DuckDBEngine
+from plan import plan_step, execute_plan
+
+PROFILES = {
+    "smoke": {"rows": [1000], "columns": [5]},
+    "quick": {"rows": [10_000, 100_000], "columns": [5, 50]},
+    "full": {"rows": [10_000, 100_000, 1_000_000, 10_000_000], "columns": [5, 50, 500]},
+}
+COLUMN_KINDS = ["int", "float", "category", "text", "date", "bool"]
+BUCKET = "benchmark-bucket"
+COMPRESSION_LEVELS = {"gzip": [1, 6, 9], "zstd": [1, 3, 9, 19]}
+
+
+class PeakRss:
+    """Samples the resident set size on a background thread while a block runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Not Linux: fall back to the process high-water mark (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def generate_frame(rows, columns, seed=0):
+    """
+    A mixed-type frame: integers, floats with missing values, low-cardinality
+    categories, free text, dates and booleans, cycling through the kinds.
+    """
+    rng = np.random.default_rng(seed)
+    fake = Faker()
+    Faker.seed(seed)
+    # Faker is slow per value, so draw from fixed pools with NumPy
+    cities = np.array([fake.city() for _ in range(50)], dtype=object)
+    names = np.array([fake.name() for _ in range(2000)], dtype=object)
+
+    data = {}
+    for index in range(columns):
+        kind = COLUMN_KINDS[index % len(COLUMN_KINDS)]
+        name = f"{kind}_{index}"
+        if kind == "int":
+            data[name] = rng.integers(0, 1_000_000, rows)
+        elif kind == "float":
+            values = rng.normal(100, 25, rows)
+            values[rng.random(rows) < 0.05] = np.nan
+            data[name] = values
+        elif kind == "category":
+            data[name] = cities[rng.integers(0, len(cities), rows)]
+        elif kind == "text":
+            data[name] = names[rng.integers(0, len(names), rows)]
+        elif kind == "date":
+            data[name] = np.datetime64("2020-01-01") + rng.integers(0, 1500, rows).astype("timedelta64[D]")
+        else:
+            data[name] = rng.random(rows) < 0.5
+    return pd.DataFrame(data)
+
+
+def dataset_file(data_dir, rows, columns, file_format):
+    """Path of a generated dataset, generating it on first use."""
+    delimiter = ',' if file_format == 'csv' else '\t'
+    path = os.path.join(data_dir, f"synthetic-{rows}x{columns}.{file_format}")
+    if not os.path.exists(path):
+        generate_frame(rows, columns).to_csv(path, index=False, sep=delimiter)
+    return path
+
+
+def transformation_commands(df):
+    """One command per `apply_predefined_transformation` operation, plus the common filter forms."""
+    int_column, category_column, text_column = (
+        next(col for col in df.columns if col.startswith(kind)) for kind in ("int", "category", "text")
+    )
+    category = df[category_column].iloc[0]
+    return {
+        "remove": f"remove column {df.columns[-1]}",
+        "rename": f"rename column {int_column} to {int_column}_renamed",
+        "filter_numeric": f"filter rows where {int_column} > {int(df[int_column].median())}",
+        "filter_equals": f'filter rows where {category_column} == "{category}"',
+        "filter_prefix": f"filter rows where {text_column} like 'A%'",
+    }
+
+
+def compress_file(source_path, target_path, codec, level):
+    """Compress a file the way exports are written; returns the compressed size."""
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        writer = CompressingWriter(target, codec, level)
+        while chunk := source.read(1024 * 1024):
+            writer.write(chunk)
+        writer.close()
+    return writer.bytes_out
+
+
+def read_all(path):
+    with open_text(path) as source:
+        while source.read(1024 * 1024):
+            pass
+
+
+def measure(operation, fn, rows, data_bytes):
+    with PeakRss() as rss:
+        started = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - started
+    return result, {
+        "operation": operation,
+        "seconds": round(seconds, 6),
+        "rows_per_second": round(rows / seconds, 1) if seconds else None,
+        "mb_per_second": round(data_bytes / 1024 / 1024 / seconds, 2) if seconds else None,
+        "peak_rss_mb": round(rss.peak / 1024 / 1024, 1),
+        # How many copies of the data the operation held at its peak, beyond what was resident before
+        "peak_copies": round((rss.peak - rss.start) / data_bytes, 2) if data_bytes else None,
+    }
+
+
+def run_dataset(storage_client, data_dir, rows, columns, file_format):
+    """Time every operation on one synthetic dataset; returns the case results."""
+    delimiter = ',' if file_format == 'csv' else '\t'
+    label = f"{file_format}-{rows}x{columns}"
+    source_path = dataset_file(data_dir, rows, columns, file_format)
+    dataset_name = os.path.basename(source_path)
+    bucket = storage_client.bucket(BUCKET)
+    bucket.blob(dataset_name).upload_from_filename(source_path)
+    source_bytes = os.path.getsize(source_path)
+
+    cases = []
+
+    def record(operation, fn, data_bytes, case_rows=rows):
+        result, case = measure(operation, fn, case_rows, data_bytes)
+        cases.append({"dataset": label, "rows": case_rows, "columns": columns, **case})
+        return result
+
+    dataset_cache.clear()
+    blob_cache.clear()
+    df = record(f"load_dataset[{file_format}]",
+                lambda: service.load_dataset(BUCKET, dataset_name, delimiter=delimiter), source_bytes)
+    frame_bytes = int(df.memory_usage(deep=False).sum())
+
+    record("save_dataset", lambda: service.save_dataset(BUCKET, dataset_name, df), frame_bytes)
+    parquet_bytes = bucket.get_blob(working_copy_name(dataset_name)).size
+
+    dataset_cache.clear()
+    blob_cache.clear()
+    record("load_dataset[parquet]",
+           lambda: service.load_dataset(BUCKET, dataset_name, columnar=True), parquet_bytes)
+
+    commands = transformation_commands(df)
+    for operation, command in commands.items():
+        record(f"apply_predefined_transformation[{operation}]",
+               lambda: service.apply_predefined_transformation(df, command), frame_bytes)
+
+    steps = [plan_step(commands[operation]) for operation in ("filter_numeric", "rename", "remove")]
+    record("execute_plan[filter+rename+remove]", lambda: execute_plan(df, steps), frame_bytes)
+
+    parquet_path = os.path.join(data_dir, f"{label}.parquet")
+    bucket.blob(working_copy_name(dataset_name)).download_to_filename(parquet_path)
+    target_path = os.path.join(data_dir, f"{label}-result.parquet")
+    engine = DuckDBEngine(temp_directory=os.path.join(data_dir, "duckdb"))
+    record("duckdb.transform_file[filter+rename+remove]",
+           lambda: engine.transform_file(parquet_path, target_path, steps, list(df.columns)), parquet_bytes)
+
+    # Throughput is measured on the uncompressed bytes, so codecs compare directly
+    for codec, levels in COMPRESSION_LEVELS.items():
+        for level in levels:
+            compressed_path = os.path.join(data_dir, f"{label}.{codec}")
+            compressed_bytes = record(f"compress[{codec}-{level}]",
+                                      lambda: compress_file(source_path, compressed_path, codec, level), source_bytes)
+            cases[-1]["compressed_bytes"] = compressed_bytes
+            cases[-1]["bytes_saved"] = round(1 - compressed_bytes / source_bytes, 4)
+            record(f"decompress[{codec}-{level}]", lambda: read_all(compressed_path), source_bytes)
+    return cases
+
+
+def compare_to_baseline(cases, baseline, tolerance=0.25, noise_seconds=0.005):
+    """
+    Cases that got slower than the baseline by more than `tolerance` (a fraction).
+
+    Differences below `noise_seconds` are ignored so the tiniest cases do not flap.
+    """
+    reference = {(case["dataset"], case["operation"]): case["seconds"] for case in baseline.get("cases", [])}
+    regressions = []
+    for case in cases:
+        before = reference.get((case["dataset"], case["operation"]))
+        if before is None:
+            continue
+        if case["seconds"] > before * (1 + tolerance) and case["seconds"] - before > noise_seconds:
+            regressions.append({
+                "dataset": case["dataset"],
+                "operation": case["operation"],
+                "seconds": case["seconds"],
+                "baseline_seconds": before,
+                "slowdown": round(case["seconds"] / before, 2),
+            })
+    return regressions
+
+
+def run(rows_list, columns_list, formats, data_dir, max_cells):
+    storage_client = LocalStorageClient(os.path.join(data_dir, "storage"))
+    storage_client.create_bucket(BUCKET)
+    service.storage_client = storage_client
+
+    cases = []
+    for file_format in formats:
+        for rows in rows_list:
+            for columns in columns_list:
+                if rows * columns > max_cells:
+                    print(f"Skipping {rows}x{columns}: more than {max_cells} cells", file=sys.stderr)
+                    continue
+                print(f"Benchmarking {file_format} {rows}x{columns}", file=sys.stderr)
+                cases.extend(run_dataset(storage_client, data_dir, rows, columns, file_format))
+    return {
+        "generated_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "cases": cases,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--rows", type=int, nargs="+", help="row counts (overrides the profile)")
+    parser.add_argument("--columns", type=int, nargs="+", help="column counts (overrides the profile)")
+    parser.add_argument("--formats", nargs="+", choices=["csv", "tsv"], default=["csv"])
+    parser.add_argument("--max-cells", type=int, default=50_000_000, help="skip datasets larger than this")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "idts-benchmark"),
+                        help="where generated datasets are kept between runs")
+    parser.add_argument("--output", help="write results here instead of stdout")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, as a fraction")
+    parser.add_argument("--save-baseline", help="also write the results here as the new baseline")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    profile = PROFILES[args.profile]
+    results = run(args.rows or profile["rows"], args.columns or profile["columns"], args.formats,
+                  args.data_dir, args.max_cells)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            results["regressions"] = compare_to_baseline(results["cases"], json.load(baseline_file), args.tolerance)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            baseline_file.write(output)
+
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
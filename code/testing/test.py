@@ -6,23 +6,63 @@ import bcrypt
 from unittest.mock import Mock
 import pandas as pd
 import jwt
+import time
 from unittest import TestCase
+from io import BytesIO
 
 backend_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../backend')
 sys.path.insert(0, backend_path)
 
-from app import app  
+from ingest import UploadInspector, HEAD_BYTES
+from app import app, read_text, reconcile_storage, backfill_email_lookups
+from google.api_core.exceptions import Conflict
+from dataset_cache import dataset_cache, DatasetCache
+from blob_cache import BlobCache, blob_cache
+from engines import DuckDBEngine
+from plan import plan_step, execute_plan
+from predicates import parse_condition
+from zone_maps import prune_row_groups, build_zone_maps, ZONE_MAP_TEXT_CHARS
+import pyarrow.parquet as pq
+from streaming import stream_plan, stream_export
+from jobs import JobQueue, job_queue
+from user_cache import user_cache
+from blob_store import LocalStorageClient, LocalBlob, storage_calls
+from telemetry import span_buffer, latency_histograms, cpu_histograms
+from passwords import PasswordHasher, PasswordBusy, password_hasher
+import threading
+from compact import compact_frame, memory_bytes
+from transfers import upload_file, download_file, ChecksumMismatch
+from profiling import DatasetProfile, profile_chunks
+from sketches import HyperLogLog, hash_values
+import tempfile
+import gzip
+import pyarrow as pa
 
 class TestApp(unittest.TestCase):
     def setUp(self):
         self.client = app.test_client()
         self.client.testing = True
+        dataset_cache.clear()
+        user_cache.clear()
+        blob_cache.clear()
 
+    def run_command(self, token, command):
+        """Send a chat command and wait for its queued job to finish."""
+        response = self.client.post('/transform', json={'command': command}, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+        job_queue.wait(job_id, timeout=10)
+
+        response = self.client.get(f'/jobs/{job_id}', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        job = response.get_json()
+        self.assertIn(job['status'], ('succeeded', 'failed'))
+        return job['status_code'], job['result']
+
+    @patch("app.job_queue")
     @patch("app.firestore_client")  
     @patch("app.storage_client") 
-    def test_signup(self, mock_storage_client, mock_firestore_client):
-        mock_firestore_client.collection.return_value.where.return_value.get.return_value = []
-
+    def test_signup(self, mock_storage_client, mock_firestore_client, mock_job_queue):
         mock_user_doc = MagicMock()
         mock_user_doc.id = "test_user_id"
         mock_firestore_client.collection.return_value.document.return_value = mock_user_doc
@@ -37,14 +77,33 @@ class TestApp(unittest.TestCase):
 
         self.assertEqual(response.status_code, 201)
         self.assertIn("User registered successfully", response.get_json()["message"])
+        # The email lookup and the user are written in one batch; the bucket is left to a background job
+        batch = mock_firestore_client.batch.return_value
+        batch.create.assert_called_once_with(mock_user_doc, {'user_id': 'test_user_id', 'email': 'test@example.com'})
+        self.assertFalse(batch.set.call_args[0][1]['bucket_ready'])
+        batch.commit.assert_called_once()
+        # Nothing is read or queried first; the batch's `create` is what rejects a registered email
+        mock_user_doc.get.assert_not_called()
+        mock_firestore_client.collection.return_value.where.assert_not_called()
+        mock_storage_client.create_bucket.assert_not_called()
+        key, description, fn, user_id = mock_job_queue.submit.call_args[0]
+        self.assertEqual((key, user_id), ('test_user_id', 'test_user_id'))
+
+        mock_user_doc.get.return_value.to_dict.return_value = dict(batch.set.call_args[0][1])
+        self.assertEqual(fn(user_id)[1], 201)
+        created = mock_storage_client.create_bucket.call_args[0][0]
+        self.assertEqual(created.storage_class, "STANDARD")
+        mock_user_doc.update.assert_called_once_with({'bucket_ready': True})
+        # Once the bucket exists, provisioning again is a no-op
+        self.assertEqual(fn(user_id)[1], 200)
         mock_storage_client.create_bucket.assert_called_once()
 
     @patch('app.firestore_client')
     def test_login_successful(self, mock_firestore_client):
-        mock_collection = Mock()
-        mock_firestore_client.collection.return_value = mock_collection
+        collections = {'users': Mock(), 'emails': Mock()}
+        mock_firestore_client.collection.side_effect = collections.get
 
-        hashed_password = bcrypt.hashpw('testpassword'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        hashed_password = bcrypt.hashpw('testpassword'.encode('utf-8'), bcrypt.gensalt(password_hasher.rounds)).decode('utf-8')
         mock_user_data = {
             'email': 'test@example.com',
             'password': hashed_password
@@ -53,7 +112,10 @@ class TestApp(unittest.TestCase):
         mock_document = Mock()
         mock_document.to_dict.return_value = mock_user_data
         mock_document.id = 'test_user_id'  
-        mock_collection.where.return_value.get.return_value = [mock_document]
+        collections['users'].document.return_value.get.return_value = mock_document
+        lookup = collections['emails'].document.return_value.get.return_value
+        lookup.exists = True
+        lookup.to_dict.return_value = {'user_id': 'test_user_id'}
 
         response = self.client.post(
             '/login',
@@ -62,7 +124,83 @@ class TestApp(unittest.TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertIn('Login successful', response.json['message'])
+        # Resolved through the lookup document, never by querying the users collection
+        collections['users'].document.assert_called_with('test_user_id')
+        collections['users'].where.assert_not_called()
         
+    @patch('app.firestore_client')
+    def test_legacy_login_needs_fallback_or_backfill(self, mock_firestore_client):
+        collections = {'users': Mock(), 'emails': Mock()}
+        mock_firestore_client.collection.side_effect = collections.get
+        hashed_password = bcrypt.hashpw(b'secret', bcrypt.gensalt(4)).decode('utf-8')
+        legacy_user = Mock(id='legacy_id')
+        legacy_user.to_dict.return_value = {'email': 'Old@Example.com'}
+        collections['users'].where.return_value.get.return_value = [legacy_user]
+        collections['users'].stream.return_value = [legacy_user]
+        collections['users'].document.return_value.get.return_value.to_dict.return_value = {'password': hashed_password}
+        collections['emails'].document.return_value.get.return_value.exists = False
+
+        # Unknown emails cost a single GET unless the fallback is turned on
+        response = self.client.post('/login', json={'email': 'Old@Example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 401)
+        collections['users'].where.assert_not_called()
+
+        latency_histograms.clear()
+        cpu_histograms.clear()
+        with patch('app.EMAIL_LOOKUP_FALLBACK', True):
+            response = self.client.post('/login', json={'email': 'Old@Example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        # Logging in is a read; lookups are only written by the backfill
+        collections['emails'].document.return_value.set.assert_not_called()
+        collections['emails'].document.return_value.create.assert_not_called()
+        self.assertEqual(backfill_email_lookups(), 1)
+        collections['emails'].document.return_value.create.assert_called_once_with({'user_id': 'legacy_id', 'email': 'Old@Example.com'})
+        # The hash was made with another cost than BCRYPT_ROUNDS, so it is upgraded
+        update = collections['users'].document.return_value.update.call_args[0][0]
+        self.assertTrue(update['password'].startswith(f'$2b${password_hasher.rounds:02d}$'))
+
+        metrics = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('idts_cpu_seconds_count{route="/login",phase="request"} 1', metrics)
+        self.assertIn('idts_cpu_seconds_count{route="/login",phase="bcrypt"} 2', metrics)
+        self.assertIn('idts_phase_duration_seconds_count{route="/login",phase="request"} 1', metrics)
+
+    @patch('app.job_queue')
+    @patch('app.firestore_client')
+    def test_signup_rejects_registered_email(self, mock_firestore_client, mock_job_queue):
+        mock_firestore_client.batch.return_value.commit.side_effect = Conflict("Document already exists")
+        response = self.client.post("/signup", json={"name": "Test", "email": "taken@example.com", "password": "pw"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("User already exists", response.get_json()["message"])
+        mock_job_queue.submit.assert_not_called()
+
+    def test_password_pool_turns_callers_away_when_full(self):
+        hasher = PasswordHasher(workers=1, queue=1, rounds=4)
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_check(*args):
+            started.set()
+            release.wait(5)
+            return True
+
+        with patch('passwords.bcrypt.checkpw', slow_check):
+            first = threading.Thread(target=hasher.check, args=('a', 'b'))
+            second = threading.Thread(target=hasher.check, args=('a', 'b'))
+            first.start()
+            started.wait(5)
+            second.start()
+            time.sleep(0.1)
+            # One check runs and one waits; the third is turned away instead of queueing
+            with self.assertRaises(PasswordBusy):
+                hasher.check('a', 'b')
+            release.set()
+            first.join()
+            second.join()
+        self.assertEqual(hasher.stats()['completed']['check'], 2)
+        self.assertEqual(hasher.stats()['rejected']['check'], 1)
+        self.assertTrue(hasher.check('pw', hasher.hash('pw')))
+        self.assertFalse(hasher.needs_rehash(hasher.hash('pw')))
+
     @patch('app.firestore_client')
     @patch('app.storage_client')
     def test_transform_dataset(self, mock_storage_client, mock_firestore_client):
@@ -79,20 +217,977 @@ class TestApp(unittest.TestCase):
         mock_bucket = Mock()
         mock_storage_client.get_bucket.return_value = mock_bucket
         mock_bucket.blob.return_value = mock_blob
-        mock_blob.download_to_filename.return_value = None
-
-        pd.DataFrame({'col1': [1, 2, 3], 'col2': [4, 5, 6]}).to_csv('/tmp/test-dataset.csv', index=False)
+        mock_blob.download_to_filename.side_effect = (
+            lambda path: pd.DataFrame({'col1': [1, 2, 3], 'col2': [4, 5, 6]}).to_csv(path, index=False)
+        )
+        mock_storage_client.bucket.return_value.get_blob.return_value = mock_blob
         
         mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
 
+        status_code, body = self.run_command(mock_token, 'size')
+
+        self.assertEqual(status_code, 200)
+        self.assertIn('Dataset Dimensions', body['message'])
+
+    @patch('app.firestore_client')
+    @patch('app.storage_client')
+    def test_transform_reuses_cached_dataset(self, mock_storage_client, mock_firestore_client):
+        mock_user = {
+            'bucket': 'test-bucket',
+            'dataset': 'cached-dataset.csv',
+            'file_type': 'csv'
+        }
+        mock_firestore_client.collection.return_value.document.return_value.get.return_value.to_dict.return_value = mock_user
+
+        mock_blob = Mock()
+        mock_blob.generation = 1
+        mock_blob.download_to_filename.side_effect = (
+            lambda path: pd.DataFrame({'col1': [1, 2, 3], 'col2': [4, 5, 6]}).to_csv(path, index=False)
+        )
+        mock_storage_client.bucket.return_value.get_blob.return_value = mock_blob
+
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        for command in ('columns', 'size'):
+            status_code, body = self.run_command(mock_token, command)
+            self.assertEqual(status_code, 200)
+
+        mock_blob.download_to_filename.assert_called_once()
+        self.assertEqual(dataset_cache.stats()['hits'], 1)
+        self.assertEqual(dataset_cache.stats()['misses'], 1)
+
+    @patch('app.firestore_client')
+    @patch('app.storage_client')
+    def test_metadata_commands_use_manifest(self, mock_storage_client, mock_firestore_client):
+        mock_user = {
+            'bucket': 'test-bucket',
+            'dataset': 'test-dataset.csv',
+            'file_type': 'csv',
+            'manifest': {
+                'columns': ['col1', 'col2'],
+                'dtypes': {'col1': 'int64', 'col2': 'int64'},
+                'rows': 3,
+                'bytes': 24,
+                'generation': 1
+            }
+        }
+        mock_firestore_client.collection.return_value.document.return_value.get.return_value.to_dict.return_value = mock_user
+
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        status_code, body = self.run_command(mock_token, 'size')
+
+        self.assertEqual(status_code, 200)
+        self.assertIn('Rows: 3, Columns: 2', body['message'])
+        mock_storage_client.bucket.assert_not_called()
+        mock_storage_client.get_bucket.assert_not_called()
+
+    @patch('app.firestore_client')
+    @patch('app.storage_client')
+    def test_user_document_is_cached_and_written_through(self, mock_storage_client, mock_firestore_client):
+        mock_user = {
+            'bucket': 'test-bucket',
+            'dataset': 'test-dataset.csv',
+            'file_type': 'csv',
+            'manifest': {
+                'columns': ['col1', 'col2'],
+                'dtypes': {'col1': 'int64', 'col2': 'int64'},
+                'rows': 3,
+                'bytes': 24,
+                'generation': 1
+            }
+        }
+        user_doc = mock_firestore_client.collection.return_value.document.return_value
+        user_doc.get.return_value.to_dict.return_value = mock_user
+
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        self.run_command(mock_token, 'remove column col1')
+        status_code, body = self.run_command(mock_token, 'columns')
+
+        # The second command sees the queued step without reading Firestore again
+        self.assertEqual(status_code, 200)
+        self.assertIn('col2', body['message'])
+        self.assertNotIn('col1', body['message'])
+        self.assertEqual(user_doc.get.call_count, 1)
+        user_doc.update.assert_called_once()
+
+        stats = user_cache.stats()
+        self.assertEqual((stats['firestore_reads'], stats['firestore_reads_saved'], stats['firestore_writes']), (1, 1, 1))
+
+    @patch('app.firestore_client')
+    @patch('app.storage_client')
+    def test_upload_records_manifest(self, mock_storage_client, mock_firestore_client):
+        mock_user_ref = mock_firestore_client.collection.return_value.document.return_value
+        mock_user_ref.get.return_value.to_dict.return_value = {'bucket': 'test-bucket'}
+
+        mock_blob = Mock()
+        mock_blob.size = 24
+        mock_blob.generation = 7
+        mock_working_blob = Mock()
+        mock_working_blob.size = 16
+        mock_working_blob.generation = 8
+        mock_storage_client.bucket.return_value.blob.side_effect = (
+            lambda name: mock_working_blob if name.endswith('.parquet') else mock_blob
+        )
+
+        body = b'col1,col2\n1,a\n2,b\n3,c\n'
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
         response = self.client.post(
-            '/transform',
-            json={'command': 'size'},
+            '/home',
+            data={'file': (BytesIO(body), 'upload.csv'), 'file_type': 'csv'},
             headers={'Authorization': f'Bearer {mock_token}'}
         )
 
+        self.assertEqual(response.status_code, 201)
+        update = mock_user_ref.update.call_args[0][0]
+        self.assertEqual(update['manifest']['columns'], ['col1', 'col2'])
+        self.assertEqual(update['manifest']['rows'], 3)
+        self.assertEqual(update['manifest']['format'], 'parquet')
+        self.assertEqual(update['manifest']['generation'], 8)
+        self.assertEqual(update['manifest']['export_generation'], 7)
+        self.assertEqual(update['manifest']['source_bytes'], len(body))
+        self.assertIn('inferred_memory_bytes', update['manifest'])
+        self.assertIn('memory_bytes', update['manifest'])
+        # The working copy is uploaded straight from memory
+        mock_working_blob.upload_from_file.assert_called_once()
+        mock_working_blob.upload_from_filename.assert_not_called()
+
+        # The original is streamed to GCS once, compressed on the way, and never read back
+        writer = mock_blob.open.return_value
+        self.assertEqual(gzip.decompress(b''.join(call.args[0] for call in writer.write.call_args_list)), body)
+        self.assertEqual(mock_blob.content_encoding, 'gzip')
+        writer.close.assert_called_once()
+        mock_blob.download_to_filename.assert_not_called()
+
+    @patch('app.firestore_client')
+    @patch('app.storage_client')
+    def test_upload_rejects_malformed_file_before_finalizing(self, mock_storage_client, mock_firestore_client):
+        mock_user_ref = mock_firestore_client.collection.return_value.document.return_value
+        mock_user_ref.get.return_value.to_dict.return_value = {'bucket': 'test-bucket', 'dataset': 'old.csv'}
+
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        response = self.client.post(
+            '/replace-dataset',
+            data={'file': (BytesIO(b'col1\tcol2\n1\ta\n'), 'upload.tsv'), 'file_type': 'csv'},
+            headers={'Authorization': f'Bearer {mock_token}'}
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('TSV-delimited', response.get_json()['message'])
+        mock_storage_client.bucket.return_value.blob.return_value.open.return_value.close.assert_not_called()
+        mock_storage_client.get_bucket.return_value.blob.assert_not_called()
+        mock_storage_client.batch.assert_not_called()
+        mock_user_ref.update.assert_not_called()
+
+    def test_upload_head_check_handles_quoted_newlines(self):
+        row = '1,"line one\nline two",1\n'
+        rows = 3000
+        # Pad the first record so the head ends right after a newline inside a quoted field
+        filler = (HEAD_BYTES - len('a,b,c\n') - len('0,"",0\n') - 12) % len(row)
+        data = ('a,b,c\n' + f'0,"{"x" * filler}",0\n' + row * rows).encode()
+        self.assertEqual(data[HEAD_BYTES - 12:HEAD_BYTES], b'1,"line one\n')
+
+        inspector = UploadInspector()
+        inspector.feed(data[:HEAD_BYTES])
+        inspector.feed(data[HEAD_BYTES:])
+        inspector.finish()
+        self.assertEqual(inspector.columns, 3)
+        self.assertEqual(len(pd.read_csv(BytesIO(data))), rows + 1)
+
+        # Errors name the line the bad record starts on, not its index
+        inspector = UploadInspector()
+        inspector.feed(('a,b,c\n' + row * 2 + '1,2\n').encode())
+        with self.assertRaisesRegex(ValueError, 'Line 6 has 2 fields'):
+            inspector.finish()
+
+    @patch('app.firestore_client')
+    @patch('app.storage_client')
+    def test_transform_defers_work_to_pending_plan(self, mock_storage_client, mock_firestore_client):
+        mock_user = {
+            'bucket': 'test-bucket',
+            'dataset': 'columnar-dataset.csv',
+            'file_type': 'csv',
+            'manifest': {'columns': ['col1', 'col2'], 'dtypes': {'col1': 'int64', 'col2': 'int64'}, 'rows': 3,
+                         'generation': 1, 'format': 'parquet'}
+        }
+        mock_user_ref = mock_firestore_client.collection.return_value.document.return_value
+        mock_user_ref.get.return_value.to_dict.return_value = mock_user
+
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        for command in ('rename column col1 to first', 'filter rows where first > 1', 'remove column col2'):
+            status_code, body = self.run_command(mock_token, command)
+            self.assertEqual(status_code, 200)
+            self.assertNotIn('download_url', body)
+            mock_user['plan'] = mock_user_ref.update.call_args[0][0]['plan']
+
+        self.assertEqual([step['op'] for step in mock_user['plan']], ['rename', 'filter', 'remove'])
+        mock_storage_client.bucket.assert_not_called()
+
+        status_code, body = self.run_command(mock_token, 'columns')
+        self.assertIn('● first', body['message'])
+        self.assertNotIn('col2', body['message'])
+
+        status_code, body = self.run_command(mock_token, 'filter rows where missing > 1')
+        self.assertEqual(status_code, 400)
+
+        mock_blob = Mock()
+        mock_blob.generation = 1
+        mock_blob.download_to_filename.side_effect = (
+            lambda path: pd.DataFrame({'col1': [1, 2, 3], 'col2': [4, 5, 6]}).to_parquet(path, index=False)
+        )
+        mock_storage_client.bucket.return_value.get_blob.return_value = mock_blob
+        # Plain numbers, so the manifests built from the written blob are plain data
+        mock_storage_client.bucket.return_value.blob.return_value.generation = 2
+        mock_storage_client.bucket.return_value.blob.return_value.size = 10
+
+        status_code, body = self.run_command(mock_token, 'yes')
+
+        self.assertEqual(status_code, 200)
+        mock_blob.download_to_filename.assert_called_once()
+        update = mock_user_ref.update.call_args[0][0]
+        self.assertEqual(update['dataset'], 'transformed_columnar-dataset.csv')
+        self.assertEqual(update['plan'], [])
+        self.assertEqual(update['manifest']['columns'], ['first'])
+        self.assertEqual(update['manifest']['rows'], 2)
+
+    @patch('app.firestore_client')
+    def test_old_dataset_is_kept_when_firestore_update_fails(self, mock_firestore_client):
+        mock_user = {'bucket': 'test-bucket'}
+        failing = []
+
+        def update(fields):
+            if failing and 'dataset' in fields:
+                raise RuntimeError("Firestore is unavailable")
+            mock_user.update(fields)
+
+        user_doc = mock_firestore_client.collection.return_value.document.return_value
+        user_doc.get.return_value.to_dict.return_value = mock_user
+        user_doc.update.side_effect = update
+
+        root = tempfile.mkdtemp()
+        local_client = LocalStorageClient(root)
+        local_client.create_bucket('test-bucket')
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        headers = {'Authorization': f'Bearer {mock_token}'}
+
+        with patch('app.storage_client', local_client):
+            response = self.client.post('/home', data={'file': (BytesIO(b'a,b\n1,2\n3,4\n'), 'old.csv'), 'file_type': 'csv'},
+                                        headers=headers)
+            self.assertEqual(response.status_code, 201)
+            self.run_command(mock_token, 'filter rows where a > 1')
+
+            failing.append(True)
+            response = self.client.post('/home', data={'file': (BytesIO(b'a,b\n5,6\n'), 'new.csv'), 'file_type': 'csv'},
+                                        headers=headers)
+            self.assertEqual(response.status_code, 500)
+            status_code, body = self.run_command(mock_token, 'yes')
+            self.assertEqual(status_code, 500)
+
+        # The user still points at old.csv, so none of its blobs were deleted
+        self.assertEqual(mock_user['dataset'], 'old.csv')
+        self.assertTrue({'old.csv', 'old.csv.parquet'} <= set(os.listdir(os.path.join(root, 'test-bucket'))))
+
+    @patch('app.firestore_client')
+    def test_local_storage_backend_round_trip(self, mock_firestore_client):
+        mock_user = {'bucket': 'test-bucket'}
+        user_doc = mock_firestore_client.collection.return_value.document.return_value
+        user_doc.get.return_value.to_dict.return_value = mock_user
+        user_doc.update.side_effect = mock_user.update
+
+        root = tempfile.mkdtemp()
+        local_client = LocalStorageClient(root)
+        local_client.create_bucket('test-bucket')
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+
+        with patch('app.storage_client', local_client):
+            response = self.client.post(
+                '/home',
+                data={'file': (BytesIO(b'col1,col2\n1,a\n2,b\n3,c\n'), 'local.csv'), 'file_type': 'csv'},
+                headers={'Authorization': f'Bearer {mock_token}'}
+            )
+            self.assertEqual(response.status_code, 201)
+
+            # The uploaded original is current, so a download link costs a single metadata GET
+            span_buffer.clear()
+            job_id = self.client.post('/transform', json={'command': 'download'},
+                                      headers={'Authorization': f'Bearer {mock_token}'}).get_json()['job_id']
+            job = job_queue.wait(job_id, timeout=10)
+            self.assertEqual(job['status_code'], 200)
+            self.assertEqual(job['metrics']['storage_calls'], {'metadata': 1})
+            command_span = next(span for span in span_buffer.get_finished_spans() if span.name == 'command')
+            self.assertEqual(command_span.attributes['storage_calls'], 1)
+            self.assertEqual(command_span.attributes['storage_calls.metadata'], 1)
+
+            self.run_command(mock_token, 'filter rows where col1 > 1')
+            status_code, body = self.run_command(mock_token, 'yes')
+            self.assertEqual(status_code, 200)
+
+        # The old dataset was removed in one batch; only the transformed one is left
+        self.assertEqual(sorted(os.listdir(os.path.join(root, 'test-bucket'))), ['transformed_local.csv.parquet'])
+        self.assertEqual(len(pd.read_parquet(os.path.join(root, 'test-bucket', 'transformed_local.csv.parquet'))), 2)
+
+    @patch('app.firestore_client')
+    def test_first_upload_provisions_missing_bucket(self, mock_firestore_client):
+        mock_user = {'bucket': 'new-bucket', 'bucket_ready': False}
+        users = mock_firestore_client.collection.return_value
+        users.document.return_value.get.return_value.to_dict.return_value = mock_user
+        users.document.return_value.update.side_effect = mock_user.update
+        users.where.return_value.get.return_value = [Mock(id='test-id')]
+
+        root = tempfile.mkdtemp()
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        with patch('app.storage_client', LocalStorageClient(root)):
+            # The signup job has not run yet, so the upload creates the bucket itself
+            response = self.client.post(
+                '/home',
+                data={'file': (BytesIO(b'a,b\n1,2\n'), 'first.csv'), 'file_type': 'csv'},
+                headers={'Authorization': f'Bearer {mock_token}'}
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertTrue(mock_user['bucket_ready'])
+            self.assertIn('first.csv.parquet', os.listdir(os.path.join(root, 'new-bucket')))
+
+            # The reconciler queues a job for users still marked unprovisioned; it finds the bucket ready
+            with patch('app.job_queue') as mock_job_queue:
+                self.assertEqual(reconcile_storage(), 1)
+            users.where.assert_called_with('bucket_ready', '==', False)
+            key, description, fn, user_id = mock_job_queue.submit.call_args[0]
+            self.assertEqual(fn(user_id), ({"message": "Storage is ready.", "bucket": "new-bucket"}, 200))
+
+    @patch('app.firestore_client')
+    @patch('app.storage_client')
+    def test_batch_commands_load_and_save_once(self, mock_storage_client, mock_firestore_client):
+        mock_user = {
+            'bucket': 'test-bucket',
+            'dataset': 'batch-dataset.csv',
+            'file_type': 'csv',
+            'manifest': {'columns': ['A', 'B', 'D'], 'dtypes': {'A': 'int64', 'B': 'int64', 'D': 'int64'}, 'rows': 4,
+                         'generation': 1, 'format': 'parquet'}
+        }
+        mock_user_ref = mock_firestore_client.collection.return_value.document.return_value
+        mock_user_ref.get.return_value.to_dict.return_value = mock_user
+
+        mock_blob = Mock()
+        mock_blob.generation = 1
+        mock_blob.download_to_filename.side_effect = (
+            lambda path: pd.DataFrame({'A': [1, 2, 3, 4], 'B': [5, 6, 7, 8], 'D': [3, 6, 9, 12]}).to_parquet(path, index=False)
+        )
+        mock_storage_client.bucket.return_value.get_blob.return_value = mock_blob
+        mock_storage_client.bucket.return_value.blob.return_value.generation = 2
+        mock_storage_client.bucket.return_value.blob.return_value.size = 10
+
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        status_code, body = self.run_command(mock_token, 'remove column A; rename column B to C; filter rows where D > 5')
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual([(step['rows'], step['columns']) for step in body['steps']], [(4, 2), (4, 2), (3, 2)])
+        mock_blob.download_to_filename.assert_called_once()
+        mock_storage_client.bucket.return_value.blob.return_value.upload_from_file.assert_called_once()
+        update = mock_user_ref.update.call_args[0][0]
+        self.assertEqual(update['updated_dataset'], 'transformed_batch-dataset.csv')
+        self.assertEqual(update['updated_manifest']['columns'], ['C', 'D'])
+
+        # A failing step saves nothing
+        response = self.client.post('/transform/batch', json={'commands': ['remove column D', 'remove column Missing']},
+                                    headers={'Authorization': f'Bearer {mock_token}'})
+        job = job_queue.wait(response.get_json()['job_id'], timeout=10)
+        self.assertEqual(job['status_code'], 400)
+        self.assertIn('Step 2', job['result']['message'])
+        mock_storage_client.bucket.return_value.blob.return_value.upload_from_file.assert_called_once()
+
+    @patch('app.firestore_client')
+    def test_zone_maps_skip_row_groups(self, mock_firestore_client):
+        mock_user = {'bucket': 'test-bucket'}
+        user_doc = mock_firestore_client.collection.return_value.document.return_value
+        user_doc.get.return_value.to_dict.return_value = mock_user
+        user_doc.update.side_effect = mock_user.update
+
+        local_client = LocalStorageClient(tempfile.mkdtemp())
+        local_client.create_bucket('test-bucket')
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        body = 'ts,level\n' + ''.join(f'{i},{"error" if i % 7 == 0 else "info"}\n' for i in range(100))
+
+        with patch('app.storage_client', local_client), patch('columnar.PARQUET_ROW_GROUP_ROWS', 10):
+            response = self.client.post(
+                '/home',
+                data={'file': (BytesIO(body.encode()), 'logs.csv'), 'file_type': 'csv'},
+                headers={'Authorization': f'Bearer {mock_token}'}
+            )
+            self.assertEqual(response.status_code, 201)
+            zone_maps = mock_user['manifest']['zone_maps']
+            self.assertEqual(zone_maps['rows'], [10] * 10)
+            self.assertEqual(zone_maps['columns']['ts'][3], {'min': 30, 'max': 39, 'nulls': 0, 'distinct': 10})
+
+            # Every row group matches fully or not at all, so the count needs no data
+            self.run_command(mock_token, 'filter rows where ts >= 90')
+            job_id = self.client.post('/transform', json={'command': 'size'},
+                                      headers={'Authorization': f'Bearer {mock_token}'}).get_json()['job_id']
+            job = job_queue.wait(job_id, timeout=10)
+            self.assertIn('Rows: 10,', job['result']['message'])
+            self.assertEqual(job['metrics']['storage_calls'], {})
+
+            self.run_command(mock_token, 'filter rows where level == "error"')
+            status_code, result = self.run_command(mock_token, 'size')
+            self.assertIn('Rows: 2,', result['message'])
+
+        manifest = {'zone_maps': zone_maps}
+        self.assertEqual(prune_row_groups(manifest, [parse_condition('ts between 35 and 52')]), ([3, 4, 5], None))
+        self.assertEqual(prune_row_groups(manifest, [parse_condition('ts > 1000 or ts is null')]), ([], 0))
+        self.assertEqual(prune_row_groups(manifest, [parse_condition('not ts < 50')]), ([5, 6, 7, 8, 9], 50))
+
+    def test_zone_maps_stay_small_with_long_text(self):
+        urls = [f"https://example.com/{i:04d}/{'section/' * 20}" for i in range(8)]
+        buffer = BytesIO()
+        pq.write_table(pa.table({'url': urls}), buffer, row_group_size=2)
+        metadata = pq.ParquetFile(BytesIO(buffer.getvalue())).metadata
+
+        zone_maps = build_zone_maps(metadata)
+        zone = zone_maps['columns']['url'][1]
+        # Truncated bounds still enclose every value of the group
+        self.assertEqual(len(zone['min']), ZONE_MAP_TEXT_CHARS)
+        self.assertTrue(zone['min'] <= urls[2] <= urls[3] < zone['max'])
+        manifest = {'zone_maps': zone_maps}
+        self.assertEqual(prune_row_groups(manifest, [parse_condition(f'url == "{urls[5]}"')]), ([2], None))
+        self.assertEqual(prune_row_groups(manifest, [parse_condition('url like "https://example.com/%"')]), (None, 8))
+
+        # Too large to keep in the user document once serialized
+        with patch('zone_maps.ZONE_MAP_MAX_BYTES', 200):
+            self.assertIsNone(build_zone_maps(metadata))
+
+    def test_benchmark_flags_regressions_against_baseline(self):
+        import benchmark
+
+        with patch('app.storage_client'):
+            results = benchmark.run([1000], [5], ['csv'], tempfile.mkdtemp(), max_cells=10 ** 6)
+        operations = {case['operation'] for case in results['cases']}
+        self.assertIn('load_dataset[csv]', operations)
+        self.assertIn('apply_predefined_transformation[filter_numeric]', operations)
+        self.assertTrue(all(case['peak_rss_mb'] > 0 for case in results['cases']))
+
+        faster = {'cases': [dict(case, seconds=case['seconds'] / 4) for case in results['cases']]}
+        regressions = benchmark.compare_to_baseline(results['cases'], faster, noise_seconds=0)
+        self.assertEqual(len(regressions), len(results['cases']))
+        self.assertEqual(benchmark.compare_to_baseline(results['cases'], results), [])
+
+    def test_dataset_cache_evicts_least_recently_used(self):
+        df = pd.DataFrame({'col1': range(100)})
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        cache = DatasetCache(max_bytes=size * 2)
+
+        cache.put('bucket', 'a.csv', 1, df)
+        cache.put('bucket', 'b.csv', 1, df)
+        cache.get('bucket', 'a.csv', 1)
+        cache.put('bucket', 'c.csv', 1, df)
+
+        self.assertIsNotNone(cache.get('bucket', 'a.csv', 1))
+        self.assertIsNone(cache.get('bucket', 'b.csv', 1))
+        self.assertIsNone(cache.get('bucket', 'a.csv', 2))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    @patch('app.firestore_client')
+    @patch('app.storage_client')
+    def test_request_phases_are_traced_and_exported(self, mock_storage_client, mock_firestore_client):
+        mock_user = {
+            'bucket': 'test-bucket',
+            'dataset': 'traced-dataset.csv',
+            'file_type': 'csv',
+            'manifest': {'columns': ['A', 'B'], 'dtypes': {'A': 'int64', 'B': 'int64'}, 'rows': 3,
+                         'generation': 1, 'format': 'parquet'}
+        }
+        mock_firestore_client.collection.return_value.document.return_value.get.return_value.to_dict.return_value = mock_user
+        mock_blob = Mock()
+        mock_blob.generation = 1
+        mock_blob.size = 100
+        mock_blob.download_to_filename.side_effect = (
+            lambda path: pd.DataFrame({'A': [1, 2, 3], 'B': [4, 5, 6]}).to_parquet(path, index=False)
+        )
+        mock_storage_client.bucket.return_value.get_blob.return_value = mock_blob
+        span_buffer.clear()
+        latency_histograms.clear()
+
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        status_code, body = self.run_command(mock_token, 'remove column A; filter rows where B > 4')
+        self.assertEqual(status_code, 200)
+
+        spans = {span.name: span for span in span_buffer.get_finished_spans()}
+        for name in ('POST /transform', 'batch', 'firestore.get_user', 'load_dataset', 'gcs.download', 'parse',
+                     'transform', 'save_dataset', 'serialize', 'gcs.upload', 'firestore.update_user'):
+            self.assertIn(name, spans)
+            self.assertEqual(spans[name].attributes['route'], '/transform')
+        # The job's spans belong to the trace of the request that queued it
+        self.assertEqual(len({span.context.trace_id for span in spans.values() if span.name != 'GET /jobs/<job_id>'}), 1)
+        self.assertEqual(spans['load_dataset'].attributes['bytes'], 100)
+        self.assertEqual(spans['load_dataset'].attributes['rows'], 3)
+        self.assertEqual(spans['save_dataset'].attributes['rows'], 2)
+        self.assertEqual(spans['transform'].attributes['command_type'], 'filter')
+
+        response = self.client.get('/metrics')
         self.assertEqual(response.status_code, 200)
-        self.assertIn('Dataset Dimensions', response.get_json()['message'])
+        text = response.get_data(as_text=True)
+        self.assertIn('idts_phase_duration_seconds_count{route="/transform",phase="load_dataset"} 1', text)
+        self.assertIn('idts_phase_duration_seconds_bucket{route="/transform",phase="request",le="+Inf"}', text)
+        self.assertIn('idts_storage_calls_total{kind=', text)
+
+    def test_large_frames_upload_while_serializing(self):
+        from app import save_dataset, export_dataset
+
+        client = LocalStorageClient(tempfile.mkdtemp())
+        client.create_bucket('test-bucket')
+        df = pd.DataFrame({'A': range(1000), 'B': ['x', 'y'] * 500})
+
+        with patch('app.storage_client', client), patch('app.PIPELINED_UPLOAD_MIN_BYTES', 0):
+            with storage_calls.track() as calls:
+                manifest = save_dataset('test-bucket', 'big.csv', df)
+            # The upload ran on the I/O pool and is still counted for this caller
+            self.assertEqual(calls['upload'], 1)
+            working_copy = client.bucket('test-bucket').get_blob('big.csv.parquet')
+            self.assertEqual(manifest['generation'], working_copy.generation)
+            pd.testing.assert_frame_equal(pd.read_parquet(working_copy.path), df)
+
+            blob = export_dataset('test-bucket', 'big.csv', df)
+            self.assertEqual(blob.content_encoding, 'gzip')
+            pd.testing.assert_frame_equal(pd.read_csv(blob.path, compression='gzip'), df)
+
+            # A frame that fails to serialize never replaces the working copy
+            with self.assertRaises(Exception):
+                save_dataset('test-bucket', 'big.csv', pd.DataFrame({'A': [object()] * 3}))
+            self.assertEqual(client.bucket('test-bucket').get_blob('big.csv.parquet').generation, working_copy.generation)
+            self.assertEqual(sorted(os.listdir(os.path.join(client.root, 'test-bucket'))), ['big.csv', 'big.csv.parquet'])
+
+    def test_compressed_uploads_are_stored_as_sent(self):
+        from app import ingest_upload, export_dataset
+
+        client = LocalStorageClient(tempfile.mkdtemp())
+        client.create_bucket('test-bucket')
+        df = pd.DataFrame({'A': range(1000), 'B': ['x', 'y'] * 500})
+        text = df.to_csv(index=False, sep='\t').encode('utf-8')
+        body = pa.Codec('zstd').compress(text, asbytes=True)
+
+        with patch('app.storage_client', client), patch('compression.STORAGE_COMPRESSION', 'zstd'):
+            manifest = ingest_upload('test-bucket', 'data.tsv.zst', BytesIO(body), delimiter='\t')
+            self.assertEqual(manifest['compression'], 'zstd')
+            self.assertEqual(manifest['source_bytes'], len(text))
+            self.assertEqual(manifest['stored_bytes'], len(body))
+            self.assertEqual(manifest['rows'], 1000)
+
+            # The original is kept byte for byte and still parses from a cached download
+            stored = client.bucket('test-bucket').get_blob('data.tsv.zst')
+            self.assertEqual(stored.path.read_bytes(), body)
+            pd.testing.assert_frame_equal(read_text(stored.path, '\t'), df)
+
+            blob = export_dataset('test-bucket', 'transformed_data.tsv.zst', df, delimiter='\t')
+            self.assertEqual((blob.content_type, blob.content_encoding), ('text/tab-separated-values', 'zstd'))
+            self.assertTrue(blob.path.read_bytes().startswith(b'\x28\xb5\x2f\xfd'))
+            pd.testing.assert_frame_equal(read_text(blob.path, '\t'), df)
+
+        # Plain uploads are compressed with the storage codec on their way to storage
+        with patch('app.storage_client', client):
+            manifest = ingest_upload('test-bucket', 'plain.tsv', BytesIO(text), delimiter='\t')
+        self.assertEqual(manifest['compression'], 'gzip')
+        self.assertLess(manifest['stored_bytes'], len(text))
+        self.assertEqual(gzip.decompress(client.bucket('test-bucket').get_blob('plain.tsv').path.read_bytes()), text)
+
+    @patch('transfers.PARALLEL_TRANSFER_MIN_BYTES', 1024)
+    @patch('transfers.TRANSFER_PART_BYTES', 100)
+    def test_large_files_are_transferred_in_parallel_parts(self):
+        client = LocalStorageClient(tempfile.mkdtemp())
+        bucket = client.create_bucket('test-bucket')
+        source = os.path.join(tempfile.mkdtemp(), 'data.bin')
+        body = os.urandom(4050)
+        with open(source, 'wb') as f:
+            f.write(body)
+
+        # 41 parts need two rounds of compose
+        with storage_calls.track() as calls:
+            upload_file(bucket.blob('data.bin'), source)
+        self.assertEqual(calls['upload'], 41)
+        self.assertEqual(calls['compose'], 3)
+        self.assertEqual(os.listdir(bucket.path), ['data.bin'])
+        blob = bucket.get_blob('data.bin')
+        self.assertEqual(blob.path.read_bytes(), body)
+
+        # More parts than one batch request may delete are cleaned up in several
+        many = os.path.join(tempfile.mkdtemp(), 'many.bin')
+        with open(many, 'wb') as f:
+            f.write(os.urandom(10 * 1050))
+        with patch('transfers.TRANSFER_PART_BYTES', 10), storage_calls.track() as calls:
+            upload_file(bucket.blob('many.bin'), many)
+        self.assertEqual(calls['batch'], 2)
+        self.assertEqual(sorted(os.listdir(bucket.path)), ['data.bin', 'many.bin'])
+
+        # A failed part is retried on its own
+        target = os.path.join(tempfile.mkdtemp(), 'copy.bin')
+        original = LocalBlob.download_as_bytes
+        failures = []
+        def flaky(self, start=None, end=None, **kwargs):
+            if start == 200 and not failures:
+                failures.append(start)
+                raise ConnectionError('reset by peer')
+            return original(self, start, end, **kwargs)
+        with patch.object(LocalBlob, 'download_as_bytes', flaky), storage_calls.track() as calls:
+            download_file(blob, target)
+        self.assertEqual(failures, [200])
+        self.assertEqual(calls['download'], 41)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), body)
+
+        # Corrupted data is caught by the checksum
+        corrupt = lambda self, start=None, end=None, **kwargs: bytes(end + 1 - start)
+        with patch.object(LocalBlob, 'download_as_bytes', corrupt), self.assertRaises(ChecksumMismatch):
+            download_file(blob, target)
+
+    def test_scratch_files_are_private_and_removed(self):
+        from app import ingest_upload
+
+        with blob_cache.scratch('data.csv') as first, blob_cache.scratch('data.csv') as second:
+            self.assertNotEqual(first, second)
+        self.assertFalse(os.path.exists(first) or os.path.exists(second))
+
+        client = LocalStorageClient(tempfile.mkdtemp())
+        client.create_bucket('test-bucket')
+        body = b'A,B\n1,x\n2,y\n3,z\n'
+        with patch('app.storage_client', client):
+            # Spooled to scratch files and converted by DuckDB, as for uploads above STREAMING_MIN_MB
+            manifest = ingest_upload('test-bucket', 'data.csv', BytesIO(body), size_hint=10 ** 12)
+        self.assertEqual(manifest['rows'], 3)
+        self.assertEqual(os.listdir(blob_cache.directory / '.scratch'), [])
+        # The converted working copy was moved into the cache rather than left behind
+        self.assertEqual(blob_cache.stats()['entries'], 1)
+
+    def test_compact_dtypes_are_lossless_and_reused(self):
+        df = pd.DataFrame({
+            'id': range(1000),
+            'half': [i / 2 for i in range(1000)],
+            'ratio': [i / 3 for i in range(1000)],
+            'city': ['Oslo', 'Rome', 'Paris', 'Lima'] * 250,
+            'name': [f'user{i}' for i in range(1000)],
+        })
+        compacted = compact_frame(df)
+
+        self.assertEqual(str(compacted['id'].dtype), 'int16')
+        self.assertEqual(str(compacted['half'].dtype), 'float32')
+        # Thirds do not survive float32, so they stay float64
+        self.assertEqual(str(compacted['ratio'].dtype), 'float64')
+        self.assertEqual(str(compacted['city'].dtype), 'category')
+        self.assertEqual(str(compacted['name'].dtype), 'string')
+        self.assertLess(memory_bytes(compacted), memory_bytes(df))
+        pd.testing.assert_frame_equal(compacted.astype(df.dtypes.to_dict()), df)
+
+        # Ordering filters still work on categories
+        steps = [plan_step("filter rows where city >= 'Oslo'"), plan_step('filter rows where id between 0 and 9')]
+        self.assertEqual(list(execute_plan(compacted, steps)['city']), ['Oslo', 'Rome', 'Paris'] * 2 + ['Oslo', 'Rome'])
+
+        # Text files are parsed with the recorded dtypes instead of inferring them
+        path = os.path.join(tempfile.mkdtemp(), 'compact.csv')
+        df.to_csv(path, index=False)
+        recorded = compacted.dtypes.astype(str).to_dict()
+        self.assertEqual(read_text(path, ',', dtypes=recorded).dtypes.astype(str).to_dict(), recorded)
+
+    def test_profiles_merge_across_chunks(self):
+        df = pd.DataFrame({
+            'value': [(i * 7919) % 10007 / 10 for i in range(20000)],
+            'group': [f'g{i % 500}' for i in range(20000)],
+            'when': pd.date_range('2024-01-01', periods=20000, freq='min'),
+        })
+        df.loc[::10, 'value'] = None
+
+        whole = DatasetProfile.of_frame(df)
+        merged = profile_chunks(df.iloc[start:start + 3000] for start in range(0, len(df), 3000))
+        value = merged.columns['value']
+        self.assertEqual((merged.rows, value.count, value.nulls), (20000, 18000, 2000))
+        self.assertAlmostEqual(value.mean, df['value'].mean(), places=6)
+        self.assertAlmostEqual(value.std(), df['value'].std(), places=6)
+        self.assertEqual((value.min, value.max), (whole.columns['value'].min, whole.columns['value'].max))
+        self.assertAlmostEqual(value.digest.quantile(0.5), df['value'].median(), delta=df['value'].std() * 0.02)
+        self.assertEqual(merged.columns['group'].distinct.estimate(), whole.columns['group'].distinct.estimate())
+        self.assertAlmostEqual(merged.columns['group'].distinct.estimate(), 500, delta=25)
+        self.assertEqual(merged.columns['when'].kind, 'datetime')
+
+        sketch = HyperLogLog()
+        sketch.add(hash_values(pd.Series(range(100000))))
+        self.assertAlmostEqual(sketch.estimate(), 100000, delta=5000)
+
+        # Segments downcast to different widths still agree on which values are distinct
+        for narrow, wide in (('int8', 'int64'), ('float32', 'float64')):
+            values = pd.Series(range(100), dtype=narrow)
+            one, other = HyperLogLog(), HyperLogLog()
+            one.add(hash_values(values))
+            other.add(hash_values(values.astype(wide)))
+            self.assertEqual(one.merge(other).estimate(), one.estimate(), narrow)
+
+        # Profiles survive being persisted
+        restored = DatasetProfile.from_dict(merged.to_dict())
+        self.assertEqual(restored.columns['value'].digest.quantile(0.9), value.digest.quantile(0.9))
+
+    @patch('app.firestore_client')
+    def test_appended_rows_are_stored_as_segments(self, mock_firestore_client):
+        mock_user = {'bucket': 'test-bucket'}
+        user_doc = mock_firestore_client.collection.return_value.document.return_value
+        user_doc.get.return_value.to_dict.return_value = mock_user
+        user_doc.update.side_effect = mock_user.update
+
+        root = tempfile.mkdtemp()
+        local_client = LocalStorageClient(root)
+        local_client.create_bucket('test-bucket')
+        token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+
+        def upload(body, mode=None):
+            data = {'file': (BytesIO(body), 'rows.csv'), 'file_type': 'csv'}
+            if mode:
+                data['mode'] = mode
+            return self.client.post('/home', data=data, headers=headers)
+
+        with patch('app.storage_client', local_client), patch('segments.SEGMENT_COMPACT_COUNT', 2):
+            self.assertEqual(upload(b'id,city\n1,Oslo\n2,Rome\n3,Oslo\n').status_code, 201)
+            base_generation = mock_user['manifest']['generation']
+
+            # Wider numbers and text that looks like a number still fit the dataset
+            response = upload(b'id,city\n70000,Lima\n5,404\n', mode='append')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.get_json()['rows'], 5)
+            self.assertEqual(mock_user['dataset'], 'rows.csv')
+            self.assertEqual(mock_user['manifest']['generation'], base_generation)
+            self.assertEqual(mock_user['manifest']['dtypes']['id'], 'int32')
+
+            status_code, body = self.run_command(token, 'size')
+            self.assertEqual(body['message'], 'Dataset Dimensions:\nRows: 5, Columns: 2')
+
+            # Rows that do not match the schema are rejected and nothing is left behind
+            response = upload(b'id,town\n6,Bern\n', mode='append')
+            self.assertEqual(response.status_code, 400)
+            response = upload(b'id,city\nsix,Bern\n', mode='append')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(mock_user['manifest']['segments']), 1)
+
+            # The pandas and DuckDB engines both read the union of the segments, in order
+            self.run_command(token, 'filter rows where id > 2')
+            with patch('engines.TRANSFORM_ENGINE', 'duckdb'):
+                status_code, body = self.run_command(token, 'size')
+            self.assertEqual(body['message'], 'Dataset Dimensions:\nRows: 3, Columns: 2')
+            status_code, body = self.run_command(token, 'yes')
+            self.assertEqual(status_code, 200)
+            transformed = pd.read_parquet(os.path.join(root, 'test-bucket', 'transformed_rows.csv.parquet'))
+            self.assertEqual(list(transformed['id']), [3, 70000, 5])
+            self.assertEqual(list(transformed['city'].astype(str)), ['Oslo', 'Lima', '404'])
+
+            # A second small segment makes a run long enough to be compacted in the background
+            self.assertEqual(upload(b'id,city\n7,Oslo\n', mode='append').status_code, 201)
+            self.assertEqual(upload(b'id,city\n8,Rome\n', mode='append').status_code, 201)
+            status_code, body = self.run_command(token, 'download')
+            self.assertEqual(status_code, 200)
+            self.assertEqual(len(mock_user['manifest']['segments']), 1)
+            self.assertEqual(mock_user['manifest']['rows'], 5)
+            with gzip.open(os.path.join(root, 'test-bucket', 'transformed_rows.csv'), 'rt') as f:
+                self.assertEqual(f.read(), 'id,city\n3,Oslo\n70000,Lima\n5,404\n7,Oslo\n8,Rome\n')
+
+        # The merged segments are gone; one segment holds their rows
+        names = sorted(os.listdir(os.path.join(root, 'test-bucket')))
+        segments = [name for name in names if '.segment-' in name]
+        self.assertEqual(segments, [mock_user['manifest']['segments'][0]['name'] + '.parquet'])
+
+    @patch('app.firestore_client')
+    def test_describe_persists_profile_with_dataset(self, mock_firestore_client):
+        mock_user = {'bucket': 'test-bucket'}
+        user_doc = mock_firestore_client.collection.return_value.document.return_value
+        user_doc.get.return_value.to_dict.return_value = mock_user
+        user_doc.update.side_effect = mock_user.update
+
+        root = tempfile.mkdtemp()
+        local_client = LocalStorageClient(root)
+        local_client.create_bucket('test-bucket')
+        token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+
+        with patch('app.storage_client', local_client):
+            response = self.client.post(
+                '/home',
+                data={'file': (BytesIO(b'A,B\n1,x\n2,y\n3,\n10,x\n'), 'data.csv'), 'file_type': 'csv'},
+                headers={'Authorization': f'Bearer {token}'}
+            )
+            self.assertEqual(response.status_code, 201)
+
+            status_code, body = self.run_command(token, 'describe')
+            self.assertEqual(status_code, 200)
+            self.assertIn('mean: 4, std: 4.08248', body['message'])
+            self.assertIn('nulls: 1', body['message'])
+            self.assertTrue(os.path.exists(os.path.join(root, 'test-bucket', 'data.csv.profile.json')))
+
+            # The persisted profile answers again without reading the working copy
+            dataset_cache.clear()
+            blob_cache.clear()
+            job_id = self.client.post('/transform', json={'command': 'describe A'},
+                                      headers={'Authorization': f'Bearer {token}'}).get_json()['job_id']
+            job = job_queue.wait(job_id, timeout=10)
+            self.assertEqual(job['status_code'], 200)
+            self.assertNotIn('B (', job['result']['message'])
+            self.assertEqual(job['metrics']['storage_calls'], {'download': 1})
+
+            # A pending plan is applied before profiling
+            self.run_command(token, 'filter rows where A < 5')
+            status_code, body = self.run_command(token, 'describe A')
+            self.assertIn('Rows: 3', body['message'])
+            status_code, body = self.run_command(token, 'describe Missing')
+            self.assertEqual(status_code, 400)
+
+    def test_blob_cache_reuses_current_generation(self):
+        client = LocalStorageClient(tempfile.mkdtemp())
+        for bucket_name in ('bucket-a', 'bucket-b'):
+            client.create_bucket(bucket_name)
+        source = os.path.join(tempfile.mkdtemp(), 'data.csv')
+        with open(source, 'w') as f:
+            f.write('col1\n1\n2\n')
+        cache = BlobCache(tempfile.mkdtemp(), max_bytes=20)
+
+        def read(bucket_name):
+            blob = client.bucket(bucket_name).get_blob('data.csv')
+            with cache.open(bucket_name, 'data.csv', blob) as path:
+                return path, open(path).read()
+
+        client.bucket('bucket-a').blob('data.csv').upload_from_filename(source)
+        first_path, first = read('bucket-a')
+        self.assertEqual(read('bucket-a'), (first_path, first))
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        # Same object name in another bucket gets its own file
+        client.bucket('bucket-b').blob('data.csv').upload_from_filename(source)
+        other_path, _ = read('bucket-b')
+        self.assertNotEqual(other_path, first_path)
+
+        # A rewrite is a new generation, downloaded again and replacing the old file
+        with open(source, 'w') as f:
+            f.write('col1\n3\n')
+        client.bucket('bucket-a').blob('data.csv').upload_from_filename(source)
+        new_path, content = read('bucket-a')
+        self.assertEqual(content, 'col1\n3\n')
+        self.assertFalse(os.path.exists(first_path))
+
+        # The old generation's file was dropped, so 9 + 7 bytes fit the budget
+        self.assertEqual(cache.stats()['misses'], 3)
+        self.assertEqual(cache.stats()['bytes'], 16)
+        self.assertEqual(cache.stats()['evictions'], 0)
+
+        client.bucket('bucket-b').blob('data.csv').upload_from_filename(source)
+        read('bucket-b')
+        self.assertEqual(cache.stats()['entries'], 2)
+        with open(source, 'w') as f:
+            f.write('col1\n' + '4\n' * 10)
+        client.bucket('bucket-a').blob('data.csv').upload_from_filename(source)
+        read('bucket-a')
+        # The 25-byte entry is kept even though it is over budget; the least recently used one goes
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_duckdb_engine_matches_pandas(self):
+        from app import apply_predefined_transformation
+
+        df = pd.DataFrame({'Name': ['a', 'b', 'c', 'd'], 'Age': [20, 30, None, 40]})
+        df.to_parquet('/tmp/engine-source.parquet', index=False)
+        engine = DuckDBEngine(threads=2)
+
+        for command in ('filter rows where Age > 25', 'remove column Name', 'rename column Age to Years'):
+            engine.transform_file('/tmp/engine-source.parquet', '/tmp/engine-target.parquet', [plan_step(command)], list(df.columns))
+            expected = apply_predefined_transformation(df, command).reset_index(drop=True)
+            pd.testing.assert_frame_equal(pd.read_parquet('/tmp/engine-target.parquet'), expected, check_dtype=False)
+
+        steps = [plan_step(command) for command in ('rename column Age to Years', 'filter rows where Years > 25', 'remove column Name')]
+        engine.transform_file('/tmp/engine-source.parquet', '/tmp/engine-target.parquet', steps, list(df.columns))
+        pd.testing.assert_frame_equal(
+            pd.read_parquet('/tmp/engine-target.parquet'), execute_plan(df, steps).reset_index(drop=True), check_dtype=False
+        )
+
+        with self.assertRaises(ValueError):
+            engine.transform_file('/tmp/engine-source.parquet', '/tmp/engine-target.parquet', [plan_step('remove column Missing')], list(df.columns))
+
+        # Conditions are compiled to SQL with pandas semantics instead of falling back
+        for condition in ('Name == "a"', 'Age != 30', 'not (Age > 25)', "Name like 'b%' or Age is null"):
+            steps = [plan_step(f'filter rows where {condition}')]
+            engine.transform_file('/tmp/engine-source.parquet', '/tmp/engine-target.parquet', steps, list(df.columns))
+            pd.testing.assert_frame_equal(
+                pd.read_parquet('/tmp/engine-target.parquet'), execute_plan(df, steps).reset_index(drop=True), check_dtype=False
+            )
+
+    def test_filter_conditions_compile_to_masks(self):
+        df = pd.DataFrame({'Name': ['ann', 'bob', 'cy', None], 'Age': [20, 30, None, 40], 'City': ['A', 'B', 'A', 'C']})
+        expected = {
+            'Age > 25': [1, 3],
+            'Age != 30': [0, 2, 3],
+            '(Age >= 20) & (City == "A")': [0],
+            # `&` and `|` bind looser than comparisons, as in pandas `query`
+            'Age > 25 & Age < 50': [1, 3],
+            'Age < 25 | City == "C" && Name != "x | y"': [0, 3],
+            'City in ("A", "C") and not Age is null': [0, 3],
+            'Age between 25 and 40': [1, 3],
+            "Name like 'a%' or Name like '%o%'": [0, 1],
+            'Name is null or 40 <= Age': [3],
+        }
+        for condition, rows in expected.items():
+            result = execute_plan(df, [plan_step(f'filter rows where {condition}')])
+            self.assertEqual(list(result.index), rows, condition)
+
+        # Filters issued after a rename refer to the new name
+        steps = [plan_step('rename column Age to Years'), plan_step('filter rows where Years < 35')]
+        self.assertEqual(list(execute_plan(df, steps).index), [0, 1])
+
+        for condition in ("__import__('os').system('ls')", 'Age.sum() > 1', 'Missing > 1', 'Age > "old"'):
+            with self.assertRaises(ValueError):
+                execute_plan(df, [plan_step(f'filter rows where {condition}')])
+
+        self.assertIs(parse_condition('Age  >   25'), parse_condition('Age > 25'))
+
+        # Columns whose names are SQL keywords can still be referenced
+        keys = pd.DataFrame({'Key': [1, 2, 3], 'Replace': ['a', 'b', 'c']})
+        steps = [plan_step('filter rows where Key >= 2 & Replace != "c"')]
+        self.assertEqual(list(execute_plan(keys, steps).index), [1])
+
+    def test_streaming_plan_matches_in_memory_plan(self):
+        df = pd.DataFrame({'Name': [f'n{i}' for i in range(1000)], 'Age': [i % 90 for i in range(1000)]})
+        source = BytesIO()
+        df.to_parquet(source, index=False, row_group_size=100)
+        steps = [plan_step(command) for command in ('filter rows where Age > 50', 'rename column Name to Who')]
+
+        # Write-only sink, like the GCS resumable upload writer
+        class Sink(BytesIO):
+            def seek(self, *args):
+                raise OSError("not seekable")
+
+            def seekable(self):
+                return False
+
+        target = Sink()
+        schema, rows, _ = stream_plan(source, target, steps, batch_rows=64)
+
+        expected = execute_plan(df, steps).reset_index(drop=True)
+        self.assertEqual(rows, len(expected))
+        self.assertEqual(schema.names, ['Who', 'Age'])
+        pd.testing.assert_frame_equal(pd.read_parquet(BytesIO(target.getvalue())), expected, check_dtype=False)
+
+        csv_target = BytesIO()
+        stream_export(BytesIO(target.getvalue()), csv_target, batch_rows=64)
+        pd.testing.assert_frame_equal(pd.read_csv(BytesIO(csv_target.getvalue())), expected, check_dtype=False)
+
+    def test_job_queue_keeps_per_user_order(self):
+        queue = JobQueue(workers=4)
+        order = []
+
+        def record(user, index):
+            time.sleep(0.01)
+            order.append((user, index))
+            return {"index": index}, 200
+
+        job_ids = [queue.submit(user, "record", record, user, index) for index in range(5) for user in ('a', 'b')]
+        for job_id in job_ids:
+            job = queue.wait(job_id, timeout=10)
+            self.assertEqual(job['status'], 'succeeded')
+            self.assertIsNotNone(job['timing']['run_seconds'])
+
+        for user in ('a', 'b'):
+            self.assertEqual([index for key, index in order if key == user], list(range(5)))
+
+    def test_job_status_is_private_to_its_user(self):
+        job_id = job_queue.submit('someone-else', 'columns', lambda: ({"message": "ok"}, 200))
+        job_queue.wait(job_id, timeout=10)
+
+        mock_token = jwt.encode({'user_id': 'test-id'}, app.secret_key, algorithm='HS256')
+        response = self.client.get(f'/jobs/{job_id}', headers={'Authorization': f'Bearer {mock_token}'})
+        self.assertEqual(response.status_code, 404)
 
     def test_invalid_route(self):
         response = self.client.get("/nonexistent")